@@ -38,7 +38,9 @@ def create_app():
     db_path = os.path.abspath(
         os.path.join(os.path.dirname(os.path.dirname(__file__)), "app.db")
     )
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv(
+        "SQLALCHEMY_DATABASE_URI", f"sqlite:///{db_path}"
+    )
     db_dir = os.path.dirname(db_path)
     if not os.path.exists(db_dir):
         os.makedirs(db_dir, exist_ok=True)
@@ -74,10 +76,14 @@ def create_app():
     ticket_folder = os.path.abspath(ticket_folder)
     app.config["UPLOAD_FOLDER"] = upload_folder
     app.config["TICKET_FILES_FOLDER"] = ticket_folder
+    app.config["DATA_FOLDER"] = os.path.abspath(
+        os.getenv("DATA_FOLDER", app.instance_path)
+    )
     app.logger.info(f"APP_ROOT: {app_root}")
     app.logger.info(f"STATIC_FOLDER: {static_folder_path}")
     app.logger.info(f"UPLOAD_FOLDER: {upload_folder}")
     app.logger.info(f"TICKET_FILES_FOLDER: {ticket_folder}")
+    app.logger.info(f"DATA_FOLDER: {app.config['DATA_FOLDER']}")
     app.logger.info(f"UPLOAD_FOLDER exists: {os.path.exists(upload_folder)}")
     if os.path.exists(upload_folder):
         app.logger.info(f"UPLOAD_FOLDER contents: {os.listdir(upload_folder)}")
@@ -87,7 +93,41 @@ def create_app():
         f"MAX_CONTENT_LENGTH установлен: {max_content_length} байт "
         f"({max_content_length / (1024 * 1024):.1f} MB)"
     )
-    for folder in [app.config["UPLOAD_FOLDER"]]:
+    app.config["FILE_OFFLOAD_MODE"] = os.getenv("FILE_OFFLOAD_MODE", "").lower()
+    app.config["FILE_OFFLOAD_PREFIX"] = os.getenv(
+        "FILE_OFFLOAD_PREFIX", "/protected-uploads"
+    )
+    app.config["UPLOAD_SESSION_TTL_HOURS"] = int(
+        os.getenv("UPLOAD_SESSION_TTL_HOURS", 24)
+    )
+    app.config["JOB_CONCURRENCY"] = {
+        "optimize_file": int(os.getenv("OPTIMIZE_FILE_CONCURRENCY", 2)),
+        "export_solutions": int(os.getenv("EXPORT_JOB_CONCURRENCY", 1)),
+    }
+    app.config["JOB_INTERVALS"] = {
+        "expire_subscriptions": int(
+            os.getenv("SUBSCRIPTION_SWEEP_INTERVAL_SECONDS", 300)
+        ),
+        "process_payment_webhooks": int(
+            os.getenv("PAYMENT_WEBHOOK_SWEEP_SECONDS", 60)
+        ),
+        "reconcile_payments": int(
+            os.getenv("PAYMENT_RECONCILE_INTERVAL_SECONDS", 900)
+        ),
+    }
+    app.config["EXPORT_READ_WORKERS"] = int(os.getenv("EXPORT_READ_WORKERS", 4))
+    app.config["EXPORT_CACHE_MAX_BYTES"] = int(
+        os.getenv("EXPORT_CACHE_MAX_BYTES", 1024**3)
+    )
+    app.config["EXPORT_CACHE_MAX_AGE_HOURS"] = int(
+        os.getenv("EXPORT_CACHE_MAX_AGE_HOURS", 24)
+    )
+    app.config["EXPORT_LINK_TTL_HOURS"] = int(os.getenv("EXPORT_LINK_TTL_HOURS", 24))
+    app.config["FRAGMENT_CACHE_MAX_ENTRIES"] = int(
+        os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", 512)
+    )
+    app.config["FRAGMENT_CACHE_REDIS_URL"] = os.getenv("FRAGMENT_CACHE_REDIS_URL", "")
+    for folder in [app.config["UPLOAD_FOLDER"], app.config["DATA_FOLDER"]]:
         if not os.path.exists(folder):
             os.makedirs(folder, exist_ok=True)
     app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER", "smtp.gmail.com")
@@ -109,6 +149,30 @@ def create_app():
     app.config["YOOKASSA_TEST_MODE"] = (
         os.getenv("YOOKASSA_TEST_MODE", "True").lower() == "true"
     )
+    app.config["YOOKASSA_API_URL"] = os.getenv(
+        "YOOKASSA_API_URL", "https://api.yookassa.ru/v3"
+    )
+    app.config["YOOKASSA_CONNECT_TIMEOUT"] = float(
+        os.getenv("YOOKASSA_CONNECT_TIMEOUT", 3.05)
+    )
+    app.config["YOOKASSA_READ_TIMEOUT"] = float(os.getenv("YOOKASSA_READ_TIMEOUT", 15))
+    app.config["YOOKASSA_MAX_RETRIES"] = int(os.getenv("YOOKASSA_MAX_RETRIES", 2))
+    app.config["YOOKASSA_POOL_SIZE"] = int(os.getenv("YOOKASSA_POOL_SIZE", 10))
+    app.config["YOOKASSA_BREAKER_THRESHOLD"] = int(
+        os.getenv("YOOKASSA_BREAKER_THRESHOLD", 5)
+    )
+    app.config["YOOKASSA_BREAKER_COOLDOWN"] = float(
+        os.getenv("YOOKASSA_BREAKER_COOLDOWN", 30)
+    )
+    app.config["PAYMENT_STATUS_CACHE_SECONDS"] = int(
+        os.getenv("PAYMENT_STATUS_CACHE_SECONDS", 5)
+    )
+    app.config["PAYMENT_RECONCILE_AFTER_MINUTES"] = int(
+        os.getenv("PAYMENT_RECONCILE_AFTER_MINUTES", 15)
+    )
+    app.config["PAYMENT_RECONCILE_MAX_AGE_DAYS"] = int(
+        os.getenv("PAYMENT_RECONCILE_MAX_AGE_DAYS", 7)
+    )
     app.config["SUBSCRIPTION_PRICES"] = {
         "1": float(os.getenv("SUBSCRIPTION_PRICE_1", 89.00)),
         "3": float(os.getenv("SUBSCRIPTION_PRICE_3", 199.00)),
@@ -135,7 +199,9 @@ def create_app():
 
     app_logger.info(f"UPLOAD_FOLDER: {upload_folder}")
     app_logger.info(f"TICKET_FILES_FOLDER: {ticket_folder}")
-    app_logger.info(f"DATABASE_URI: {os.path.basename(db_path)}")
+    app_logger.info(
+        f"DATABASE_URI: {os.path.basename(app.config['SQLALCHEMY_DATABASE_URI'])}"
+    )
     app_logger.info(f"MAX_CONTENT_LENGTH: {max_content_length / (1024 * 1024):.1f} MB")
 
     @app.after_request
@@ -168,9 +234,11 @@ def create_app():
     csrf.init_app(app)
     minify = Minify()
     minify.init_app(app)
+    from .views.payment import payment_webhook
     from .views.telegram_auth import telegram_login
 
     csrf.exempt(telegram_login)
+    csrf.exempt(payment_webhook)
     login_manager.login_view = "auth.login"
     login_manager.login_message = (
         "Пожалуйста, войдите в систему для доступа к этой странице."
@@ -215,6 +283,9 @@ def create_app():
     app.jinja_env.filters["extract_filename"] = extract_filename
     app.jinja_env.filters["extract_user_id_from_path"] = extract_user_id_from_path
     app.jinja_env.filters["mask_email"] = mask_email
+    from .utils.fragment_cache import FragmentCacheExtension
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
 
     @app.context_processor
     def inject_maintenance_mode():
@@ -49,6 +49,7 @@ class User(UserMixin, db.Model):
     is_manual_subscription = db.Column(db.Boolean, default=False)
     is_trial_subscription = db.Column(db.Boolean, default=False)
     trial_subscription_expires = db.Column(db.DateTime)
+    effective_subscription_expires = db.Column(db.DateTime, index=True)
     is_verified = db.Column(db.Boolean, default=False)
     group_id = db.Column(db.Integer, db.ForeignKey("group.id"), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -68,6 +69,9 @@ class User(UserMixin, db.Model):
     notifications = db.relationship(
         "Notification", backref="user", lazy=True, cascade="all, delete-orphan"
     )
+    upload_sessions = db.relationship(
+        "UploadSession", backref="user", lazy=True, cascade="all, delete-orphan"
+    )
 
     def is_effective_admin(self):
         return self.is_admin and self.admin_mode_enabled
@@ -79,42 +83,27 @@ class User(UserMixin, db.Model):
         return self.is_admin and self.admin_mode_enabled
 
     def get_accessible_subjects(self):
-        from .models import Subject, SubjectGroup
-
-        if self.can_see_all_subjects():
-            return Subject.query.all()
-        elif self.group_id:
-            return (
-                Subject.query.join(SubjectGroup)
-                .filter(SubjectGroup.group_id == self.group_id)
-                .all()
-            )
-        else:
-            return []
+        from .services.user_management_service import UserManagementService
+
+        return UserManagementService.get_accessible_subjects(self)
+
+    def can_access_subject(self, subject_id):
+        from .services.user_management_service import UserManagementService
+
+        return UserManagementService.can_access_subject(self, subject_id)
 
     def can_add_materials_to_subject(self, subject):
-        if self.is_admin and self.admin_mode_enabled:
-            return True
-        elif self.is_moderator and self.group_id:
-            from .models import SubjectGroup
-
-            return (
-                SubjectGroup.query.filter_by(
-                    subject_id=subject.id, group_id=self.group_id
-                ).first()
-                is not None
-            )
-        else:
-            return False
+        from .services.user_management_service import UserManagementService
+
+        return UserManagementService.can_add_materials_to_subject(self, subject)
 
     def can_manage_subject_materials(self, subject):
         return self.can_add_materials_to_subject(subject)
 
     def has_active_subscription(self):
-        from .utils.payment_service import YooKassaService
+        from .utils.subscription_state import SubscriptionState
 
-        payment_service = YooKassaService()
-        return payment_service.check_user_subscription(self)
+        return SubscriptionState.is_active(self)
 
     def get_role_display(self):
         if self.is_admin:
@@ -267,6 +256,67 @@ class Submission(db.Model):
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class FileLocation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    relative_path = db.Column(db.String(512), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    size = db.Column(db.BigInteger)
+    sha256 = db.Column(db.String(64), index=True)
+    modified_at = db.Column(db.DateTime)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+    __table_args__ = (db.Index("ix_file_location_lookup", "subject_id", "filename"),)
+
+    def __repr__(self) -> str:
+        return f"<FileLocation {self.subject_id}/{self.filename} -> {self.relative_path}>"
+
+
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    offset = db.Column(db.BigInteger, default=0, nullable=False)
+    sha256 = db.Column(db.String(64))
+    status = db.Column(db.String(20), default="uploading", nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<UploadSession {self.id}: {self.filename} {self.offset}/{self.size}>"
+
+
+class BackgroundJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(20), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    progress = db.Column(db.Integer, default=0, nullable=False)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+    __table_args__ = (
+        db.Index("ix_background_job_queue", "status", "kind", "run_after"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<BackgroundJob {self.id}: {self.kind} {self.status}>"
+
+
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -284,6 +334,25 @@ class Payment(db.Model):
         return f"<Payment {self.yookassa_payment_id}: {self.status}>"
 
 
+class PaymentWebhookEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(64), nullable=False)
+    payment_id = db.Column(db.String(255), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+    __table_args__ = (
+        db.UniqueConstraint("event", "payment_id", name="uq_payment_webhook_event"),
+        db.Index("ix_payment_webhook_event_queue", "status", "payment_id"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<PaymentWebhookEvent {self.event} {self.payment_id}: {self.status}>"
+
+
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -3,6 +3,7 @@ from .material_service import MaterialService
 from .payment_service import PaymentService
 from .subject_service import SubjectService
 from .ticket_service import TicketService
+from .upload_service import UploadService
 from .user_management_service import GroupManagementService, UserManagementService
 from .user_service import UserService
 
@@ -15,4 +16,5 @@ __all__ = [
     "GroupManagementService",
     "TicketService",
     "PaymentService",
+    "UploadService",
 ]
@@ -1,20 +1,48 @@
+import csv
+import io
+import itertools
+import json
 import os
-import tempfile
-import zipfile
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 
-from ..models import Material, Subject, Submission
+from .. import db
+from ..models import (
+    BackgroundJob,
+    Material,
+    Notification,
+    Subject,
+    SubjectGroup,
+    Submission,
+    User,
+)
+from ..utils.export_cache import ExportCache
+from ..utils.job_queue import JobQueue
+from ..utils.zip_stream import ZipEntry, ZipStream
+
+EXPORT_SOLUTIONS_JOB = "export_solutions"
 
 
 class ExportService:
+    MAX_FOLDER_NAME_LENGTH = 100
+
     @staticmethod
-    def clean_folder_name(name: str) -> str:
+    def clean_folder_name(name: str, item_id: Optional[int] = None) -> str:
+        """
+        Имя папки в архиве из названия предмета, задания или пользователя
+
+        Длинное название обрезается до MAX_FOLDER_NAME_LENGTH символов. С
+        item_id к имени добавляется _<id>, чтобы одноименные объекты не
+        попадали в одну папку.
+        """
         if not name:
-            return "Без_названия"
+            name = "Без_названия"
 
         name = name.strip()
 
@@ -28,60 +56,377 @@ class ExportService:
         if " " in name:
             name = "_".join(name.split())
 
-        name = name.strip("_")
+        name = name.strip("_") or "Предмет"
+        suffix = f"_{item_id}" if item_id is not None else ""
+        name = name[: ExportService.MAX_FOLDER_NAME_LENGTH - len(suffix)].rstrip("_")
+        return f"{name}{suffix}"
 
-        if not name or len(name) > 100:
-            return "Предмет"
-        return name
+    @staticmethod
+    def _unique_archive_path(archive_path: str, used_paths: Set[str]) -> str:
+        """Добавляет к имени файла _2, _3..., если такой путь в архиве уже занят"""
+        root, extension = os.path.splitext(archive_path)
+        candidate = archive_path
+        counter = 2
+        while candidate in used_paths:
+            candidate = f"{root}_{counter}{extension}"
+            counter += 1
+        used_paths.add(candidate)
+        return candidate
 
     @staticmethod
-    def export_user_solutions(user_id: int, username: str) -> Optional[str]:
-        submissions = Submission.query.filter_by(user_id=user_id).all()
+    def collect_user_solutions(user_id: int) -> Optional[Dict]:
+        """
+        Собирает файлы решений пользователя, сгруппированные по предметам
+
+        Returns:
+            Optional[Dict]: {subject_id: {"subject", "files"}} или None,
+            если у пользователя нет решений
+        """
+        submissions = (
+            Submission.query.filter_by(user_id=user_id)
+            .options(joinedload(Submission.material).joinedload(Material.subject))
+            .order_by(Submission.id)
+            .all()
+        )
         if not submissions:
             return None
-        temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-        temp_zip.close()
         upload_folder = current_app.config.get("UPLOAD_FOLDER", "app/static/uploads")
-        with zipfile.ZipFile(temp_zip.name, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            subjects_dict = {}
-            for submission in submissions:
-                if not submission.file:
-                    continue
-                material = Material.query.get(submission.material_id)
-                if not material:
-                    continue
-                subject = Subject.query.get(material.subject_id)
-                if not subject:
-                    continue
-                if subject.id not in subjects_dict:
-                    subjects_dict[subject.id] = {"subject": subject, "files": []}
-                file_path = os.path.join(upload_folder, submission.file)
-                if os.path.exists(file_path):
-                    safe_filename = secure_filename(os.path.basename(submission.file))
-                    subject_name = ExportService.clean_folder_name(subject.title)
-                    archive_path = os.path.join(subject_name, safe_filename)
-                    subjects_dict[subject.id]["files"].append(
-                        {
-                            "file_path": file_path,
-                            "archive_path": archive_path,
-                            "material_title": material.title,
-                        }
+        directory_listings: Dict[str, Dict[str, os.DirEntry]] = {}
+        used_paths: Set[str] = set()
+        subjects_dict = {}
+        for submission in submissions:
+            if not submission.file:
+                continue
+            material = submission.material
+            if not material:
+                continue
+            subject = material.subject
+            if not subject:
+                continue
+            if subject.id not in subjects_dict:
+                subjects_dict[subject.id] = {"subject": subject, "files": []}
+            file_path = os.path.join(upload_folder, submission.file)
+            dir_entry = ExportService._find_file(file_path, directory_listings)
+            if dir_entry:
+                safe_filename = secure_filename(os.path.basename(submission.file))
+                subject_name = ExportService.clean_folder_name(subject.title)
+                archive_path = ExportService._unique_archive_path(
+                    os.path.join(subject_name, safe_filename), used_paths
+                )
+                stat = dir_entry.stat()
+                subjects_dict[subject.id]["files"].append(
+                    {
+                        "file_path": file_path,
+                        "archive_path": archive_path,
+                        "material_title": material.title,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                    }
+                )
+        return subjects_dict
+
+    @staticmethod
+    def _find_file(
+        file_path: str, directory_listings: Dict[str, Dict[str, os.DirEntry]]
+    ) -> Optional[os.DirEntry]:
+        """
+        Ищет файл по одному os.scandir на каталог
+
+        Решения пользователя лежат в нескольких каталогах, поэтому каждый
+        из них читается один раз, а не os.path.exists на каждый файл.
+        """
+        directory, filename = os.path.split(file_path)
+        if directory not in directory_listings:
+            try:
+                with os.scandir(directory) as entries:
+                    directory_listings[directory] = {
+                        entry.name: entry for entry in entries if entry.is_file()
+                    }
+            except OSError:
+                directory_listings[directory] = {}
+        return directory_listings[directory].get(filename)
+
+    @staticmethod
+    def build_solutions_archive(
+        user_id: int,
+        username: str,
+        subjects_dict: Dict,
+        fingerprint: str,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Iterator[bytes]:
+        """Архив из кэша или новый, который кэшируется по ходу сборки"""
+        cached = ExportCache.open(user_id, fingerprint)
+        if cached is not None:
+            return cached
+        entries = [
+            ZipEntry(file_info["archive_path"], path=file_info["file_path"])
+            for subject_data in subjects_dict.values()
+            for file_info in subject_data["files"]
+        ]
+        readme_content = ExportService._generate_readme_content(
+            username, subjects_dict
+        )
+        entries.append(ZipEntry("README.txt", data=readme_content.encode("utf-8")))
+        if on_progress is not None:
+            entries = ExportService._track_progress(entries, on_progress)
+        return ExportCache.store(user_id, fingerprint, ZipStream.generate(entries))
+
+    @staticmethod
+    def _track_progress(
+        entries: List[ZipEntry], on_progress: Callable[[int, int], None]
+    ) -> Iterator[ZipEntry]:
+        for done, entry in enumerate(entries):
+            on_progress(done, len(entries))
+            yield entry
+        on_progress(len(entries), len(entries))
+
+    @staticmethod
+    def find_solutions_export_job(user_id: int) -> Optional[BackgroundJob]:
+        """Незавершенная задача экспорта решений пользователя"""
+        return (
+            BackgroundJob.query.filter(
+                BackgroundJob.kind == EXPORT_SOLUTIONS_JOB,
+                BackgroundJob.status.in_(
+                    [JobQueue.STATUS_PENDING, JobQueue.STATUS_RUNNING]
+                ),
+                BackgroundJob.payload == json.dumps({"user_id": user_id}),
+            )
+            .order_by(BackgroundJob.id.desc())
+            .first()
+        )
+
+    @staticmethod
+    def get_solutions_export_job(job_id: int, user_id: int) -> Optional[BackgroundJob]:
+        job = db.session.get(BackgroundJob, job_id)
+        if job is None or job.kind != EXPORT_SOLUTIONS_JOB:
+            return None
+        if JobQueue.get_payload(job).get("user_id") != user_id:
+            return None
+        return job
+
+    @staticmethod
+    def request_solutions_export(
+        user_id: int, username: str
+    ) -> Tuple[Optional[str], Optional[BackgroundJob]]:
+        """
+        Запрашивает архив решений без сборки в HTTP-запросе
+
+        Returns:
+            Tuple[Optional[str], Optional[BackgroundJob]]: ссылка на готовый
+            архив из кэша, либо задача, которая его соберет; (None, None),
+            если решений нет
+        """
+        subjects_dict = ExportService.collect_user_solutions(user_id)
+        if subjects_dict is None:
+            return None, None
+        fingerprint = ExportService.get_solutions_fingerprint(
+            user_id, username, subjects_dict
+        )
+        if ExportCache.find(user_id, fingerprint):
+            return ExportService.get_download_link(user_id, fingerprint), None
+        job = ExportService.find_solutions_export_job(user_id)
+        if job is None:
+            job = JobQueue.enqueue(
+                EXPORT_SOLUTIONS_JOB, {"user_id": user_id}, max_attempts=2
+            )
+        return None, job
+
+    @staticmethod
+    def run_solutions_export_job(payload: dict, job: BackgroundJob) -> Optional[dict]:
+        """
+        Фоновая сборка архива решений
+
+        Прогресс пишется в задачу по мере добавления файлов в архив. Готовый
+        архив остается в ExportCache, а пользователь получает уведомление
+        со ссылкой на скачивание, которая действует EXPORT_LINK_TTL_HOURS.
+        """
+        user = db.session.get(User, payload["user_id"])
+        if user is None:
+            return None
+        subjects_dict = ExportService.collect_user_solutions(user.id)
+        if subjects_dict is None:
+            return None
+        fingerprint = ExportService.get_solutions_fingerprint(
+            user.id, user.username, subjects_dict
+        )
+        if not ExportCache.find(user.id, fingerprint):
+
+            def on_progress(done: int, total: int) -> None:
+                progress = done * 99 // total
+                if progress - job.progress >= 5:
+                    JobQueue.set_progress(job, progress)
+
+            for _ in ExportService.build_solutions_archive(
+                user.id, user.username, subjects_dict, fingerprint, on_progress
+            ):
+                pass
+            if not ExportCache.find(user.id, fingerprint):
+                raise RuntimeError("Архив не сохранен в кэш экспорта")
+        link = ExportService.get_download_link(user.id, fingerprint)
+        db.session.add(
+            Notification(
+                user_id=user.id,
+                title="Архив решений готов",
+                message="Архив ваших решений собран и доступен для скачивания",
+                type="success",
+                link=link,
+            )
+        )
+        return {"fingerprint": fingerprint, "download_url": link}
+
+    @staticmethod
+    def _get_link_serializer() -> URLSafeTimedSerializer:
+        return URLSafeTimedSerializer(
+            current_app.config["SECRET_KEY"], salt="export-download"
+        )
+
+    @staticmethod
+    def get_download_link(user_id: int, fingerprint: str) -> str:
+        token = ExportService._get_link_serializer().dumps(
+            {"user_id": user_id, "fingerprint": fingerprint}
+        )
+        return f"/export-solutions/download/{token}"
+
+    @staticmethod
+    def load_download_token(token: str, user_id: int) -> Optional[str]:
+        """Путь к архиву по ссылке или None, если ссылка истекла или чужая"""
+        max_age = current_app.config.get("EXPORT_LINK_TTL_HOURS", 24) * 3600
+        try:
+            data = ExportService._get_link_serializer().loads(token, max_age=max_age)
+        except BadSignature:
+            return None
+        if data.get("user_id") != user_id:
+            return None
+        return ExportCache.find(user_id, data.get("fingerprint", ""))
+
+    @staticmethod
+    def get_solutions_fingerprint(
+        user_id: int, username: str, subjects_dict: Dict
+    ) -> str:
+        """Отпечаток состояния решений: число, последняя сдача, mtime и размер файлов"""
+        count, last_submitted_at = (
+            db.session.query(func.count(Submission.id), func.max(Submission.submitted_at))
+            .filter(Submission.user_id == user_id)
+            .one()
+        )
+        files = sorted(
+            (file_info["archive_path"], file_info["mtime_ns"], file_info["size"])
+            for subject_data in subjects_dict.values()
+            for file_info in subject_data["files"]
+        )
+        return ExportCache.fingerprint([username, count, last_submitted_at, *files])
+
+    @staticmethod
+    def collect_submissions(
+        subject: Subject, material: Optional[Material] = None
+    ) -> Tuple[List[ZipEntry], List[List[str]]]:
+        """
+        Собирает решения всех студентов по предмету или одному заданию
+
+        Ожидаемые студенты - участники групп, которым открыт предмет (без
+        администраторов). Файлы в архиве раскладываются по пользователям:
+        <пользователь>/<задание>/<файл>, при выгрузке одного задания -
+        <пользователь>/<файл>.
+
+        Returns:
+            Tuple[List[ZipEntry], List[List[str]]]: записи архива и строки
+            манифеста (задание, пользователь, статус, время сдачи, путь)
+        """
+        if material is not None:
+            materials = [material]
+        else:
+            materials = (
+                Material.query.filter_by(subject_id=subject.id, type="assignment")
+                .order_by(Material.id)
+                .all()
+            )
+        material_ids = [item.id for item in materials]
+        submissions = (
+            Submission.query.filter(Submission.material_id.in_(material_ids))
+            .options(joinedload(Submission.user))
+            .order_by(Submission.id)
+            .all()
+            if material_ids
+            else []
+        )
+        expected_users = (
+            User.query.join(SubjectGroup, SubjectGroup.group_id == User.group_id)
+            .filter(SubjectGroup.subject_id == subject.id, User.is_admin.is_(False))
+            .order_by(User.username)
+            .all()
+        )
+        submitted = {
+            (submission.material_id, submission.user_id): submission
+            for submission in submissions
+        }
+        users = {user.id: user for user in expected_users}
+        for submission in submissions:
+            if submission.user:
+                users.setdefault(submission.user_id, submission.user)
+
+        upload_folder = current_app.config.get("UPLOAD_FOLDER", "app/static/uploads")
+        directory_listings: Dict[str, Dict[str, os.DirEntry]] = {}
+        entries: List[ZipEntry] = []
+        manifest: List[List[str]] = []
+        used_paths: Set[str] = set()
+        for item in materials:
+            material_folder = ExportService.clean_folder_name(item.title, item.id)
+            for user in sorted(users.values(), key=lambda user: user.username):
+                submission = submitted.get((item.id, user.id))
+                user_folder = ExportService.clean_folder_name(user.username)
+                if submission is None or not submission.file:
+                    status, submitted_at, archive_path = "не сдано", "", ""
+                    if submission is not None:
+                        status = "текст без файла"
+                else:
+                    submitted_at = (
+                        submission.submitted_at.strftime("%d.%m.%Y %H:%M")
+                        if submission.submitted_at
+                        else ""
                     )
-            for subject_data in subjects_dict.values():
-                for file_info in subject_data["files"]:
-                    try:
-                        zip_file.write(
-                            file_info["file_path"], file_info["archive_path"]
+                    file_path = os.path.join(upload_folder, submission.file)
+                    safe_filename = secure_filename(os.path.basename(submission.file))
+                    if material is not None:
+                        archive_path = os.path.join(user_folder, safe_filename)
+                    else:
+                        archive_path = os.path.join(
+                            user_folder, material_folder, safe_filename
                         )
-                    except Exception as e:
-                        current_app.logger.error(
-                            f"Error adding file {file_info['file_path']} to archive: {e}"
+                    if ExportService._find_file(file_path, directory_listings):
+                        status = "сдано"
+                        archive_path = ExportService._unique_archive_path(
+                            archive_path, used_paths
                         )
-            readme_content = ExportService._generate_readme_content(
-                username, subjects_dict
-            )
-            zip_file.writestr("README.txt", readme_content.encode("utf-8"))
-        return temp_zip.name
+                        entries.append(ZipEntry(archive_path, path=file_path))
+                    else:
+                        status, archive_path = "файл отсутствует", ""
+                manifest.append(
+                    [item.title, user.username, status, submitted_at, archive_path]
+                )
+        return entries, manifest
+
+    @staticmethod
+    def export_submissions(
+        subject: Subject, material: Optional[Material] = None
+    ) -> Iterator[bytes]:
+        """
+        Потоковый ZIP-архив решений всех студентов для преподавателя
+
+        Файлы читаются заранее в ограниченном пуле потоков (EXPORT_READ_WORKERS),
+        в конец архива добавляется MANIFEST.csv со сданными и несданными работами.
+        """
+        entries, manifest = ExportService.collect_submissions(subject, material)
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["Задание", "Пользователь", "Статус", "Сдано", "Файл в архиве"])
+        writer.writerows(manifest)
+        manifest_entry = ZipEntry(
+            "MANIFEST.csv", data=output.getvalue().encode("utf-8-sig")
+        )
+        workers = current_app.config.get("EXPORT_READ_WORKERS", 4)
+        return ZipStream.generate(
+            itertools.chain(ZipStream.prefetch(entries, workers), [manifest_entry])
+        )
 
     @staticmethod
     def _generate_readme_content(username: str, subjects_dict: Dict) -> str:
@@ -96,3 +441,8 @@ class ExportService:
             for file_info in subject_data["files"]:
                 content += f"  - {file_info['material_title']} ({os.path.basename(file_info['archive_path'])})\n"
         return content
+
+
+JobQueue.register(
+    EXPORT_SOLUTIONS_JOB, ExportService.run_solutions_export_job, concurrency=1
+)
@@ -1,26 +1,57 @@
-import os
 from datetime import datetime
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 from flask import current_app
-from sqlalchemy.orm import selectinload
+from sqlalchemy import func
 
 from .. import db
 from ..models import Material, Submission, Subject
+from ..utils.export_cache import ExportCache
 from ..utils.file_storage import FileStorageManager
 from ..utils.transliteration import get_safe_filename
+from .upload_service import UploadService
 
 
 class MaterialService:
     @staticmethod
     def get_subject_materials(subject_id: int) -> Tuple[List[Material], List[Material]]:
         lectures = Material.query.filter_by(subject_id=subject_id, type="lecture").all()
-        assignments = (
-            Material.query.options(selectinload(Material.submissions))
-            .filter_by(subject_id=subject_id, type="assignment")
+        assignments = Material.query.filter_by(
+            subject_id=subject_id, type="assignment"
+        ).all()
+        return lectures, assignments
+
+    @staticmethod
+    def get_user_submissions(
+        user_id: int, material_ids: List[int]
+    ) -> Dict[int, Submission]:
+        """Решения с файлом одного пользователя: {material_id: Submission}"""
+        if not material_ids:
+            return {}
+        submissions = Submission.query.filter(
+            Submission.user_id == user_id,
+            Submission.material_id.in_(material_ids),
+            Submission.file.isnot(None),
+            Submission.file != "",
+        ).all()
+        return {submission.material_id: submission for submission in submissions}
+
+    @staticmethod
+    def get_submission_counts(material_ids: List[int]) -> Dict[int, int]:
+        """Число сданных решений по каждому заданию одним агрегирующим запросом"""
+        if not material_ids:
+            return {}
+        rows = (
+            db.session.query(Submission.material_id, func.count(Submission.id))
+            .filter(
+                Submission.material_id.in_(material_ids),
+                Submission.file.isnot(None),
+                Submission.file != "",
+            )
+            .group_by(Submission.material_id)
             .all()
         )
-        return lectures, assignments
+        return dict(rows)
 
     @staticmethod
     def create_material(
@@ -31,16 +62,26 @@ class MaterialService:
         file_data=None,
         solution_file_data=None,
         created_by: Optional[int] = None,
+        file_upload_id: Optional[str] = None,
+        solution_upload_id: Optional[str] = None,
     ) -> Material:
         filename = None
         solution_filename = None
-        if file_data:
+        if file_upload_id:
+            filename = MaterialService._store_material_upload(
+                subject_id, file_upload_id, created_by
+            )
+        elif file_data:
             full_path, relative_path = FileStorageManager.get_material_upload_path(
                 subject_id, get_safe_filename(file_data.filename)
             )
             if FileStorageManager.save_file(file_data, full_path):
                 filename = relative_path
-        if solution_file_data and material_type == "assignment":
+        if solution_upload_id and material_type == "assignment":
+            solution_filename = MaterialService._store_material_upload(
+                subject_id, solution_upload_id, created_by
+            )
+        elif solution_file_data and material_type == "assignment":
             full_path, relative_path = FileStorageManager.get_material_upload_path(
                 subject_id, get_safe_filename(solution_file_data.filename)
             )
@@ -59,6 +100,24 @@ class MaterialService:
         db.session.commit()
         return material
 
+    @staticmethod
+    def _store_material_upload(
+        subject_id: int, upload_id: str, user_id: Optional[int]
+    ) -> Optional[str]:
+        """Переносит завершенную загрузку (UploadService) в папку материалов"""
+        upload = UploadService.get_completed_session(upload_id, user_id)
+        if not upload:
+            current_app.logger.warning(
+                f"Загрузка {upload_id} не найдена или не завершена"
+            )
+            return None
+        full_path, relative_path = FileStorageManager.get_material_upload_path(
+            subject_id, upload.filename
+        )
+        if UploadService.consume(upload, full_path):
+            return relative_path
+        return None
+
     @staticmethod
     def update_material(
         material_id: int, title: str, description: Optional[str]
@@ -83,13 +142,8 @@ class MaterialService:
                 "MAX_CONTENT_LENGTH", 500 * 1024 * 1024
             ):
                 return False
-        old_file_path = None
         if material.file:
-            old_file_path = os.path.join(
-                current_app.config["UPLOAD_FOLDER"], material.file
-            )
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
+            FileStorageManager.delete_file(material.file)
         full_path, relative_path = FileStorageManager.get_material_upload_path(
             material.subject_id, filename
         )
@@ -133,20 +187,37 @@ class MaterialService:
         db.session.commit()
 
     @staticmethod
-    def submit_solution(material: Material, user_id: int, file_data) -> bool:
+    def submit_solution(
+        material: Material,
+        user_id: int,
+        file_data=None,
+        upload_id: Optional[str] = None,
+    ) -> bool:
         if material.type != "assignment":
             return False
-        if not file_data or not file_data.filename:
-            return False
-        filename = get_safe_filename(file_data.filename)
-        if hasattr(file_data, "content_length") and file_data.content_length:
-            if file_data.content_length > current_app.config.get(
-                "MAX_CONTENT_LENGTH", 500 * 1024 * 1024
-            ):
+        if upload_id:
+            upload = UploadService.get_completed_session(upload_id, user_id)
+            if not upload:
+                return False
+            full_path, relative_path = FileStorageManager.get_subject_upload_path(
+                material.subject_id, user_id, upload.filename
+            )
+            if not UploadService.consume(upload, full_path):
+                return False
+        else:
+            if not file_data or not file_data.filename:
+                return False
+            filename = get_safe_filename(file_data.filename)
+            if hasattr(file_data, "content_length") and file_data.content_length:
+                if file_data.content_length > current_app.config.get(
+                    "MAX_CONTENT_LENGTH", 500 * 1024 * 1024
+                ):
+                    return False
+            full_path, relative_path = FileStorageManager.get_subject_upload_path(
+                material.subject_id, user_id, filename
+            )
+            if not FileStorageManager.save_file(file_data, full_path):
                 return False
-        full_path, relative_path = FileStorageManager.get_subject_upload_path(
-            material.subject_id, user_id, filename
-        )
         submission = Submission.query.filter_by(
             user_id=user_id, material_id=material.id
         ).first()
@@ -154,5 +225,7 @@ class MaterialService:
             submission = Submission(user_id=user_id, material_id=material.id)
             db.session.add(submission)
         submission.file = relative_path
+        submission.submitted_at = datetime.utcnow()
         db.session.commit()
+        ExportCache.invalidate(user_id)
         return True
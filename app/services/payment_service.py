@@ -1,8 +1,15 @@
+import json
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
 
 from .. import db
-from ..models import Payment, User
+from ..models import BackgroundJob, Payment, PaymentWebhookEvent, User
+from ..utils.job_queue import JobQueue
+
+PROCESS_WEBHOOKS_JOB = "process_payment_webhooks"
+RECONCILE_PAYMENTS_JOB = "reconcile_payments"
 
 
 class PaymentService:
@@ -58,6 +65,9 @@ class PaymentService:
             ).first()
             if not payment_record:
                 return False
+            if payment_record.status in (status, "succeeded", "canceled"):
+                db.session.commit()
+                return True
             payment_record.status = status
             payment_record.updated_at = datetime.utcnow()
             if status == "succeeded" and paid:
@@ -112,7 +122,6 @@ class PaymentService:
             user.subscription_expires = datetime.utcnow() + timedelta(
                 days=subscription_days
             )
-            db.session.commit()
             return True
         except Exception as e:
             from flask import current_app
@@ -129,7 +138,6 @@ class PaymentService:
                 return False
             user.is_subscribed = False
             user.subscription_expires = None
-            db.session.commit()
             return True
         except Exception as e:
             from flask import current_app
@@ -188,8 +196,8 @@ class PaymentService:
                     return False, "Платеж не принадлежит вам"
                 payment_record.status = "canceled"
                 payment_record.updated_at = datetime.utcnow()
-                db.session.commit()
                 PaymentService._deactivate_subscription_for_payment(payment_record)
+                db.session.commit()
                 return True, "Платеж отменен"
             else:
                 return False, "Платеж не найден"
@@ -209,3 +217,200 @@ class PaymentService:
             return current_app.config.get("SUBSCRIPTION_PRICES", {})
         except Exception:
             return {}
+
+    @staticmethod
+    def store_webhook(event: str, payment_id: str, payload: str) -> bool:
+        """
+        Сохраняет уведомление ЮKassa во входящую очередь
+
+        Возвращает False, если это событие платежа уже было сохранено
+        (повторная доставка). Применяет события задача PROCESS_WEBHOOKS_JOB.
+        """
+        from flask import current_app
+
+        db.session.add(
+            PaymentWebhookEvent(event=event, payment_id=payment_id, payload=payload)
+        )
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        try:
+            queued = BackgroundJob.query.filter(
+                BackgroundJob.kind == PROCESS_WEBHOOKS_JOB,
+                BackgroundJob.status == JobQueue.STATUS_PENDING,
+                BackgroundJob.run_after <= datetime.utcnow(),
+            ).first()
+            if not queued:
+                JobQueue.enqueue(PROCESS_WEBHOOKS_JOB, max_attempts=1)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(
+                f"Не удалось поставить обработку webhook в очередь: {str(e)}"
+            )
+        return True
+
+    @staticmethod
+    def process_webhook_inbox(max_attempts: int = 5) -> Dict[str, int]:
+        """
+        Применяет сохраненные уведомления в порядке поступления
+
+        События одного платежа применяются строго по очереди: после ошибки
+        остальные события этого платежа ждут следующего запуска. Событие,
+        не примененное за max_attempts попыток, помечается failed.
+        """
+        from flask import current_app
+
+        counts = {"processed": 0, "failed": 0, "deferred": 0}
+        blocked = set()
+        inbox = (
+            PaymentWebhookEvent.query.filter_by(status="pending")
+            .order_by(PaymentWebhookEvent.id)
+            .all()
+        )
+        for inbox_event in inbox:
+            if inbox_event.payment_id in blocked:
+                counts["deferred"] += 1
+                continue
+            payment_data = json.loads(inbox_event.payload).get("object") or {}
+            inbox_event.status = "processed"
+            inbox_event.processed_at = datetime.utcnow()
+            if PaymentService.process_payment_webhook(inbox_event.event, payment_data):
+                counts["processed"] += 1
+                continue
+            db.session.rollback()
+            inbox_event.attempts += 1
+            inbox_event.processed_at = None
+            inbox_event.error = "Платеж не найден или ошибка применения события"
+            if inbox_event.attempts >= max_attempts:
+                inbox_event.status = "failed"
+                counts["failed"] += 1
+                current_app.logger.error(
+                    f"Webhook {inbox_event.event} для платежа "
+                    f"{inbox_event.payment_id} не применен за {max_attempts} попыток"
+                )
+            else:
+                inbox_event.status = "pending"
+                blocked.add(inbox_event.payment_id)
+                counts["deferred"] += 1
+            db.session.commit()
+        return counts
+
+    @staticmethod
+    def reconcile_pending_payments(
+        stale_minutes: Optional[int] = None,
+        now: Optional[datetime] = None,
+        max_age_days: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Сверяет зависшие платежи со списком платежей ЮKassa
+
+        Платежи в статусе pending/waiting_for_capture старше stale_minutes,
+        но не старше max_age_days, запрашиваются не по одному, а списком за
+        их промежуток дат (постранично). Без нижней границы платеж, которого
+        нет в ЮKassa, навсегда сдвигал бы начало промежутка, и каждая сверка
+        листала бы всю историю магазина. Новые статусы и активации подписок
+        применяются одним commit. Возвращает отчет: сколько проверено, какие
+        статусы изменились, для каких платежей активирована подписка и какие
+        не найдены в ЮKassa.
+
+        В отличие от webhook, отмененный платеж подписку не снимает: сверяются
+        только платежи, которые еще не прошли, поэтому подписку дал не этот
+        платеж, а другой, уже успешный. Платные подписки без успешного
+        платежа сбрасывает задача expire_subscriptions.
+        """
+        from flask import current_app
+
+        from ..utils.payment_service import YooKassaService
+
+        now = now or datetime.utcnow()
+        if stale_minutes is None:
+            stale_minutes = current_app.config.get(
+                "PAYMENT_RECONCILE_AFTER_MINUTES", 15
+            )
+        if max_age_days is None:
+            max_age_days = current_app.config.get("PAYMENT_RECONCILE_MAX_AGE_DAYS", 7)
+        report: Dict[str, Any] = {
+            "checked": 0,
+            "updated": {},
+            "activated": [],
+            "missing": [],
+        }
+        stale = (
+            Payment.query.filter(
+                Payment.status.in_(["pending", "waiting_for_capture"]),
+                Payment.created_at <= now - timedelta(minutes=stale_minutes),
+                Payment.created_at >= now - timedelta(days=max_age_days),
+            )
+            .order_by(Payment.created_at)
+            .all()
+        )
+        report["checked"] = len(stale)
+        if not stale:
+            return report
+        payment_service = YooKassaService()
+        if payment_service.simulation_mode:
+            report["skipped"] = "Ключи ЮKassa не настроены"
+            return report
+        margin = timedelta(minutes=10)
+        listing = payment_service.list_payments(
+            stale[0].created_at - margin, stale[-1].created_at + margin
+        )
+        if "error" in listing:
+            report["error"] = listing["error"]
+            return report
+        remote = {item.get("id"): item for item in listing["items"]}
+        for payment_record in stale:
+            item = remote.get(payment_record.yookassa_payment_id)
+            if item is None:
+                report["missing"].append(payment_record.yookassa_payment_id)
+                continue
+            status = item.get("status", payment_record.status)
+            if status == payment_record.status:
+                continue
+            report["updated"][payment_record.yookassa_payment_id] = [
+                payment_record.status,
+                status,
+            ]
+            payment_record.status = status
+            payment_record.updated_at = now
+            if (
+                status == "succeeded"
+                and item.get("paid", True)
+                and PaymentService._activate_subscription_for_payment(payment_record)
+            ):
+                report["activated"].append(payment_record.yookassa_payment_id)
+        db.session.commit()
+        if report["updated"] or report["missing"]:
+            current_app.logger.info(
+                f"Сверка платежей: проверено {report['checked']}, "
+                f"изменено {len(report['updated'])}, "
+                f"активировано {len(report['activated'])}, "
+                f"не найдено {len(report['missing'])}"
+            )
+        return report
+
+    @staticmethod
+    def run_webhook_job(payload: Dict[str, Any], job: BackgroundJob) -> Dict[str, int]:
+        return PaymentService.process_webhook_inbox()
+
+    @staticmethod
+    def run_reconcile_job(
+        payload: Dict[str, Any], job: BackgroundJob
+    ) -> Dict[str, Any]:
+        report = PaymentService.reconcile_pending_payments()
+        if "error" in report:
+            raise RuntimeError(report["error"])
+        return report
+
+
+JobQueue.register(
+    PROCESS_WEBHOOKS_JOB, PaymentService.run_webhook_job, concurrency=1, interval=60
+)
+JobQueue.register(
+    RECONCILE_PAYMENTS_JOB,
+    PaymentService.run_reconcile_job,
+    concurrency=1,
+    interval=900,
+)
@@ -1,8 +1,30 @@
 import os
 import shutil
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import case, func
 
 from .. import db
-from ..models import Subject
+from ..models import Material, Subject, SubjectGroup, User
+from ..utils.blob_store import BlobStore
+from ..utils.file_index import FileIndex
+from .user_management_service import UserManagementService
+
+
+@dataclass
+class SubjectCard:
+    """Карточка предмета на главной странице: поля предмета и сводка по материалам"""
+
+    id: int
+    title: str
+    description: Optional[str]
+    pattern_type: Optional[str]
+    pattern_svg: Optional[str]
+    material_count: int
+    assignment_count: int
+    last_updated: Optional[datetime]
 
 
 class SubjectService:
@@ -49,6 +71,7 @@ class SubjectService:
         subject_path = os.path.join(upload_path, str(subject.id))
         if os.path.exists(subject_path):
             shutil.rmtree(subject_path)
+        BlobStore.release_all(FileIndex.forget_subject(subject.id))
         for material in subject.materials:
             db.session.delete(material)
         db.session.delete(subject)
@@ -57,3 +80,41 @@ class SubjectService:
     @staticmethod
     def get_subject_or_404(subject_id: int):
         return Subject.query.get_or_404(subject_id)
+
+    @staticmethod
+    def get_subject_cards(user: Optional[User] = None) -> List[SubjectCard]:
+        """
+        Карточки доступных пользователю предметов одним агрегирующим запросом
+
+        Материалы не загружаются: по ним считаются только число материалов,
+        число заданий и время последнего изменения. Без пользователя
+        (неавторизованный посетитель) возвращаются все предметы.
+        """
+        query = (
+            db.session.query(
+                Subject.id,
+                Subject.title,
+                Subject.description,
+                Subject.pattern_type,
+                Subject.pattern_svg,
+                func.count(Material.id),
+                func.coalesce(
+                    func.sum(case((Material.type == "assignment", 1), else_=0)), 0
+                ),
+                func.max(Material.updated_at),
+            )
+            .outerjoin(Material, Material.subject_id == Subject.id)
+            .group_by(Subject.id)
+            .order_by(Subject.id)
+        )
+        if user is not None and not UserManagementService.can_see_all_subjects(user):
+            if not user.group_id:
+                return []
+            query = query.filter(
+                Subject.id.in_(
+                    db.session.query(SubjectGroup.subject_id).filter(
+                        SubjectGroup.group_id == user.group_id
+                    )
+                )
+            )
+        return [SubjectCard(*row) for row in query.all()]
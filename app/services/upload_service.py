@@ -0,0 +1,238 @@
+import fcntl
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import update
+
+from .. import db
+from ..models import UploadSession
+from ..utils.file_storage import FileStorageManager
+from ..utils.transliteration import get_safe_filename
+
+
+class UploadService:
+    """
+    Возобновляемая загрузка больших файлов частями (в стиле tus)
+
+    Создание сессии, запись частей по смещению (PATCH), завершение.
+    Части пишутся сразу в DATA_FOLDER/.uploads/<id>.part - вне публичной
+    статики; если DATA_FOLDER на той же файловой системе, что и
+    UPLOAD_FOLDER, завершение загрузки переносит файл через os.replace без
+    копирования. SHA-256 считается по мере поступления данных.
+    """
+
+    UPLOAD_DIR = ".uploads"
+    READ_CHUNK_SIZE = 1024 * 1024
+    STATUS_UPLOADING = "uploading"
+    STATUS_COMPLETE = "complete"
+    OFFSET_CONFLICT = "Смещение не совпадает с загруженным объемом"
+
+    _hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+    _hashers_lock = threading.Lock()
+
+    @staticmethod
+    def get_part_path(upload: UploadSession) -> str:
+        data_base = current_app.config.get("DATA_FOLDER", current_app.instance_path)
+        return os.path.join(
+            os.path.abspath(data_base), UploadService.UPLOAD_DIR, f"{upload.id}.part"
+        )
+
+    @staticmethod
+    def create_session(
+        user, filename: str, size: int
+    ) -> Tuple[Optional[UploadSession], str]:
+        if not filename:
+            return None, "Не указано имя файла"
+        safe_filename = get_safe_filename(filename)
+        if size is None or size < 0:
+            return None, "Некорректный размер файла"
+        if size > FileStorageManager.get_user_max_file_size_bytes(user):
+            return None, FileStorageManager.get_user_limit_message(user)
+        UploadService.cleanup_expired()
+        upload = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=user.id,
+            filename=safe_filename,
+            size=size,
+            offset=0,
+            status=UploadService.STATUS_UPLOADING,
+        )
+        part_path = UploadService.get_part_path(upload)
+        try:
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            open(part_path, "wb").close()
+            db.session.add(upload)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Ошибка создания сессии загрузки: {e}")
+            return None, "Ошибка создания загрузки"
+        current_app.logger.info(
+            f"Создана сессия загрузки {upload.id}: {safe_filename} ({size} байт)"
+        )
+        return upload, ""
+
+    @staticmethod
+    def get_session(upload_id: str, user_id: int) -> Optional[UploadSession]:
+        if not upload_id:
+            return None
+        return UploadSession.query.filter_by(id=upload_id, user_id=user_id).first()
+
+    @staticmethod
+    def _take_hasher(upload: UploadSession) -> "hashlib._Hash":
+        """Возвращает хешер, досчитанный до upload.offset"""
+        with UploadService._hashers_lock:
+            cached = UploadService._hashers.pop(upload.id, None)
+        if cached and cached[0] == upload.offset:
+            return cached[1]
+        digest = hashlib.sha256()
+        remaining = upload.offset
+        with open(UploadService.get_part_path(upload), "rb") as f:
+            while remaining > 0:
+                chunk = f.read(min(UploadService.READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+        return digest
+
+    @staticmethod
+    def _put_hasher(upload: UploadSession, digest: "hashlib._Hash") -> None:
+        with UploadService._hashers_lock:
+            UploadService._hashers[upload.id] = (upload.offset, digest)
+
+    @staticmethod
+    def _drop_hasher(upload_id: str) -> None:
+        with UploadService._hashers_lock:
+            UploadService._hashers.pop(upload_id, None)
+
+    @staticmethod
+    def append_chunk(upload: UploadSession, offset: int, stream) -> Tuple[bool, str]:
+        """
+        Дописывает часть файла начиная с offset
+
+        Часть пишется под эксклюзивной блокировкой файла загрузки, а новое
+        смещение сохраняется условным UPDATE по старому: из двух PATCH с
+        одним смещением второй получает OFFSET_CONFLICT и ничего не пишет.
+        Смещение сохраняется даже при обрыве соединения: клиент узнает его
+        через HEAD и продолжает с того же места.
+        """
+        if upload.status != UploadService.STATUS_UPLOADING:
+            return False, "Загрузка уже завершена"
+        if offset != upload.offset:
+            return False, UploadService.OFFSET_CONFLICT
+        with open(UploadService.get_part_path(upload), "r+b") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False, UploadService.OFFSET_CONFLICT
+            db.session.refresh(upload)
+            if upload.status != UploadService.STATUS_UPLOADING:
+                return False, "Загрузка уже завершена"
+            if offset != upload.offset:
+                return False, UploadService.OFFSET_CONFLICT
+            digest = UploadService._take_hasher(upload)
+            written = 0
+            error = ""
+            try:
+                f.seek(offset)
+                f.truncate()
+                while True:
+                    chunk = stream.read(UploadService.READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if offset + written + len(chunk) > upload.size:
+                        error = "Размер данных превышает заявленный размер файла"
+                        break
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+                f.flush()
+            except Exception as e:
+                current_app.logger.warning(
+                    f"Загрузка {upload.id} прервана на {offset + written} байт: {e}"
+                )
+                error = "Соединение прервано"
+            result = db.session.execute(
+                update(UploadSession)
+                .where(UploadSession.id == upload.id, UploadSession.offset == offset)
+                .values(offset=offset + written)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            db.session.refresh(upload)
+            if result.rowcount != 1:
+                return False, UploadService.OFFSET_CONFLICT
+            UploadService._put_hasher(upload, digest)
+        if error:
+            return False, error
+        return True, ""
+
+    @staticmethod
+    def finalize(
+        upload: UploadSession, expected_sha256: Optional[str] = None
+    ) -> Tuple[bool, str]:
+        if upload.status == UploadService.STATUS_COMPLETE:
+            return True, ""
+        if upload.offset != upload.size:
+            return False, f"Загружено {upload.offset} из {upload.size} байт"
+        digest = UploadService._take_hasher(upload)
+        sha256 = digest.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            UploadService._put_hasher(upload, digest)
+            return False, "Контрольная сумма не совпадает"
+        upload.sha256 = sha256
+        upload.status = UploadService.STATUS_COMPLETE
+        db.session.commit()
+        current_app.logger.info(f"Загрузка {upload.id} завершена, SHA-256 {sha256}")
+        return True, ""
+
+    @staticmethod
+    def get_completed_session(upload_id: str, user_id: int) -> Optional[UploadSession]:
+        upload = UploadService.get_session(upload_id, user_id)
+        if not upload or upload.status != UploadService.STATUS_COMPLETE:
+            return None
+        return upload
+
+    @staticmethod
+    def consume(upload: UploadSession, full_path: str) -> bool:
+        """Переносит завершенную загрузку на итоговый путь и удаляет сессию"""
+        if upload.status != UploadService.STATUS_COMPLETE:
+            return False
+        if not FileStorageManager.move_uploaded_file(
+            UploadService.get_part_path(upload), full_path, upload.sha256
+        ):
+            return False
+        db.session.delete(upload)
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def abort(upload: UploadSession) -> None:
+        UploadService._drop_hasher(upload.id)
+        part_path = UploadService.get_part_path(upload)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        db.session.delete(upload)
+        db.session.commit()
+
+    @staticmethod
+    def cleanup_expired() -> int:
+        """Удаляет сессии, не получавшие данных дольше UPLOAD_SESSION_TTL_HOURS"""
+        ttl_hours = current_app.config.get("UPLOAD_SESSION_TTL_HOURS", 24)
+        cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+        expired = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+        for upload in expired:
+            try:
+                UploadService.abort(upload)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.warning(
+                    f"Ошибка удаления устаревшей загрузки {upload.id}: {e}"
+                )
+        return len(expired)
@@ -2,7 +2,9 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 
 from .. import db
-from ..models import Group, Subject, SubjectGroup, User
+from ..models import Group, Subject, User
+from ..utils.subject_access import SubjectAccess
+from ..utils.subscription_state import SubscriptionState
 
 
 class UserManagementService:
@@ -24,27 +26,27 @@ class UserManagementService:
         if UserManagementService.can_see_all_subjects(user):
             return Subject.query.all()
         elif user.group_id:
-            return (
-                Subject.query.join(SubjectGroup)
-                .filter(SubjectGroup.group_id == user.group_id)
-                .all()
-            )
+            subject_ids = SubjectAccess.get_subject_ids(user.group_id)
+            if not subject_ids:
+                return []
+            return Subject.query.filter(Subject.id.in_(subject_ids)).all()
         else:
             return []
 
+    @staticmethod
+    def can_access_subject(user: User, subject_id: int) -> bool:
+        if UserManagementService.can_see_all_subjects(user):
+            return True
+        return bool(user.group_id) and SubjectAccess.has_access(
+            user.group_id, subject_id
+        )
+
     @staticmethod
     def can_add_materials_to_subject(user: User, subject: Subject) -> bool:
         if user.is_admin and user.admin_mode_enabled:
             return True
         elif user.is_moderator and user.group_id:
-            from ..models import SubjectGroup
-
-            return (
-                SubjectGroup.query.filter_by(
-                    subject_id=subject.id, group_id=user.group_id
-                ).first()
-                is not None
-            )
+            return SubjectAccess.has_access(user.group_id, subject.id)
         else:
             return False
 
@@ -54,24 +56,7 @@ class UserManagementService:
 
     @staticmethod
     def has_active_subscription(user: User) -> bool:
-
-        if (
-            user.is_manual_subscription
-            and user.subscription_expires
-            and user.subscription_expires > datetime.utcnow()
-        ):
-            return True
-        if (
-            user.is_trial_subscription
-            and user.trial_subscription_expires
-            and user.trial_subscription_expires > datetime.utcnow()
-        ):
-            return True
-        return (
-            user.is_subscribed
-            and user.subscription_expires
-            and user.subscription_expires > datetime.utcnow()
-        )
+        return SubscriptionState.is_active(user)
 
     @staticmethod
     def get_role_display(user: User) -> str:
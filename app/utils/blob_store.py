@@ -0,0 +1,197 @@
+import hashlib
+import os
+import uuid
+from typing import Iterable, Optional, Tuple
+
+from flask import current_app
+
+from ..models import FileLocation
+from .file_index import FileIndex
+from .image_variants import ImageVariants
+
+
+class HashingWriter:
+    """Файловый объект, считающий SHA-256 по мере записи загрузки"""
+
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Контентно-адресуемое хранилище загрузок: DATA_FOLDER/.blobs/ab/cd/<sha256>
+
+    Пути предметов и пользователей остаются обычными файлами, но являются
+    жесткими ссылками на общий блоб. Ссылками считаются записи FileLocation
+    с тем же sha256; блоб удаляется, когда на него не осталось ни записей,
+    ни других ссылок в файловой системе. Жесткие ссылки работают, только
+    если DATA_FOLDER и UPLOAD_FOLDER на одной файловой системе.
+    """
+
+    BLOB_DIR = ".blobs"
+
+    @staticmethod
+    def _blob_base() -> str:
+        data_base = current_app.config.get("DATA_FOLDER", current_app.instance_path)
+        return os.path.join(os.path.abspath(data_base), BlobStore.BLOB_DIR)
+
+    @staticmethod
+    def blob_path(sha256: str) -> str:
+        return os.path.join(BlobStore._blob_base(), sha256[:2], sha256[2:4], sha256)
+
+    @staticmethod
+    def save_upload(file, full_path: str) -> str:
+        """
+        Сохраняет загруженный FileStorage, одновременно считая SHA-256
+
+        Запись идет во временный файл с последующим os.replace: по старому
+        пути может лежать жесткая ссылка на общий блоб, который нельзя
+        перезаписывать на месте.
+
+        Returns:
+            str: SHA-256 записанного содержимого
+        """
+        temp_path = f"{full_path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(temp_path, "wb") as f:
+                writer = HashingWriter(f)
+                file.save(writer)
+            os.replace(temp_path, full_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return writer.hexdigest()
+
+    @staticmethod
+    def store(full_path: str, sha256: str) -> bool:
+        """
+        Заменяет файл жесткой ссылкой на блоб с тем же содержимым
+
+        Если блоба еще нет, файл сам становится блобом. Если файловая система
+        не поддерживает жесткие ссылки, файл остается отдельной копией.
+
+        Returns:
+            bool: True, если файл связан с блобом
+        """
+        blob_path = BlobStore.blob_path(sha256)
+        try:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            file_stat = os.stat(full_path)
+            try:
+                os.link(full_path, blob_path)
+                return True
+            except FileExistsError:
+                pass
+            blob_stat = os.stat(blob_path)
+            if (blob_stat.st_dev, blob_stat.st_ino) == (
+                file_stat.st_dev,
+                file_stat.st_ino,
+            ):
+                return True
+            if blob_stat.st_size != file_stat.st_size:
+                current_app.logger.warning(
+                    f"Размер блоба {sha256} не совпадает с {full_path}, "
+                    f"дедупликация пропущена"
+                )
+                return False
+            temp_path = f"{full_path}.{uuid.uuid4().hex}.link"
+            os.link(blob_path, temp_path)
+            os.replace(temp_path, full_path)
+            current_app.logger.info(f"Файл {full_path} связан с блобом {sha256}")
+            return True
+        except OSError as e:
+            current_app.logger.warning(
+                f"Не удалось связать {full_path} с хранилищем блобов: {e}"
+            )
+            return False
+
+    @staticmethod
+    def release(sha256: Optional[str]) -> bool:
+        """Удаляет блоб, если на него больше нет ссылок"""
+        if not sha256:
+            return False
+        blob_path = BlobStore.blob_path(sha256)
+        try:
+            if not os.path.exists(blob_path):
+                return False
+            if FileLocation.query.filter_by(sha256=sha256).first():
+                return False
+            if os.stat(blob_path).st_nlink > 1:
+                return False
+            os.remove(blob_path)
+            ImageVariants.release(sha256)
+            current_app.logger.info(f"Блоб {sha256} удален: ссылок не осталось")
+            return True
+        except OSError as e:
+            current_app.logger.warning(f"Ошибка удаления блоба {sha256}: {e}")
+            return False
+
+    @staticmethod
+    def release_all(hashes: Iterable[str]) -> int:
+        """
+        Освобождает блобы файлов, удаленных из индекса
+
+        Используется после FileIndex.forget_subject/forget_user: проверяются
+        только блобы удаленных файлов, а не все хранилище.
+        """
+        return sum(1 for sha256 in hashes if BlobStore.release(sha256))
+
+    @staticmethod
+    def collect_garbage() -> int:
+        """Удаляет все блобы без ссылок обходом всего хранилища"""
+        blob_base = BlobStore._blob_base()
+        removed = 0
+        if not os.path.isdir(blob_base):
+            return removed
+        for _, _, files in os.walk(blob_base):
+            for name in files:
+                if BlobStore.release(name):
+                    removed += 1
+        return removed
+
+    @staticmethod
+    def deduplicate_existing() -> Tuple[int, int]:
+        """
+        Переводит уже загруженные файлы на хранилище блобов
+
+        Индекс файлов должен быть актуален (FileIndex.rebuild): SHA-256 берется
+        из него. После связывания запись индекса обновляется, так как файл
+        теперь указывает на inode блоба.
+
+        Returns:
+            Tuple[int, int]: (число связанных файлов, освобождено байт)
+        """
+        linked = 0
+        saved_bytes = 0
+        for location in FileLocation.query.order_by(FileLocation.id).all():
+            if not location.sha256:
+                continue
+            full_path = FileIndex.get_full_path(location)
+            blob_path = BlobStore.blob_path(location.sha256)
+            try:
+                file_stat = os.stat(full_path)
+                blob_stat = os.stat(blob_path) if os.path.exists(blob_path) else None
+            except OSError:
+                continue
+            already_shared = blob_stat is not None and (
+                (blob_stat.st_dev, blob_stat.st_ino)
+                == (file_stat.st_dev, file_stat.st_ino)
+            )
+            if already_shared or not BlobStore.store(full_path, location.sha256):
+                continue
+            linked += 1
+            if blob_stat is not None and file_stat.st_nlink == 1:
+                saved_bytes += file_stat.st_size
+            FileIndex.record(full_path, location.sha256)
+        return linked, saved_bytes
@@ -0,0 +1,145 @@
+import glob
+import hashlib
+import os
+import time
+import uuid
+from typing import Iterable, Iterator, Optional
+
+from flask import current_app
+
+
+class ExportCache:
+    """
+    Кэш готовых архивов экспорта: DATA_FOLDER/.exports/<user_id>-<fingerprint>.zip
+
+    Отпечаток (fingerprint) строится по состоянию решений пользователя,
+    поэтому неизменившийся набор файлов отдается из кэша без пересборки.
+    Старые архивы вытесняются по возрасту (EXPORT_CACHE_MAX_AGE_HOURS) и
+    суммарному размеру (EXPORT_CACHE_MAX_BYTES).
+    """
+
+    CACHE_DIR = ".exports"
+    CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def _cache_base() -> str:
+        data_base = current_app.config.get("DATA_FOLDER", current_app.instance_path)
+        return os.path.join(os.path.abspath(data_base), ExportCache.CACHE_DIR)
+
+    @staticmethod
+    def fingerprint(parts: Iterable) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(repr(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()[:32]
+
+    @staticmethod
+    def get_path(user_id: int, fingerprint: str) -> str:
+        return os.path.join(ExportCache._cache_base(), f"{user_id}-{fingerprint}.zip")
+
+    @staticmethod
+    def find(user_id: int, fingerprint: str) -> Optional[str]:
+        """Путь к закэшированному архиву или None; продлевает срок его жизни"""
+        path = ExportCache.get_path(user_id, fingerprint)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    @staticmethod
+    def open(user_id: int, fingerprint: str) -> Optional[Iterator[bytes]]:
+        """Возвращает части закэшированного архива или None"""
+        path = ExportCache.find(user_id, fingerprint)
+        if path is None:
+            return None
+        try:
+            source = open(path, "rb")
+        except OSError:
+            return None
+        return ExportCache._read_chunks(source)
+
+    @staticmethod
+    def _read_chunks(source) -> Iterator[bytes]:
+        with source:
+            while True:
+                chunk = source.read(ExportCache.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    @staticmethod
+    def store(
+        user_id: int, fingerprint: str, chunks: Iterable[bytes]
+    ) -> Iterator[bytes]:
+        """
+        Отдает части архива дальше, одновременно записывая их в кэш
+
+        Архив попадает в кэш через os.replace только если был отдан
+        полностью; при обрыве загрузки временный файл удаляется.
+        """
+        path = ExportCache.get_path(user_id, fingerprint)
+        temp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            target = open(temp_path, "wb")
+        except OSError as e:
+            current_app.logger.warning(f"Кэш экспорта недоступен: {e}")
+            yield from chunks
+            return
+        try:
+            with target:
+                for chunk in chunks:
+                    target.write(chunk)
+                    yield chunk
+            ExportCache.invalidate(user_id)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        ExportCache.evict()
+
+    @staticmethod
+    def invalidate(user_id: int) -> int:
+        """Удаляет все закэшированные архивы пользователя"""
+        removed = 0
+        pattern = os.path.join(ExportCache._cache_base(), f"{user_id}-*.zip")
+        for path in glob.glob(pattern):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    @staticmethod
+    def evict() -> int:
+        """Вытесняет архивы старше EXPORT_CACHE_MAX_AGE_HOURS и сверх лимита размера"""
+        cache_base = ExportCache._cache_base()
+        if not os.path.isdir(cache_base):
+            return 0
+        max_age = current_app.config.get("EXPORT_CACHE_MAX_AGE_HOURS", 24) * 3600
+        max_bytes = current_app.config.get("EXPORT_CACHE_MAX_BYTES", 1024**3)
+        now = time.time()
+        entries = []
+        with os.scandir(cache_base) as scanned:
+            for entry in scanned:
+                if not entry.is_file() or not entry.name.endswith(".zip"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort(reverse=True)
+        removed = 0
+        total_size = 0
+        for mtime, size, path in entries:
+            total_size += size
+            if now - mtime <= max_age and total_size <= max_bytes:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+                total_size -= size
+            except OSError:
+                pass
+        return removed
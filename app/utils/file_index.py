@@ -0,0 +1,322 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Optional, Set, Tuple
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from .. import db
+from ..models import BackgroundJob, FileLocation
+from .job_queue import JobQueue
+
+INDEX_FILE_JOB = "index_file"
+
+
+class FileIndex:
+    """Индекс расположения загруженных файлов: (subject_id, имя) -> путь в UPLOAD_FOLDER"""
+
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def _upload_base() -> str:
+        return os.path.abspath(
+            current_app.config.get("UPLOAD_FOLDER", "app/static/uploads")
+        )
+
+    @staticmethod
+    def make_key(filename: str) -> str:
+        return secure_filename(os.path.basename(filename or ""))
+
+    @staticmethod
+    def relative_to_upload(full_path: str) -> Optional[str]:
+        upload_base = FileIndex._upload_base()
+        full_path = os.path.abspath(full_path)
+        if not full_path.startswith(upload_base + os.sep):
+            return None
+        return os.path.relpath(full_path, upload_base).replace(os.sep, "/")
+
+    @staticmethod
+    def get_full_path(location: FileLocation) -> str:
+        return os.path.normpath(
+            os.path.join(FileIndex._upload_base(), location.relative_path)
+        )
+
+    @staticmethod
+    def parse_relative_path(
+        relative_path: str,
+    ) -> Optional[Tuple[int, Optional[int], str]]:
+        """
+        Разбирает относительный путь загрузки
+
+        Returns:
+            Optional[Tuple[int, Optional[int], str]]: (subject_id, user_id_или_None, имя)
+        """
+        if not relative_path:
+            return None
+        parts = relative_path.replace(os.sep, "/").strip("/").split("/")
+        if len(parts) < 2 or not parts[0].isdigit():
+            return None
+        subject_id = int(parts[0])
+        if len(parts) == 2:
+            return subject_id, None, parts[1]
+        if len(parts) == 3 and parts[1] == "materials":
+            return subject_id, None, parts[2]
+        if len(parts) == 4 and parts[1] == "users" and parts[2].isdigit():
+            return subject_id, int(parts[2]), parts[3]
+        return None
+
+    @staticmethod
+    def compute_sha256(full_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(full_path, "rb") as f:
+            while True:
+                chunk = f.read(FileIndex.HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _fill_metadata(
+        location: FileLocation, full_path: str, sha256: Optional[str] = None
+    ) -> None:
+        stat = os.stat(full_path)
+        location.size = stat.st_size
+        location.modified_at = datetime.utcfromtimestamp(int(stat.st_mtime))
+        location.sha256 = sha256 or FileIndex.compute_sha256(full_path)
+
+    @staticmethod
+    def _is_stale(location: FileLocation, full_path: str) -> bool:
+        if not location.sha256 or location.modified_at is None:
+            return True
+        stat = os.stat(full_path)
+        return (
+            location.size != stat.st_size
+            or location.modified_at != datetime.utcfromtimestamp(int(stat.st_mtime))
+        )
+
+    @staticmethod
+    def _build_location(full_path: str) -> Optional[FileLocation]:
+        relative_path = FileIndex.relative_to_upload(full_path)
+        parsed = FileIndex.parse_relative_path(relative_path)
+        if not parsed:
+            return None
+        subject_id, user_id, filename = parsed
+        key = FileIndex.make_key(filename)
+        if not key:
+            return None
+        return FileLocation(
+            subject_id=subject_id,
+            filename=key,
+            relative_path=relative_path,
+            user_id=user_id,
+        )
+
+    @staticmethod
+    def record(full_path: str, sha256: Optional[str] = None) -> bool:
+        """
+        Добавляет или обновляет запись индекса для сохраненного файла
+
+        Размер, время изменения и SHA-256 (ETag) вычисляются один раз здесь,
+        при загрузке, и дальше берутся из индекса. Запись идет в SAVEPOINT:
+        ошибка откатывает только ее, а не изменения вызывающего кода, и
+        commit остается за вызывающим кодом.
+        """
+        new_location = FileIndex._build_location(full_path)
+        if not new_location:
+            return False
+        try:
+            FileIndex._fill_metadata(new_location, full_path, sha256)
+            with db.session.begin_nested():
+                location = FileLocation.query.filter_by(
+                    relative_path=new_location.relative_path
+                ).first()
+                if location:
+                    location.size = new_location.size
+                    location.modified_at = new_location.modified_at
+                    location.sha256 = new_location.sha256
+                else:
+                    db.session.add(new_location)
+            return True
+        except Exception as e:
+            current_app.logger.warning(
+                f"Ошибка обновления индекса файлов {full_path}: {e}"
+            )
+            return False
+
+    @staticmethod
+    def get_sha256(relative_path: Optional[str]) -> Optional[str]:
+        """Возвращает SHA-256 проиндексированного файла по относительному пути"""
+        if not relative_path:
+            return None
+        relative_path = relative_path.replace(os.sep, "/").strip("/")
+        location = FileLocation.query.filter_by(relative_path=relative_path).first()
+        return location.sha256 if location else None
+
+    @staticmethod
+    def forget(relative_path: str) -> None:
+        if not relative_path:
+            return
+        relative_path = relative_path.replace(os.sep, "/").strip("/")
+        FileIndex._delete_where(FileLocation.relative_path == relative_path)
+
+    @staticmethod
+    def forget_subject(subject_id: int) -> Set[str]:
+        return FileIndex._delete_where(FileLocation.subject_id == subject_id)
+
+    @staticmethod
+    def forget_user(user_id: int) -> Set[str]:
+        return FileIndex._delete_where(FileLocation.user_id == user_id)
+
+    @staticmethod
+    def _delete_where(criterion) -> Set[str]:
+        """Удаляет записи индекса и возвращает SHA-256 удаленных файлов"""
+        try:
+            hashes = {
+                sha256
+                for (sha256,) in db.session.query(FileLocation.sha256)
+                .filter(criterion, FileLocation.sha256.isnot(None))
+                .distinct()
+            }
+            FileLocation.query.filter(criterion).delete(synchronize_session=False)
+            return hashes
+        except Exception as e:
+            current_app.logger.warning(f"Ошибка очистки индекса файлов: {e}")
+            return set()
+
+    @staticmethod
+    def lookup(subject_id: int, filename: str) -> Optional[FileLocation]:
+        """Находит файл предмета по имени; файлы материалов важнее решений"""
+        key = FileIndex.make_key(filename)
+        if not key:
+            return None
+        locations = (
+            FileLocation.query.filter_by(subject_id=subject_id, filename=key)
+            .order_by(FileLocation.user_id.isnot(None), FileLocation.id)
+            .all()
+        )
+        for location in locations:
+            if os.path.isfile(FileIndex.get_full_path(location)):
+                return location
+            FileIndex.forget(location.relative_path)
+        return None
+
+    @staticmethod
+    def resolve(subject_id: int, filename: str) -> Optional[str]:
+        """Возвращает абсолютный путь к файлу по индексу или None"""
+        location = FileIndex.lookup(subject_id, filename)
+        return FileIndex.get_full_path(location) if location else None
+
+    @staticmethod
+    def get_metadata(
+        full_path: str, location: Optional[FileLocation] = None
+    ) -> Optional[FileLocation]:
+        """
+        Возвращает запись индекса с размером, временем изменения и SHA-256
+
+        Если файл изменился на диске после записи (или записи нет),
+        возвращает None и ставит переиндексацию в очередь: SHA-256 большого
+        файла не считается внутри запроса.
+        """
+        relative_path = FileIndex.relative_to_upload(full_path)
+        if not relative_path:
+            return None
+        if location is None or location.relative_path != relative_path:
+            location = FileLocation.query.filter_by(relative_path=relative_path).first()
+        try:
+            if location and not FileIndex._is_stale(location, full_path):
+                return location
+        except OSError:
+            return None
+        FileIndex.schedule_record(full_path)
+        return None
+
+    @staticmethod
+    def schedule_record(full_path: str) -> bool:
+        """Ставит переиндексацию файла в очередь, если она еще не запланирована"""
+        relative_path = FileIndex.relative_to_upload(full_path)
+        if not relative_path:
+            return False
+        payload = {"relative_path": relative_path}
+        try:
+            pending = BackgroundJob.query.filter_by(
+                kind=INDEX_FILE_JOB,
+                status=JobQueue.STATUS_PENDING,
+                payload=json.dumps(payload, ensure_ascii=False),
+            ).first()
+            if not pending:
+                JobQueue.enqueue(INDEX_FILE_JOB, payload)
+            return True
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(
+                f"Не удалось запланировать индексацию {full_path}: {e}"
+            )
+            return False
+
+    @staticmethod
+    def run_index_job(payload: dict, job: BackgroundJob) -> bool:
+        """Фоновая переиндексация файла: размер, время изменения и SHA-256"""
+        full_path = os.path.normpath(
+            os.path.join(FileIndex._upload_base(), payload["relative_path"])
+        )
+        if not FileIndex.relative_to_upload(full_path) or not os.path.isfile(full_path):
+            return False
+        return FileIndex.record(full_path)
+
+    @staticmethod
+    def rebuild() -> int:
+        """Полностью пересобирает индекс по содержимому UPLOAD_FOLDER"""
+        upload_base = FileIndex._upload_base()
+        known = {
+            location.relative_path: location for location in FileLocation.query.all()
+        }
+        entries = []
+        if os.path.isdir(upload_base):
+            for subject_entry in os.scandir(upload_base):
+                if not subject_entry.is_dir() or not subject_entry.name.isdigit():
+                    continue
+                for entry in os.scandir(subject_entry.path):
+                    if entry.is_file():
+                        entries.append(entry.path)
+                    elif entry.is_dir() and entry.name == "materials":
+                        entries.extend(
+                            material_entry.path
+                            for material_entry in os.scandir(entry.path)
+                            if material_entry.is_file()
+                        )
+                    elif entry.is_dir() and entry.name == "users":
+                        for user_entry in os.scandir(entry.path):
+                            if not user_entry.is_dir() or not user_entry.name.isdigit():
+                                continue
+                            entries.extend(
+                                file_entry.path
+                                for file_entry in os.scandir(user_entry.path)
+                                if file_entry.is_file()
+                            )
+        count = 0
+        try:
+            FileLocation.query.delete(synchronize_session=False)
+            for full_path in entries:
+                location = FileIndex._build_location(full_path)
+                if not location:
+                    continue
+                previous = known.get(location.relative_path)
+                if previous and not FileIndex._is_stale(previous, full_path):
+                    location.size = previous.size
+                    location.sha256 = previous.sha256
+                    location.modified_at = previous.modified_at
+                else:
+                    FileIndex._fill_metadata(location, full_path)
+                db.session.add(location)
+                count += 1
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return count
+
+
+JobQueue.register(INDEX_FILE_JOB, FileIndex.run_index_job, concurrency=2)
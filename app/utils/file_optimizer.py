@@ -1,8 +1,8 @@
 import os
-import tempfile
+import re
+import shutil
 import zipfile
 import json
-from pathlib import Path
 from typing import Optional, Tuple
 
 from flask import current_app
@@ -12,6 +12,31 @@ class FileOptimizer:
     """Модуль для автоматической оптимизации загружаемых файлов без потери качества"""
 
     SUPPORTED_EXTENSIONS = {"pdf", "docx", "pptx", "ipynb", "jpg", "jpeg", "png"}
+    OFFICE_REMOVED_ENTRIES = {
+        "docProps/thumbnail.jpeg",
+        "docProps/thumbnail.png",
+        "docProps/thumbnail.wmf",
+        "docProps/thumbnail.emf",
+        "[Content_Types].xml.bak",
+    }
+    OFFICE_THUMBNAIL_REL_RE = re.compile(
+        rb"<Relationship\b[^>]*Target=\"/?docProps/thumbnail\.[a-z]+\"[^>]*/>"
+    )
+    PRECOMPRESSED_EXTENSIONS = {
+        "jpg",
+        "jpeg",
+        "png",
+        "gif",
+        "webp",
+        "wdp",
+        "mp3",
+        "m4a",
+        "mp4",
+        "zip",
+    }
+    COPY_CHUNK_SIZE = 1024 * 1024
+    IN_MEMORY_ENTRY_LIMIT = 32 * 1024 * 1024
+    JPEG_QUALITY = 90
 
     @staticmethod
     def optimize_file(file_path: str) -> Tuple[bool, Optional[str]]:
@@ -103,26 +128,26 @@ class FileOptimizer:
 
     @staticmethod
     def _optimize_office_file(file_path: str) -> Tuple[bool, Optional[str]]:
-        """Оптимизация Office файлов (DOCX, PPTX) путем пересжатия ZIP"""
-        try:
-            filename = os.path.basename(file_path)
-            temp_path = file_path + ".optimized"
-
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_path_obj = Path(temp_dir)
-
-                with zipfile.ZipFile(file_path, "r") as zip_ref:
-                    zip_ref.extractall(temp_path_obj)
-
-                FileOptimizer._clean_office_metadata(temp_path_obj)
+        """
+        Оптимизация Office файлов (DOCX, PPTX) путем пересжатия ZIP
 
-                with zipfile.ZipFile(
-                    temp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=9
-                ) as zip_out:
-                    for file_path_in_zip in temp_path_obj.rglob("*"):
-                        if file_path_in_zip.is_file():
-                            arcname = file_path_in_zip.relative_to(temp_path_obj)
-                            zip_out.write(file_path_in_zip, arcname)
+        Архив пересобирается потоково, запись за записью, без распаковки
+        на диск. Миниатюры docProps/thumbnail.* выбрасываются вместе со
+        ссылкой на них в _rels/.rels, а уже сжатые медиафайлы (JPEG, PNG
+        и т.п.) сохраняются без повторного сжатия.
+        """
+        temp_path = file_path + ".optimized"
+        try:
+            with zipfile.ZipFile(file_path, "r") as zip_in, zipfile.ZipFile(
+                temp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=9
+            ) as zip_out:
+                for info in zip_in.infolist():
+                    if (
+                        info.is_dir()
+                        or info.filename in FileOptimizer.OFFICE_REMOVED_ENTRIES
+                    ):
+                        continue
+                    FileOptimizer._copy_office_entry(zip_in, zip_out, info)
 
             orig_size = os.path.getsize(file_path)
             opt_size = os.path.getsize(temp_path)
@@ -146,20 +171,55 @@ class FileOptimizer:
             return False, None
 
     @staticmethod
-    def _clean_office_metadata(temp_path: Path) -> None:
-        """Удаляет ненужные метаданные из Office файлов"""
-        files_to_remove = [
-            "docProps/thumbnail.jpeg",
-            "docProps/thumbnail.png",
-            "docProps/thumbnail.wmf",
-            "docProps/thumbnail.emf",
-            "[Content_Types].xml.bak",
-        ]
-
-        for file_to_remove in files_to_remove:
-            file_path_to_remove = temp_path / file_to_remove
-            if file_path_to_remove.exists():
-                file_path_to_remove.unlink()
+    def _target_entry(info: zipfile.ZipInfo, compress_type: int) -> zipfile.ZipInfo:
+        """Запись нового архива с датой и атрибутами исходной записи"""
+        target = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+        target.external_attr = info.external_attr
+        target.compress_type = compress_type
+        return target
+
+    @staticmethod
+    def _copy_office_entry(
+        zip_in: zipfile.ZipFile, zip_out: zipfile.ZipFile, info: zipfile.ZipInfo
+    ) -> None:
+        """
+        Копирует запись архива в новый архив
+
+        Сжимаемые записи до IN_MEMORY_ENTRY_LIMIT пишутся через writestr,
+        который принимает уровень сжатия архива. Остальные копируются
+        потоково, не читая их целиком в память: уже сжатые медиафайлы без
+        сжатия, а очень крупные сжимаемые - с уровнем zlib по умолчанию.
+        """
+        if info.filename == "_rels/.rels":
+            rels = zip_in.read(info)
+            zip_out.writestr(
+                FileOptimizer._target_entry(info, zip_out.compression),
+                FileOptimizer.OFFICE_THUMBNAIL_REL_RE.sub(b"", rels),
+                compresslevel=zip_out.compresslevel,
+            )
+            return
+
+        extension = info.filename.rsplit(".", 1)[-1].lower()
+        if extension in FileOptimizer.PRECOMPRESSED_EXTENSIONS:
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zip_out.compression
+        target = FileOptimizer._target_entry(info, compress_type)
+
+        if (
+            compress_type != zipfile.ZIP_STORED
+            and info.file_size <= FileOptimizer.IN_MEMORY_ENTRY_LIMIT
+        ):
+            zip_out.writestr(
+                target, zip_in.read(info), compresslevel=zip_out.compresslevel
+            )
+            return
+
+        force_zip64 = info.file_size >= zipfile.ZIP64_LIMIT
+        with zip_in.open(info) as src, zip_out.open(
+            target, "w", force_zip64=force_zip64
+        ) as dst:
+            shutil.copyfileobj(src, dst, FileOptimizer.COPY_CHUNK_SIZE)
 
     @staticmethod
     def _optimize_ipynb(file_path: str) -> Tuple[bool, Optional[str]]:
@@ -191,9 +251,56 @@ class FileOptimizer:
 
     @staticmethod
     def _optimize_image(file_path: str) -> Tuple[bool, Optional[str]]:
-        """Оптимизация изображений (пока только базовая поддержка)"""
+        """
+        Оптимизация изображений: удаление метаданных и пересжатие
 
-        return True, None
+        Ориентация из EXIF применяется к пикселям, после чего EXIF, XMP и
+        прочие метаданные не сохраняются; цветовой профиль ICC сохраняется.
+        PNG пересжимается без потерь, JPEG - с исходными таблицами
+        квантования (quality="keep"), если поворот не потребовался, иначе с
+        качеством JPEG_QUALITY.
+        """
+        temp_path = file_path + ".optimized"
+        try:
+            from PIL import Image, ImageOps
+
+            with Image.open(file_path) as original:
+                image_format = original.format
+                image = ImageOps.exif_transpose(original)
+                transposed = image is not original
+                if image_format == "PNG":
+                    params = {"format": "PNG", "optimize": True}
+                elif image_format == "JPEG":
+                    params = {"format": "JPEG", "optimize": True, "progressive": True}
+                    if transposed:
+                        params["quality"] = FileOptimizer.JPEG_QUALITY
+                    else:
+                        params["quality"] = "keep"
+                        params["subsampling"] = "keep"
+                else:
+                    return True, None
+                params["icc_profile"] = original.info.get("icc_profile")
+                image.save(temp_path, **params)
+
+            orig_size = os.path.getsize(file_path)
+            opt_size = os.path.getsize(temp_path)
+
+            if opt_size < orig_size:
+                os.replace(temp_path, file_path)
+                current_app.logger.info(
+                    f"Изображение оптимизировано: {file_path} ({orig_size} -> {opt_size})"
+                )
+            else:
+                os.unlink(temp_path)
+            return True, None
+
+        except Exception as e:
+            current_app.logger.warning(
+                f"Ошибка оптимизации изображения {file_path}: {e}"
+            )
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return False, None
 
     @staticmethod
     def should_optimize_file(filename: str) -> bool:
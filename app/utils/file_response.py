@@ -0,0 +1,465 @@
+import os
+import secrets
+from datetime import UTC, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from flask import Response, current_app, request
+from werkzeug.http import http_date
+from werkzeug.wsgi import wrap_file
+
+from ..models import FileLocation
+from .file_index import FileIndex
+from .image_variants import ImageVariants
+
+OFFLOAD_X_ACCEL_REDIRECT = "x-accel-redirect"
+OFFLOAD_X_SENDFILE = "x-sendfile"
+
+
+class FileRangeWrapper:
+    """
+    Часть файла: length байт от текущей позиции
+
+    Передается в wsgi.file_wrapper сервера вместо самого файла, когда
+    отдается диапазон: обертки, читающие файл до конца (wsgiref), иначе
+    отправили бы больше Content-Length. fileno() и tell() оставлены для
+    серверов с os.sendfile (gunicorn): они начинают с текущей позиции и
+    ограничиваются Content-Length.
+    """
+
+    def __init__(self, file, length: int, buffer_size: int = 65536):
+        self.file = file
+        self.remaining = length
+        self.buffer_size = buffer_size
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        chunk = self.file.read(size)
+        self.remaining -= len(chunk)
+        return chunk
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        chunk = self.read(self.buffer_size)
+        if not chunk:
+            raise StopIteration()
+        return chunk
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class FileResponseBuilder:
+    """Сборка ответов для отдачи загруженных файлов (/files/...)"""
+
+    BUFFER_SIZE = 65536
+    MAX_RANGES = 16
+    IMAGE_VARIANT_MIMETYPES = {"image/jpeg", "image/png"}
+
+    MIMETYPES = {
+        ".pdf": "application/pdf",
+        ".jpg": "image/jpeg",
+        ".jpeg": "image/jpeg",
+        ".png": "image/png",
+        ".webp": "image/webp",
+        ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        ".doc": "application/msword",
+        ".txt": "text/plain",
+        ".zip": "application/zip",
+    }
+
+    @staticmethod
+    def get_mimetype(filename: str) -> str:
+        extension = os.path.splitext(filename or "")[1].lower()
+        return FileResponseBuilder.MIMETYPES.get(extension, "application/octet-stream")
+
+    @staticmethod
+    def get_base_headers(
+        filename: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[datetime] = None,
+    ) -> Dict[str, str]:
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "public, max-age=3600",
+            "X-Content-Type-Options": "nosniff",
+            "X-Frame-Options": "SAMEORIGIN",
+            "Content-Disposition": f'attachment; filename="{os.path.basename(filename)}"',
+        }
+        if etag:
+            headers["ETag"] = f'"{etag}"'
+        if last_modified:
+            headers["Last-Modified"] = http_date(
+                last_modified.replace(tzinfo=UTC)
+            )
+        return headers
+
+    @staticmethod
+    def get_validators(
+        file_path: str, location: Optional[FileLocation] = None
+    ) -> Tuple[str, datetime]:
+        """
+        Возвращает (ETag, Last-Modified) файла
+
+        Для проиндексированных загрузок это SHA-256 и время изменения,
+        посчитанные при загрузке. Для прочих файлов (и пока переиндексация
+        изменившегося файла стоит в очереди) ETag строится из времени
+        изменения и размера, как это делает Nginx.
+        """
+        location = FileIndex.get_metadata(file_path, location)
+        if location:
+            return location.sha256, location.modified_at
+        stat = os.stat(file_path)
+        return (
+            f"{int(stat.st_mtime):x}-{stat.st_size:x}",
+            datetime.utcfromtimestamp(int(stat.st_mtime)),
+        )
+
+    @staticmethod
+    def is_not_modified(etag: str, last_modified: Optional[datetime]) -> bool:
+        if request.headers.get("If-None-Match"):
+            return request.if_none_match.contains_weak(etag)
+        if_modified_since = request.if_modified_since
+        if if_modified_since and last_modified:
+            return last_modified.replace(tzinfo=UTC) <= if_modified_since
+        return False
+
+    @staticmethod
+    def if_range_matches(etag: str, last_modified: Optional[datetime]) -> bool:
+        """Проверяет If-Range: при несовпадении Range игнорируется и файл отдается целиком"""
+        if_range_header = request.headers.get("If-Range")
+        if not if_range_header:
+            return True
+        if if_range_header.strip().startswith("W/"):
+            return False
+        if_range = request.if_range
+        if if_range.etag is not None:
+            return if_range.etag == etag
+        if if_range.date is not None and last_modified:
+            return last_modified.replace(tzinfo=UTC) == if_range.date
+        return False
+
+    @staticmethod
+    def not_modified(
+        filename: str, etag: str, last_modified: Optional[datetime]
+    ) -> Response:
+        headers = FileResponseBuilder.get_base_headers(filename, etag, last_modified)
+        headers.pop("Content-Disposition")
+        return Response(status=304, headers=headers)
+
+    @staticmethod
+    def get_offload_mode() -> Optional[str]:
+        mode = (current_app.config.get("FILE_OFFLOAD_MODE") or "").strip().lower()
+        if mode in (OFFLOAD_X_ACCEL_REDIRECT, OFFLOAD_X_SENDFILE):
+            return mode
+        return None
+
+    @staticmethod
+    def offload(
+        file_path: str,
+        mimetype: str,
+        filename: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[datetime] = None,
+    ) -> Optional[Response]:
+        """
+        Передает отправку файла обратному прокси (Nginx/Apache)
+
+        Авторизация, поиск файла и заголовки остаются на стороне Flask,
+        тело ответа отправляет прокси через sendfile. Диапазоны и HEAD
+        прокси обрабатывает самостоятельно.
+
+        Returns:
+            Optional[Response]: ответ с X-Accel-Redirect/X-Sendfile или None,
+            если режим выключен и файл нужно отдать из Python
+        """
+        mode = FileResponseBuilder.get_offload_mode()
+        if not mode:
+            return None
+        file_path = os.path.abspath(file_path)
+        headers = FileResponseBuilder.get_base_headers(filename, etag, last_modified)
+        if mode == OFFLOAD_X_ACCEL_REDIRECT:
+            upload_base = os.path.abspath(current_app.config["UPLOAD_FOLDER"])
+            if not file_path.startswith(upload_base + os.sep):
+                current_app.logger.warning(
+                    f"Файл вне UPLOAD_FOLDER, offload невозможен: {file_path}"
+                )
+                return None
+            relative_path = os.path.relpath(file_path, upload_base).replace(os.sep, "/")
+            prefix = current_app.config.get("FILE_OFFLOAD_PREFIX", "/protected-uploads")
+            headers["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{quote(relative_path)}"
+        else:
+            headers["X-Sendfile"] = file_path
+        return Response(status=200, mimetype=mimetype, headers=headers)
+
+    @staticmethod
+    def open_body(
+        file_path: str, start: int = 0, length: Optional[int] = None
+    ) -> Iterable[bytes]:
+        """
+        Открывает файл как тело ответа начиная с позиции start
+
+        Файл передается в wsgi.file_wrapper сервера: gunicorn отправляет его
+        через os.sendfile без копирования в Python. Выигрыш есть только под
+        таким сервером; werkzeug (app.run) обертку не предоставляет, и файл
+        читается блоками в Python. Диапазон ограничивается FileRangeWrapper
+        при любом сервере.
+        """
+        f = open(file_path, "rb")
+        try:
+            if start:
+                f.seek(start)
+            file_size = os.fstat(f.fileno()).st_size
+        except Exception:
+            f.close()
+            raise
+        body = f
+        if length is not None and start + length < file_size:
+            body = FileRangeWrapper(f, length, FileResponseBuilder.BUFFER_SIZE)
+        return wrap_file(request.environ, body, FileResponseBuilder.BUFFER_SIZE)
+
+    @staticmethod
+    def build(
+        file_path: str,
+        mimetype: str,
+        headers: Dict[str, str],
+        status: int = 200,
+        start: int = 0,
+        length: Optional[int] = None,
+    ) -> Response:
+        if length is None:
+            length = os.path.getsize(file_path) - start
+        headers = dict(headers)
+        headers["Content-Length"] = str(length)
+        return Response(
+            FileResponseBuilder.open_body(file_path, start, length),
+            status=status,
+            mimetype=mimetype,
+            headers=headers,
+            direct_passthrough=True,
+        )
+
+    @staticmethod
+    def parse_ranges(
+        range_header: str, file_size: int
+    ) -> Optional[List[Tuple[int, int]]]:
+        """
+        Разбирает заголовок Range (RFC 7233) в список диапазонов (start, end)
+
+        Поддерживаются диапазоны N-M, N- и суффиксные -N. Пересекающиеся и
+        смежные диапазоны объединяются.
+
+        Returns:
+            Optional[List[Tuple[int, int]]]: диапазоны с включительным концом,
+            пустой список, если ни один диапазон не выполним (416), или None,
+            если заголовок некорректен и его нужно игнорировать
+        """
+        unit, _, range_set = range_header.partition("=")
+        if unit.strip().lower() != "bytes" or not range_set.strip():
+            return None
+        specs = [spec.strip() for spec in range_set.split(",") if spec.strip()]
+        if not specs or len(specs) > FileResponseBuilder.MAX_RANGES:
+            return None
+        ranges = []
+        for spec in specs:
+            first, dash, last = spec.partition("-")
+            first, last = first.strip(), last.strip()
+            if not dash:
+                return None
+            if not first:
+                if not last.isdigit():
+                    return None
+                suffix_length = int(last)
+                if suffix_length == 0:
+                    continue
+                start, end = max(file_size - suffix_length, 0), file_size - 1
+            else:
+                if not first.isdigit() or (last and not last.isdigit()):
+                    return None
+                start = int(first)
+                if last and int(last) < start:
+                    return None
+                end = min(int(last), file_size - 1) if last else file_size - 1
+            if start < file_size:
+                ranges.append((start, end))
+        ranges.sort()
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    @staticmethod
+    def build_multipart(
+        file_path: str,
+        mimetype: str,
+        headers: Dict[str, str],
+        ranges: List[Tuple[int, int]],
+        file_size: int,
+    ) -> Response:
+        """Собирает ответ 206 multipart/byteranges для нескольких диапазонов"""
+        boundary = secrets.token_hex(16)
+        parts = []
+        for start, end in ranges:
+            part_header = (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+            ).encode("latin-1")
+            parts.append((part_header, start, end - start + 1))
+        closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        content_length = sum(
+            len(part_header) + length for part_header, _, length in parts
+        )
+
+        def generate():
+            with open(file_path, "rb") as f:
+                for part_header, start, length in parts:
+                    yield part_header
+                    f.seek(start)
+                    yield from FileRangeWrapper(
+                        f, length, FileResponseBuilder.BUFFER_SIZE
+                    )
+            yield closing
+
+        headers = dict(headers)
+        headers["Content-Length"] = str(content_length + len(closing))
+        return Response(
+            generate(),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+            headers=headers,
+            direct_passthrough=True,
+        )
+
+    @staticmethod
+    def accepts_webp() -> bool:
+        """
+        Клиент явно перечислил image/webp в Accept с q > 0
+
+        Шаблоны */* и image/* не учитываются: curl, wget и requests должны
+        получать исходный файл под исходным именем.
+        """
+        return any(
+            value.lower() == "image/webp" and quality > 0
+            for value, quality in request.accept_mimetypes
+        )
+
+    @staticmethod
+    def select_image_variant(
+        mimetype: str, etag: str, webp_path: Optional[str]
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Выбирает WebP-версию изображения по Accept или миниатюру по ?thumbnail=1
+
+        ETag проиндексированной загрузки - это SHA-256 содержимого, по нему
+        находятся производные из ImageVariants. webp_path - уже найденная
+        WebP-версия (ImageVariants.find) или None.
+
+        Returns:
+            Optional[Tuple[str, str]]: (путь, суффикс ETag) или None, если
+            нужно отдать оригинал
+        """
+        if mimetype not in FileResponseBuilder.IMAGE_VARIANT_MIMETYPES:
+            return None
+        if request.args.get("thumbnail"):
+            path = ImageVariants.find(etag, thumbnail=True)
+            if path:
+                return path, "thumb"
+        if webp_path and FileResponseBuilder.accepts_webp():
+            return webp_path, "webp"
+        return None
+
+    @staticmethod
+    def send(
+        file_path: str, filename: str, location: Optional[FileLocation] = None
+    ) -> Response:
+        """
+        Отдает файл с учетом условных запросов, offload, Range и HEAD
+
+        Общий обработчик для /files/<subject_id>/... и файлов решений.
+        Один диапазон отдается как обычный 206 через wsgi.file_wrapper,
+        несколько - как multipart/byteranges. Для JPEG/PNG с готовой
+        WebP-версией ответ зависит от Accept (Vary: Accept).
+        """
+        mimetype = FileResponseBuilder.get_mimetype(filename)
+        etag, last_modified = FileResponseBuilder.get_validators(file_path, location)
+        webp_path = (
+            ImageVariants.find(etag)
+            if mimetype in FileResponseBuilder.IMAGE_VARIANT_MIMETYPES
+            else None
+        )
+        variant = FileResponseBuilder.select_image_variant(mimetype, etag, webp_path)
+        if variant:
+            file_path, suffix = variant
+            filename = f"{os.path.splitext(filename)[0]}.webp"
+            mimetype = "image/webp"
+            etag = f"{etag}-{suffix}"
+            last_modified = datetime.utcfromtimestamp(
+                int(os.path.getmtime(file_path))
+            )
+        response = FileResponseBuilder._send(
+            file_path, filename, mimetype, etag, last_modified
+        )
+        if webp_path:
+            response.vary.add("Accept")
+        return response
+
+    @staticmethod
+    def _send(
+        file_path: str,
+        filename: str,
+        mimetype: str,
+        etag: str,
+        last_modified: Optional[datetime],
+    ) -> Response:
+        if FileResponseBuilder.is_not_modified(etag, last_modified):
+            return FileResponseBuilder.not_modified(filename, etag, last_modified)
+        offloaded = FileResponseBuilder.offload(
+            file_path, mimetype, filename, etag, last_modified
+        )
+        if offloaded:
+            return offloaded
+        file_size = os.path.getsize(file_path)
+        headers = FileResponseBuilder.get_base_headers(filename, etag, last_modified)
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(file_size)
+            return Response(status=200, mimetype=mimetype, headers=headers)
+        range_header = request.headers.get("Range")
+        if range_header and FileResponseBuilder.if_range_matches(etag, last_modified):
+            ranges = FileResponseBuilder.parse_ranges(range_header, file_size)
+            if ranges == []:
+                headers.pop("Content-Disposition")
+                headers["Content-Range"] = f"bytes */{file_size}"
+                return Response(
+                    "Requested Range Not Satisfiable", status=416, headers=headers
+                )
+            if ranges and len(ranges) > 1:
+                return FileResponseBuilder.build_multipart(
+                    file_path, mimetype, headers, ranges, file_size
+                )
+            if ranges:
+                start, end = ranges[0]
+                headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+                return FileResponseBuilder.build(
+                    file_path,
+                    mimetype,
+                    headers,
+                    status=206,
+                    start=start,
+                    length=end - start + 1,
+                )
+        return FileResponseBuilder.build(file_path, mimetype, headers, length=file_size)
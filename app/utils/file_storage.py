@@ -1,12 +1,21 @@
+import errno
 import os
 import shutil
+import uuid
 from datetime import datetime
-from typing import Tuple
+from typing import Optional, Tuple
 
 from flask import current_app
 
+from ..models import BackgroundJob
 from .transliteration import get_safe_filename
+from .blob_store import BlobStore
+from .file_index import FileIndex
 from .file_optimizer import FileOptimizer
+from .image_variants import ImageVariants
+from .job_queue import JobQueue
+
+OPTIMIZE_FILE_JOB = "optimize_file"
 
 
 def safe_path_join(base_path: str, *path_parts: str) -> str:
@@ -138,7 +147,11 @@ class FileStorageManager:
                 current_app.logger.warning(
                     f"Не удалось получить информацию о свободном месте: {e}"
                 )
-            file.save(safe_full_path)
+            previous_sha256 = FileIndex.get_sha256(
+                FileIndex.relative_to_upload(safe_full_path)
+            )
+            sha256 = BlobStore.save_upload(file, safe_full_path)
+            final_path = safe_full_path
             if os.path.exists(safe_full_path):
                 saved_size = os.path.getsize(safe_full_path)
                 current_app.logger.info(f"Файл успешно сохранен: {safe_full_path}")
@@ -150,40 +163,16 @@ class FileStorageManager:
                         f"Размеры не совпадают! Ожидалось: {file_size}, получено: {saved_size}"
                     )
 
-                if FileOptimizer.should_optimize_file(file_name):
-                    current_app.logger.info(f"Запуск оптимизации файла: {file_name}")
-                    try:
-                        success, new_filename = FileOptimizer.optimize_file(
-                            safe_full_path
-                        )
-                        if success:
-                            if new_filename:
-
-                                final_path = os.path.join(
-                                    os.path.dirname(safe_full_path), new_filename
-                                )
-                                current_app.logger.info(
-                                    f"Файл оптимизирован и переименован: {final_path}"
-                                )
-                            else:
-
-                                final_size = os.path.getsize(safe_full_path)
-                                current_app.logger.info(
-                                    f"Файл оптимизирован: {saved_size} -> {final_size} байт"
-                                )
-                        else:
-                            current_app.logger.warning(
-                                f"Ошибка оптимизации файла: {file_name}"
-                            )
-                    except Exception as e:
-                        current_app.logger.error(
-                            f"Исключение при оптимизации файла {file_name}: {e}"
-                        )
             else:
                 current_app.logger.error(
                     f"Файл не найден после сохранения: {safe_full_path}"
                 )
                 return False
+            sha256 = FileStorageManager._register_stored_file(
+                final_path, sha256, previous_sha256
+            )
+            if FileOptimizer.should_optimize_file(file_name):
+                FileStorageManager.enqueue_optimization(final_path, sha256)
             return True
         except Exception as e:
             current_app.logger.error(f"Ошибка сохранения файла {full_path}: {str(e)}")
@@ -192,14 +181,155 @@ class FileStorageManager:
             current_app.logger.error(f"Traceback: {traceback.format_exc()}")
             return False
 
+    @staticmethod
+    def _register_stored_file(
+        full_path: str, sha256: Optional[str], previous_sha256: Optional[str]
+    ) -> str:
+        """Связывает сохраненный файл с хранилищем блобов и индексом"""
+        sha256 = sha256 or FileIndex.compute_sha256(full_path)
+        if FileIndex.relative_to_upload(full_path):
+            BlobStore.store(full_path, sha256)
+        FileIndex.record(full_path, sha256)
+        if previous_sha256 and previous_sha256 != sha256:
+            BlobStore.release(previous_sha256)
+        return sha256
+
+    @staticmethod
+    def enqueue_optimization(full_path: str, sha256: str) -> Optional[BackgroundJob]:
+        """Ставит оптимизацию файла в фоновую очередь вместо выполнения в запросе"""
+        try:
+            return JobQueue.enqueue(
+                OPTIMIZE_FILE_JOB,
+                {"path": os.path.abspath(full_path), "sha256": sha256},
+            )
+        except Exception as e:
+            current_app.logger.warning(
+                f"Не удалось поставить оптимизацию {full_path} в очередь: {e}"
+            )
+            return None
+
+    @staticmethod
+    def run_optimization_job(payload: dict, job: BackgroundJob) -> dict:
+        """
+        Фоновая оптимизация сохраненного файла
+
+        Для изображений из UPLOAD_FOLDER после оптимизации строятся WebP-версия
+        и миниатюра (см. ImageVariants) по итоговому содержимому файла.
+        """
+        result = FileStorageManager._optimize_stored_file(payload, job)
+        full_path = payload["path"]
+        relative_path = FileIndex.relative_to_upload(full_path)
+        if (
+            result.get("reason") not in ("missing", "changed")
+            and relative_path
+            and ImageVariants.is_supported(full_path)
+        ):
+            sha256 = FileIndex.get_sha256(relative_path)
+            result["variants"] = bool(sha256) and ImageVariants.build(
+                full_path, sha256
+            )
+        return result
+
+    @staticmethod
+    def _optimize_stored_file(payload: dict, job: BackgroundJob) -> dict:
+        """
+        Оптимизирует сохраненный файл и подменяет его результатом
+
+        Оптимизатор работает с копией: по исходному пути лежит жесткая ссылка
+        на общий блоб, который нельзя менять на месте. Результат заменяет файл
+        через os.replace и заново регистрируется в хранилище блобов и индексе.
+        Если файл успели заменить или удалить, результат отбрасывается.
+        """
+        full_path = payload["path"]
+        expected_sha256 = payload.get("sha256")
+        if not os.path.exists(full_path):
+            return {"optimized": False, "reason": "missing"}
+        stat = os.stat(full_path)
+        if expected_sha256 and FileIndex.compute_sha256(full_path) != expected_sha256:
+            return {"optimized": False, "reason": "changed"}
+        directory, filename = os.path.split(full_path)
+        work_path = os.path.join(directory, f".{uuid.uuid4().hex}.{filename}")
+        try:
+            shutil.copyfile(full_path, work_path)
+            JobQueue.set_progress(job, 10)
+            success, _ = FileOptimizer.optimize_file(work_path)
+            if not success:
+                return {"optimized": False, "reason": "failed"}
+            optimized_size = os.path.getsize(work_path)
+            if optimized_size >= stat.st_size:
+                return {"optimized": False, "reason": "not_smaller"}
+            current_stat = os.stat(full_path)
+            if (current_stat.st_ino, current_stat.st_mtime_ns) != (
+                stat.st_ino,
+                stat.st_mtime_ns,
+            ):
+                return {"optimized": False, "reason": "changed"}
+            os.replace(work_path, full_path)
+            FileStorageManager._register_stored_file(full_path, None, expected_sha256)
+            current_app.logger.info(
+                f"Файл оптимизирован: {full_path} ({stat.st_size} -> {optimized_size})"
+            )
+            return {
+                "optimized": True,
+                "size_before": stat.st_size,
+                "size_after": optimized_size,
+            }
+        finally:
+            if os.path.exists(work_path):
+                os.remove(work_path)
+
+    @staticmethod
+    def move_uploaded_file(source_path: str, full_path: str, sha256: str) -> bool:
+        """
+        Переносит полностью загруженный файл (см. UploadService) на место
+
+        Перенос - это os.replace без повторного копирования, если DATA_FOLDER
+        на той же файловой системе, что и UPLOAD_FOLDER; иначе файл
+        копируется. SHA-256 посчитан во время загрузки.
+        """
+        try:
+            safe_full_path = safe_path_join(
+                os.path.dirname(full_path), os.path.basename(full_path)
+            )
+            previous_sha256 = FileIndex.get_sha256(
+                FileIndex.relative_to_upload(safe_full_path)
+            )
+            try:
+                os.replace(source_path, safe_full_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                temp_path = f"{safe_full_path}.{uuid.uuid4().hex}.part"
+                shutil.move(source_path, temp_path)
+                os.replace(temp_path, safe_full_path)
+            current_app.logger.info(
+                f"Загруженный файл перенесен: {source_path} -> {safe_full_path}"
+            )
+            FileStorageManager._register_stored_file(
+                safe_full_path, sha256, previous_sha256
+            )
+            if FileOptimizer.should_optimize_file(safe_full_path):
+                FileStorageManager.enqueue_optimization(safe_full_path, sha256)
+            return True
+        except (OSError, ValueError) as e:
+            current_app.logger.error(
+                f"Ошибка переноса загруженного файла {source_path}: {e}"
+            )
+            return False
+
     @staticmethod
     def delete_file(relative_path: str) -> bool:
         try:
+            sha256 = FileIndex.get_sha256(relative_path)
+            FileIndex.forget(relative_path)
             static_folder = current_app.static_folder
-            full_path = os.path.join(static_folder, relative_path)
-            if os.path.exists(full_path):
-                os.remove(full_path)
-                return True
+            upload_base = current_app.config.get("UPLOAD_FOLDER", "app/static/uploads")
+            for base in (static_folder, upload_base):
+                full_path = os.path.join(base, relative_path)
+                if os.path.exists(full_path):
+                    os.remove(full_path)
+                    BlobStore.release(sha256)
+                    return True
             return False
         except Exception as e:
             current_app.logger.error(f"Ошибка удаления файла {relative_path}: {str(e)}")
@@ -241,6 +371,7 @@ class FileStorageManager:
                             user_path = os.path.join(users_path, str(user_id))
                             if os.path.exists(user_path):
                                 shutil.rmtree(user_path)
+            BlobStore.release_all(FileIndex.forget_user(user_id))
             return True
         except Exception as e:
             current_app.logger.error(
@@ -355,3 +486,8 @@ class FileStorageManager:
             size_bytes /= 1024.0
             i += 1
         return f"{size_bytes:.1f} {size_names[i]}"
+
+
+JobQueue.register(
+    OPTIMIZE_FILE_JOB, FileStorageManager.run_optimization_job, concurrency=2
+)
@@ -0,0 +1,173 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from .model_changes import ModelChanges
+
+
+class LocalFragmentBackend:
+    """
+    LRU фрагментов в памяти процесса с ограничением по числу записей
+
+    Поколения моделей хранятся в файлах-метках (ModelChanges.get_generation):
+    сброс в одном процессе виден остальным процессам на этом же сервере.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_generation(self, name: str) -> str:
+        return ModelChanges.get_generation(f"fragment-{name}")
+
+    def bump_generation(self, name: str) -> None:
+        ModelChanges.bump_generation(f"fragment-{name}")
+
+
+class RedisFragmentBackend:
+    """Общий для всех процессов и серверов кэш фрагментов в Redis"""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self.client.set(key, value.encode("utf-8"), ex=ttl)
+
+    def get_generation(self, name: str) -> str:
+        value = self.client.get(f"fragment-generation:{name}")
+        return value.decode("utf-8") if value is not None else "0"
+
+    def bump_generation(self, name: str) -> None:
+        self.client.incr(f"fragment-generation:{name}")
+
+
+class FragmentCache:
+    """
+    Кэш отрендеренных фрагментов шаблонов: {% cache key, ttl %}...{% endcache %}
+
+    В ключ фрагмента входят поколения моделей Subject, Material и
+    SubjectGroup; commit, изменивший любую из них, сдвигает ее поколение,
+    и все фрагменты перестают находиться. Нулевой или пустой ttl
+    отключает кэш для конкретного рендера. Пока один поток рендерит
+    фрагмент, остальные запросы того же ключа в процессе ждут его
+    результата вместо параллельной пересборки.
+    """
+
+    MODELS = ("Subject", "Material", "SubjectGroup")
+    RENDER_WAIT_SECONDS = 10
+
+    _inflight: Dict[str, threading.Event] = {}
+    _inflight_lock = threading.Lock()
+
+    @staticmethod
+    def get_backend():
+        backend = current_app.extensions.get("fragment_cache")
+        if backend is not None:
+            return backend
+        redis_url = current_app.config.get("FRAGMENT_CACHE_REDIS_URL")
+        if redis_url:
+            try:
+                backend = RedisFragmentBackend(redis_url)
+            except ImportError:
+                current_app.logger.warning(
+                    "FRAGMENT_CACHE_REDIS_URL задан, но пакет redis не установлен"
+                )
+        if backend is None:
+            backend = LocalFragmentBackend(
+                current_app.config.get("FRAGMENT_CACHE_MAX_ENTRIES", 512)
+            )
+        current_app.extensions["fragment_cache"] = backend
+        return backend
+
+    @staticmethod
+    def make_key(key: Any) -> str:
+        backend = FragmentCache.get_backend()
+        generations = [backend.get_generation(name) for name in FragmentCache.MODELS]
+        digest = hashlib.sha256(repr((key, generations)).encode("utf-8"))
+        return f"fragment:{digest.hexdigest()[:40]}"
+
+    @staticmethod
+    def get_or_render(key: Any, ttl: Optional[int], render: Callable[[], str]) -> str:
+        if not ttl:
+            return render()
+        backend = FragmentCache.get_backend()
+        full_key = FragmentCache.make_key(key)
+        value = backend.get(full_key)
+        if value is not None:
+            return value
+        with FragmentCache._inflight_lock:
+            rendering = FragmentCache._inflight.get(full_key)
+            if rendering is None:
+                FragmentCache._inflight[full_key] = threading.Event()
+        if rendering is not None:
+            rendering.wait(FragmentCache.RENDER_WAIT_SECONDS)
+            value = backend.get(full_key)
+            return value if value is not None else render()
+        try:
+            value = str(render())
+            backend.set(full_key, value, int(ttl))
+            return value
+        finally:
+            with FragmentCache._inflight_lock:
+                FragmentCache._inflight.pop(full_key).set()
+
+    @staticmethod
+    def invalidate(model_names: Iterable[str]) -> None:
+        backend = FragmentCache.get_backend()
+        for name in model_names:
+            backend.bump_generation(name)
+
+
+class FragmentCacheExtension(Extension):
+    """Тег {% cache key, ttl %}...{% endcache %} поверх FragmentCache"""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        parser.stream.expect("comma")
+        args.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render", args), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, key: Any, ttl: Optional[int], caller) -> Markup:
+        return Markup(FragmentCache.get_or_render(key, ttl, caller))
+
+
+ModelChanges.subscribe(FragmentCache.MODELS, FragmentCache.invalidate)
@@ -0,0 +1,180 @@
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from flask import current_app
+
+from ..models import FileLocation
+from .file_index import FileIndex
+
+
+def _save_atomic(image, target_path: str, **params) -> None:
+    """Сохраняет изображение во временный файл и переносит его на место"""
+    temp_path = f"{target_path}.{uuid.uuid4().hex}.part"
+    try:
+        image.save(temp_path, **params)
+        os.replace(temp_path, target_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class ImageVariants:
+    """
+    Производные изображений: WebP-версия и миниатюра фиксированного размера
+
+    Лежат в DATA_FOLDER/.variants/ab/<sha256>.webp и <sha256>.thumb.webp.
+    Пути загрузок - жесткие ссылки на общие блобы (см. BlobStore), поэтому
+    производные привязаны к содержимому, а не к имени: одинаковые картинки
+    делят одну WebP-версию, а замененный файл не получит устаревшую.
+    """
+
+    VARIANT_DIR = ".variants"
+    SOURCE_EXTENSIONS = {"jpg", "jpeg", "png", "bmp"}
+    THUMBNAIL_SIZE = (320, 320)
+    WEBP_QUALITY = 85
+    THUMBNAIL_QUALITY = 75
+    SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+    @staticmethod
+    def is_supported(filename: str) -> bool:
+        extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+        return extension in ImageVariants.SOURCE_EXTENSIONS
+
+    @staticmethod
+    def _variant_base() -> str:
+        data_base = current_app.config.get("DATA_FOLDER", current_app.instance_path)
+        return os.path.join(os.path.abspath(data_base), ImageVariants.VARIANT_DIR)
+
+    @staticmethod
+    def get_paths(sha256: str) -> Tuple[str, str]:
+        """Возвращает пути (webp, миниатюра) для содержимого с данным SHA-256"""
+        directory = os.path.join(ImageVariants._variant_base(), sha256[:2])
+        return (
+            os.path.join(directory, f"{sha256}.webp"),
+            os.path.join(directory, f"{sha256}.thumb.webp"),
+        )
+
+    @staticmethod
+    def find(sha256: Optional[str], thumbnail: bool = False) -> Optional[str]:
+        if not sha256 or not ImageVariants.SHA256_RE.match(sha256):
+            return None
+        webp_path, thumb_path = ImageVariants.get_paths(sha256)
+        path = thumb_path if thumbnail else webp_path
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def render(source_path: str, webp_path: str, thumb_path: str) -> bool:
+        """
+        Строит WebP-версию и миниатюру одного изображения
+
+        Не использует current_app, поэтому выполняется и в ProcessPoolExecutor.
+        PNG и BMP (обычно скриншоты) кодируются в WebP без потерь, JPEG - с
+        качеством WEBP_QUALITY. WebP-версия сохраняется, только если она
+        меньше оригинала; миниатюра строится всегда.
+        """
+        from PIL import Image, ImageOps
+
+        os.makedirs(os.path.dirname(webp_path), exist_ok=True)
+        with Image.open(source_path) as original:
+            lossless = original.format in ("PNG", "BMP")
+            icc_profile = original.info.get("icc_profile")
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+            if not os.path.exists(webp_path):
+                params = {"format": "WEBP", "method": 6, "icc_profile": icc_profile}
+                if lossless:
+                    params["lossless"] = True
+                else:
+                    params["quality"] = ImageVariants.WEBP_QUALITY
+                _save_atomic(image, webp_path, **params)
+                if os.path.getsize(webp_path) >= os.path.getsize(source_path):
+                    os.remove(webp_path)
+
+            if not os.path.exists(thumb_path):
+                thumbnail = image.copy()
+                thumbnail.thumbnail(ImageVariants.THUMBNAIL_SIZE, Image.LANCZOS)
+                _save_atomic(
+                    thumbnail,
+                    thumb_path,
+                    format="WEBP",
+                    quality=ImageVariants.THUMBNAIL_QUALITY,
+                    method=6,
+                    icc_profile=icc_profile,
+                )
+        return True
+
+    @staticmethod
+    def build(full_path: str, sha256: str) -> bool:
+        """Строит производные сохраненного изображения, если их еще нет"""
+        if not ImageVariants.is_supported(full_path):
+            return False
+        webp_path, thumb_path = ImageVariants.get_paths(sha256)
+        if os.path.exists(thumb_path):
+            return True
+        try:
+            ImageVariants.render(full_path, webp_path, thumb_path)
+        except Exception as e:
+            current_app.logger.warning(
+                f"Ошибка построения WebP/миниатюры для {full_path}: {e}"
+            )
+            return False
+        current_app.logger.info(f"Построены WebP и миниатюра для {full_path}")
+        return True
+
+    @staticmethod
+    def release(sha256: Optional[str]) -> None:
+        """Удаляет производные, когда блоб с этим содержимым удален"""
+        if not sha256 or not ImageVariants.SHA256_RE.match(sha256):
+            return
+        for path in ImageVariants.get_paths(sha256):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                current_app.logger.warning(f"Ошибка удаления {path}: {e}")
+
+    @staticmethod
+    def build_missing(workers: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Строит недостающие производные для всех проиндексированных изображений
+
+        Кодирование идет в пуле процессов (по умолчанию по числу ядер).
+
+        Returns:
+            Tuple[int, int]: (построено, ошибок)
+        """
+        tasks: List[Tuple[str, str, str]] = []
+        seen = set()
+        for location in FileLocation.query.order_by(FileLocation.id).all():
+            if (
+                not location.sha256
+                or location.sha256 in seen
+                or not ImageVariants.is_supported(location.filename)
+            ):
+                continue
+            seen.add(location.sha256)
+            webp_path, thumb_path = ImageVariants.get_paths(location.sha256)
+            if os.path.exists(thumb_path):
+                continue
+            tasks.append((FileIndex.get_full_path(location), webp_path, thumb_path))
+        built = failed = 0
+        if not tasks:
+            return built, failed
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(ImageVariants.render, *task) for task in tasks]
+            for task, future in zip(tasks, futures, strict=True):
+                try:
+                    future.result()
+                    built += 1
+                except Exception as e:
+                    failed += 1
+                    current_app.logger.warning(
+                        f"Ошибка построения WebP/миниатюры для {task[0]}: {e}"
+                    )
+        return built, failed
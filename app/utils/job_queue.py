@@ -0,0 +1,303 @@
+import json
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import exists, func, insert, literal, select, update
+from sqlalchemy.orm import aliased
+
+from .. import db
+from ..models import BackgroundJob
+
+
+class JobQueue:
+    """
+    Персистентная очередь фоновых задач в таблице BackgroundJob
+
+    Обработчики регистрируются по виду задачи (kind) вместе с лимитом
+    одновременно выполняемых задач этого вида. Задачи выполняют процессы
+    JobQueue.run_worker (см. run.py); лимит проверяется при захвате задачи
+    и действует на все процессы сразу.
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    RETRY_DELAY_SECONDS = 30
+    STALE_TIMEOUT_SECONDS = 30 * 60
+
+    _handlers: Dict[str, Tuple[Callable[[Dict[str, Any], BackgroundJob], Any], int]] = {}
+    _intervals: Dict[str, int] = {}
+
+    @staticmethod
+    def register(
+        kind: str,
+        handler: Callable[[Dict[str, Any], BackgroundJob], Any],
+        concurrency: int = 1,
+        interval: Optional[int] = None,
+    ) -> None:
+        """
+        Регистрирует обработчик задач вида kind
+
+        С interval (в секундах) задача становится периодической: исполнители
+        сами ставят ее в очередь через interval после завершения предыдущей.
+        """
+        JobQueue._handlers[kind] = (handler, concurrency)
+        if interval:
+            JobQueue._intervals[kind] = interval
+
+    @staticmethod
+    def get_concurrency(kind: str) -> int:
+        _, default = JobQueue._handlers.get(kind, (None, 1))
+        limits = current_app.config.get("JOB_CONCURRENCY") or {}
+        return max(int(limits.get(kind, default)), 1)
+
+    @staticmethod
+    def get_interval(kind: str) -> int:
+        intervals = current_app.config.get("JOB_INTERVALS") or {}
+        return max(int(intervals.get(kind, JobQueue._intervals[kind])), 1)
+
+    @staticmethod
+    def schedule_periodic() -> int:
+        """
+        Ставит в очередь периодические задачи, у которых нет активного экземпляра
+
+        Вставка - условный INSERT ... SELECT WHERE NOT EXISTS: несколько
+        исполнителей, планирующих одновременно, не создадут дубликатов.
+        """
+        scheduled = 0
+        for kind in JobQueue._intervals:
+            last_finished = (
+                BackgroundJob.query.filter(
+                    BackgroundJob.kind == kind, BackgroundJob.finished_at.isnot(None)
+                )
+                .order_by(BackgroundJob.finished_at.desc())
+                .first()
+            )
+            now = datetime.utcnow()
+            run_after = now
+            if last_finished:
+                run_after = max(
+                    run_after,
+                    last_finished.finished_at
+                    + timedelta(seconds=JobQueue.get_interval(kind)),
+                )
+            active = select(BackgroundJob.id).where(
+                BackgroundJob.kind == kind,
+                BackgroundJob.status.in_(
+                    [JobQueue.STATUS_PENDING, JobQueue.STATUS_RUNNING]
+                ),
+            )
+            values = {
+                "kind": kind,
+                "payload": "{}",
+                "status": JobQueue.STATUS_PENDING,
+                "attempts": 0,
+                "max_attempts": 1,
+                "progress": 0,
+                "run_after": run_after,
+                "created_at": now,
+                "updated_at": now,
+            }
+            result = db.session.execute(
+                insert(BackgroundJob).from_select(
+                    list(values),
+                    select(
+                        *(
+                            literal(value, BackgroundJob.__table__.c[name].type)
+                            for name, value in values.items()
+                        )
+                    ).where(~exists(active)),
+                )
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                current_app.logger.info(
+                    f"Периодическая задача {kind} поставлена в очередь"
+                )
+                scheduled += 1
+        return scheduled
+
+    @staticmethod
+    def enqueue(
+        kind: str,
+        payload: Optional[Dict[str, Any]] = None,
+        max_attempts: int = 3,
+        run_after: Optional[datetime] = None,
+    ) -> BackgroundJob:
+        job = BackgroundJob(
+            kind=kind,
+            payload=json.dumps(payload or {}, ensure_ascii=False),
+            status=JobQueue.STATUS_PENDING,
+            max_attempts=max_attempts,
+            run_after=run_after or datetime.utcnow(),
+        )
+        db.session.add(job)
+        db.session.commit()
+        current_app.logger.info(f"Задача {job.id} ({kind}) поставлена в очередь")
+        return job
+
+    @staticmethod
+    def get_payload(job: BackgroundJob) -> Dict[str, Any]:
+        return json.loads(job.payload or "{}")
+
+    @staticmethod
+    def get_result(job: BackgroundJob) -> Any:
+        return json.loads(job.result) if job.result else None
+
+    @staticmethod
+    def set_progress(job: BackgroundJob, progress: int) -> None:
+        job.progress = max(0, min(int(progress), 100))
+        db.session.commit()
+
+    @staticmethod
+    def claim(worker_id: str) -> Optional[BackgroundJob]:
+        """
+        Захватывает следующую готовую задачу с учетом лимитов по видам
+
+        Захват - условный UPDATE: задача должна быть еще pending, а число
+        выполняющихся задач того же вида - меньше лимита. Поэтому несколько
+        процессов не возьмут одну задачу и не превысят лимит.
+        """
+        if not JobQueue._handlers:
+            return None
+        now = datetime.utcnow()
+        candidates = (
+            BackgroundJob.query.filter(
+                BackgroundJob.status == JobQueue.STATUS_PENDING,
+                BackgroundJob.kind.in_(list(JobQueue._handlers)),
+                BackgroundJob.run_after <= now,
+            )
+            .order_by(BackgroundJob.run_after, BackgroundJob.id)
+            .limit(20)
+            .all()
+        )
+        running_job = aliased(BackgroundJob)
+        for job in candidates:
+            running_count = (
+                select(func.count(running_job.id))
+                .where(
+                    running_job.kind == job.kind,
+                    running_job.status == JobQueue.STATUS_RUNNING,
+                )
+                .scalar_subquery()
+            )
+            result = db.session.execute(
+                update(BackgroundJob)
+                .where(
+                    BackgroundJob.id == job.id,
+                    BackgroundJob.status == JobQueue.STATUS_PENDING,
+                    running_count < JobQueue.get_concurrency(job.kind),
+                )
+                .values(
+                    status=JobQueue.STATUS_RUNNING,
+                    locked_by=worker_id,
+                    locked_at=now,
+                    attempts=BackgroundJob.attempts + 1,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                db.session.refresh(job)
+                return job
+        return None
+
+    @staticmethod
+    def run_job(job: BackgroundJob) -> bool:
+        handler, _ = JobQueue._handlers[job.kind]
+        job_id = job.id
+        try:
+            result = handler(JobQueue.get_payload(job), job)
+            job.status = JobQueue.STATUS_DONE
+            job.progress = 100
+            job.result = (
+                json.dumps(result, ensure_ascii=False) if result is not None else None
+            )
+            job.error = None
+            job.finished_at = datetime.utcnow()
+            job.locked_by = None
+            db.session.commit()
+            current_app.logger.info(f"Задача {job_id} ({job.kind}) выполнена")
+            return True
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(BackgroundJob, job_id)
+            current_app.logger.error(f"Ошибка выполнения задачи {job_id}: {e}")
+            if job is None:
+                return False
+            job.error = str(e)
+            job.locked_by = None
+            if job.attempts >= job.max_attempts:
+                job.status = JobQueue.STATUS_FAILED
+                job.finished_at = datetime.utcnow()
+            else:
+                job.status = JobQueue.STATUS_PENDING
+                job.run_after = datetime.utcnow() + timedelta(
+                    seconds=JobQueue.RETRY_DELAY_SECONDS * job.attempts
+                )
+            db.session.commit()
+            return False
+
+    @staticmethod
+    def requeue_stale(timeout_seconds: Optional[int] = None) -> int:
+        """Возвращает в очередь задачи, чей процесс-исполнитель пропал"""
+        timeout_seconds = timeout_seconds or JobQueue.STALE_TIMEOUT_SECONDS
+        cutoff = datetime.utcnow() - timedelta(seconds=timeout_seconds)
+        stale_jobs = BackgroundJob.query.filter(
+            BackgroundJob.status == JobQueue.STATUS_RUNNING,
+            BackgroundJob.locked_at < cutoff,
+        ).all()
+        for job in stale_jobs:
+            current_app.logger.warning(
+                f"Задача {job.id} ({job.kind}) зависла у {job.locked_by}, перезапуск"
+            )
+            job.locked_by = None
+            if job.attempts >= job.max_attempts:
+                job.status = JobQueue.STATUS_FAILED
+                job.error = "Превышено время выполнения"
+                job.finished_at = datetime.utcnow()
+            else:
+                job.status = JobQueue.STATUS_PENDING
+        db.session.commit()
+        return len(stale_jobs)
+
+    @staticmethod
+    def run_pending(worker_id: Optional[str] = None, max_jobs: int = 100) -> int:
+        """Выполняет готовые задачи в текущем процессе, возвращает их число"""
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        processed = 0
+        while processed < max_jobs:
+            job = JobQueue.claim(worker_id)
+            if not job:
+                break
+            JobQueue.run_job(job)
+            processed += 1
+        return processed
+
+    @staticmethod
+    def run_worker(worker_id: Optional[str] = None, poll_interval: float = 1.0) -> None:
+        """Бесконечный цикл процесса-исполнителя; вызывается внутри app_context"""
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        current_app.logger.info(f"Исполнитель фоновых задач {worker_id} запущен")
+        last_stale_check = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_stale_check > 60:
+                    JobQueue.requeue_stale()
+                    JobQueue.schedule_periodic()
+                    last_stale_check = time.monotonic()
+                processed = JobQueue.run_pending(worker_id, max_jobs=1)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Ошибка исполнителя {worker_id}: {e}")
+                processed = 0
+            finally:
+                db.session.remove()
+            if not processed:
+                time.sleep(poll_interval)
@@ -0,0 +1,109 @@
+import os
+import uuid
+from typing import Callable, Iterable, List, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+CHANGED_MODELS_KEY = "changed_models"
+
+
+class ModelChanges:
+    """
+    Подписки на изменения моделей, вызываемые после успешного commit
+
+    Изменившиеся модели собираются по flush (new/dirty/deleted) и по
+    массовым UPDATE/DELETE через Query.update()/delete(). Подписчик
+    получает имена изменившихся моделей из тех, на которые подписан;
+    после rollback накопленные изменения отбрасываются.
+    """
+
+    GENERATION_DIR = ".generations"
+
+    _subscribers: List[Tuple[Set[str], Callable[[Set[str]], None]]] = []
+
+    @staticmethod
+    def subscribe(
+        model_names: Iterable[str], callback: Callable[[Set[str]], None]
+    ) -> None:
+        ModelChanges._subscribers.append((set(model_names), callback))
+
+    @staticmethod
+    def _generation_path(name: str) -> str:
+        data_base = current_app.config.get("DATA_FOLDER", current_app.instance_path)
+        return os.path.join(
+            os.path.abspath(data_base), ModelChanges.GENERATION_DIR, name
+        )
+
+    @staticmethod
+    def get_generation(name: str) -> str:
+        """
+        Поколение именованного кэша, общее для процессов этого сервера
+
+        Поколение - inode и mtime файла-метки в DATA_FOLDER/.generations,
+        поэтому проверка стоит один stat, а сброс в одном процессе сразу
+        виден остальным.
+        """
+        try:
+            stat = os.stat(ModelChanges._generation_path(name))
+        except OSError:
+            return "0"
+        return f"{stat.st_ino}-{stat.st_mtime_ns}"
+
+    @staticmethod
+    def bump_generation(name: str) -> None:
+        marker_path = ModelChanges._generation_path(name)
+        os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+        temp_path = f"{marker_path}.{uuid.uuid4().hex}"
+        with open(temp_path, "w") as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(temp_path, marker_path)
+
+    @staticmethod
+    def _record(session: Session, model_names: Iterable[str]) -> None:
+        session.info.setdefault(CHANGED_MODELS_KEY, set()).update(model_names)
+
+    @staticmethod
+    def _after_flush(session: Session, flush_context) -> None:
+        ModelChanges._record(
+            session,
+            {
+                type(instance).__name__
+                for instance in (*session.new, *session.dirty, *session.deleted)
+            },
+        )
+
+    @staticmethod
+    def _do_orm_execute(orm_execute_state) -> None:
+        if orm_execute_state.is_update or orm_execute_state.is_delete:
+            ModelChanges._record(
+                orm_execute_state.session,
+                {mapper.class_.__name__ for mapper in orm_execute_state.all_mappers},
+            )
+
+    @staticmethod
+    def _after_commit(session: Session) -> None:
+        changed = session.info.pop(CHANGED_MODELS_KEY, None)
+        if not changed:
+            return
+        for model_names, callback in ModelChanges._subscribers:
+            matched = changed & model_names
+            if not matched:
+                continue
+            try:
+                callback(matched)
+            except Exception as e:
+                current_app.logger.error(
+                    f"Ошибка обработчика изменений {sorted(matched)}: {e}"
+                )
+
+    @staticmethod
+    def _after_rollback(session: Session) -> None:
+        session.info.pop(CHANGED_MODELS_KEY, None)
+
+
+event.listen(Session, "after_flush", ModelChanges._after_flush)
+event.listen(Session, "do_orm_execute", ModelChanges._do_orm_execute)
+event.listen(Session, "after_commit", ModelChanges._after_commit)
+event.listen(Session, "after_rollback", ModelChanges._after_rollback)
@@ -1,19 +1,29 @@
-import base64
+import threading
+import time
 import uuid
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
 
 import requests
 from flask import current_app
 
 from ..models import Payment, User, db
+from .subscription_state import SubscriptionState
+from .yookassa_client import CircuitOpenError, YooKassaClient
 
 
 class YooKassaService:
+    TERMINAL_STATUSES = ("succeeded", "canceled")
+    STATUS_WAIT_SECONDS = 10
+
+    _status_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+    _status_inflight: Dict[str, threading.Event] = {}
+    _status_lock = threading.Lock()
+
     def __init__(self) -> None:
         self.shop_id = current_app.config["YOOKASSA_SHOP_ID"]
         self.secret_key = current_app.config["YOOKASSA_SECRET_KEY"]
-        self.base_url = "https://api.yookassa.ru/v3"
         if not self.shop_id or not self.secret_key:
             current_app.logger.warning(
                 "Ключи ЮKassa не настроены, используется режим симуляции"
@@ -23,10 +33,6 @@ class YooKassaService:
             self.simulation_mode = False
             current_app.logger.info("Режим реальных платежей ЮKassa активирован")
 
-    def _get_auth_header(self) -> str:
-        auth_string = f"{self.shop_id}:{self.secret_key}"
-        return base64.b64encode(auth_string.encode()).decode()
-
     def _get_subscription_days(self, amount: float) -> int:
         prices = current_app.config["SUBSCRIPTION_PRICES"]
         if amount == prices.get("1", 99.0):
@@ -44,37 +50,33 @@ class YooKassaService:
             return 30
 
     def _make_api_request(
-        self, endpoint: str, method: str = "GET", data: Dict[str, Any] = None
+        self,
+        endpoint: str,
+        method: str = "GET",
+        data: Optional[Dict[str, Any]] = None,
+        idempotence_key: Optional[str] = None,
     ) -> Dict[str, Any]:
         if self.simulation_mode:
             current_app.logger.info(f"Симуляция API запроса: {method} {endpoint}")
             return {"simulation": True, "status": "success"}
-        url = f"{self.base_url}/{endpoint}"
-        headers = {
-            "Authorization": f"Basic {self._get_auth_header()}",
-            "Content-Type": "application/json",
-            "Idempotence-Key": str(uuid.uuid4()),
-        }
+        if method not in ("GET", "POST"):
+            raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
         try:
-            timeout = 30
-            if method == "GET":
-                response = requests.get(url, headers=headers, timeout=timeout)
-            elif method == "POST":
-                response = requests.post(
-                    url, headers=headers, json=data, timeout=timeout
-                )
-            else:
-                raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
-            if response.status_code == 200:
-                return response.json()
-            else:
-                current_app.logger.error(
-                    f"Ошибка API ЮKassa: {response.status_code} - {response.text}"
-                )
-                return {"error": f"HTTP {response.status_code}"}
+            response = YooKassaClient.get().request(
+                method, endpoint, data=data, idempotence_key=idempotence_key
+            )
+        except CircuitOpenError as e:
+            current_app.logger.warning(f"Запрос {method} {endpoint} отклонен: {e}")
+            return {"error": str(e)}
         except requests.exceptions.RequestException as e:
             current_app.logger.error(f"Ошибка сетевого запроса к ЮKassa: {str(e)}")
             return {"error": str(e)}
+        if response.status_code == 200:
+            return response.json()
+        current_app.logger.error(
+            f"Ошибка API ЮKassa: {response.status_code} - {response.text}"
+        )
+        return {"error": f"HTTP {response.status_code}"}
 
     def create_smart_payment(
         self, user: User, return_url: str, price: float = None
@@ -183,7 +185,9 @@ class YooKassaService:
                 current_app.logger.info(
                     f"Отправляем данные платежа в ЮKassa: {payment_data}"
                 )
-                api_response = self._make_api_request("payments", "POST", payment_data)
+                api_response = self._make_api_request(
+                    "payments", "POST", payment_data, idempotence_key=payment_id
+                )
                 if "error" in api_response:
                     current_app.logger.error(
                         f"Ошибка создания платежа в ЮKassa: {api_response['error']}"
@@ -215,6 +219,67 @@ class YooKassaService:
             current_app.logger.error(f"Ошибка при создании платежа: {str(e)}")
             raise e
 
+    def list_payments(
+        self, created_from: datetime, created_to: datetime, page_size: int = 100
+    ) -> Dict[str, Any]:
+        """
+        Все платежи, созданные в ЮKassa в промежутке [created_from, created_to)
+
+        Страницы списка запрашиваются по курсору; при ошибке любой страницы
+        возвращается {"error": ...}.
+        """
+        params = {
+            "created_at.gte": created_from.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "created_at.lt": created_to.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "limit": page_size,
+        }
+        items: List[Dict[str, Any]] = []
+        while True:
+            page = self._make_api_request(f"payments?{urlencode(params)}")
+            if "error" in page:
+                return page
+            items.extend(page.get("items", []))
+            if not page.get("next_cursor"):
+                return {"items": items}
+            params["cursor"] = page["next_cursor"]
+
+    def _fetch_payment(self, payment_id: str) -> Dict[str, Any]:
+        """
+        Ответ API по платежу, кэшируемый на PAYMENT_STATUS_CACHE_SECONDS
+
+        Пока один поток запрашивает платеж, остальные запросы того же
+        платежа в процессе ждут его ответа вместо своего вызова API.
+        Ошибки не кэшируются.
+        """
+        ttl = current_app.config.get("PAYMENT_STATUS_CACHE_SECONDS", 5)
+        cache = YooKassaService._status_cache
+        with YooKassaService._status_lock:
+            cached = cache.get(payment_id)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            fetching = YooKassaService._status_inflight.get(payment_id)
+            if fetching is None:
+                YooKassaService._status_inflight[payment_id] = threading.Event()
+        if fetching is not None:
+            fetching.wait(YooKassaService.STATUS_WAIT_SECONDS)
+            with YooKassaService._status_lock:
+                cached = cache.get(payment_id)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            return self._make_api_request(f"payments/{payment_id}")
+        try:
+            api_response = self._make_api_request(f"payments/{payment_id}")
+            if ttl and "error" not in api_response:
+                now = time.monotonic()
+                with YooKassaService._status_lock:
+                    for key in [k for k, v in cache.items() if v[0] <= now]:
+                        del cache[key]
+                    cache[payment_id] = (now + ttl, api_response)
+            return api_response
+        finally:
+            with YooKassaService._status_lock:
+                YooKassaService._status_inflight.pop(payment_id).set()
+
     def get_payment_status(self, payment_id: str) -> Dict[str, Any]:
         try:
             current_app.logger.info(f"Получение статуса платежа: {payment_id}")
@@ -224,6 +289,16 @@ class YooKassaService:
             if not payment_record:
                 current_app.logger.error(f"Платеж {payment_id} не найден в базе данных")
                 return {"error": "Платеж не найден"}
+            if payment_record.status in YooKassaService.TERMINAL_STATUSES:
+                return {
+                    "payment_id": payment_id,
+                    "status": payment_record.status,
+                    "amount": str(payment_record.amount),
+                    "currency": payment_record.currency or "RUB",
+                    "description": payment_record.description,
+                    "created_at": payment_record.created_at.isoformat(),
+                    "paid": payment_record.status == "succeeded",
+                }
             if self.simulation_mode:
                 current_app.logger.info(
                     f"Симуляционный режим: проверяем платеж {payment_id}"
@@ -268,15 +343,17 @@ class YooKassaService:
                         "paid": False,
                     }
             else:
-                api_response = self._make_api_request(f"payments/{payment_id}")
+                api_response = self._fetch_payment(payment_id)
                 if "error" in api_response:
                     current_app.logger.error(
                         f"Ошибка получения статуса платежа: {api_response['error']}"
                     )
                     return api_response
-                payment_record.status = api_response.get("status", "pending")
-                payment_record.updated_at = datetime.utcnow()
-                db.session.commit()
+                status = api_response.get("status", "pending")
+                if payment_record.status != status and status != "succeeded":
+                    payment_record.status = status
+                    payment_record.updated_at = datetime.utcnow()
+                    db.session.commit()
                 return {
                     "payment_id": payment_id,
                     "status": api_response.get("status", "pending"),
@@ -307,6 +384,9 @@ class YooKassaService:
             if not payment_record:
                 current_app.logger.error(f"Платеж {payment_id} не найден в базе данных")
                 return False
+            if payment_record.status == "succeeded":
+                current_app.logger.info(f"Платеж {payment_id} уже обработан")
+                return True
             payment_status = self.get_payment_status(payment_id)
             if payment_status.get("status") != "succeeded":
                 current_app.logger.warning(
@@ -335,159 +415,10 @@ class YooKassaService:
             return False
 
     def check_user_subscription(self, user: User) -> bool:
-        now = datetime.utcnow()
-        trial_active = False
-        if user.is_trial_subscription:
-            if (
-                user.trial_subscription_expires
-                and user.trial_subscription_expires < now
-            ):
-                user.is_trial_subscription = False
-                user.trial_subscription_expires = None
-                db.session.commit()
-                current_app.logger.info(
-                    f"Пробная подписка пользователя {user.username} истекла"
-                )
-            else:
-                trial_active = True
-        regular_active = False
-        if user.is_subscribed:
-            if user.is_manual_subscription:
-                current_app.logger.info(
-                    f"Пользователь {user.username} имеет ручно выданную подписку"
-                )
-                if user.subscription_expires and user.subscription_expires < now:
-                    user.is_subscribed = False
-                    user.is_manual_subscription = False
-                    db.session.commit()
-                    current_app.logger.info(
-                        f"Ручная подписка пользователя {user.username} истекла"
-                    )
-                else:
-                    regular_active = True
-            else:
-                successful_payment = (
-                    Payment.query.filter_by(user_id=user.id, status="succeeded")
-                    .order_by(Payment.created_at.desc())
-                    .first()
-                )
-                if not successful_payment:
-                    user.is_subscribed = False
-                    db.session.commit()
-                    current_app.logger.warning(
-                        f"Пользователь {user.username} имеет подписку без успешного платежа - сброс"
-                    )
-                elif user.subscription_expires and user.subscription_expires < now:
-                    user.is_subscribed = False
-                    db.session.commit()
-                else:
-                    regular_active = True
-        if trial_active and regular_active:
-            trial_expires = user.trial_subscription_expires or now
-            regular_expires = user.subscription_expires or now
-            if regular_expires > trial_expires:
-                user.is_trial_subscription = False
-                user.trial_subscription_expires = None
-                db.session.commit()
-                current_app.logger.info(
-                    f"Пользователь {user.username} имеет обычную подписку, отключаем тестовую"
-                )
-                return True
-            else:
-                user.is_subscribed = False
-                user.is_manual_subscription = False
-                db.session.commit()
-                current_app.logger.info(
-                    f"Пользователь {user.username} имеет тестовую подписку, отключаем обычную"
-                )
-                return True
-        return trial_active or regular_active
+        return SubscriptionState.is_active(user)
 
     def get_subscription_info(self, user: User) -> dict:
-        now = datetime.utcnow()
-        trial_active = False
-        trial_expires = None
-        if user.is_trial_subscription:
-            if not user.trial_subscription_expires:
-                trial_active = True
-                trial_expires = None
-            elif user.trial_subscription_expires < now:
-                user.is_trial_subscription = False
-                user.trial_subscription_expires = None
-                db.session.commit()
-            else:
-                trial_active = True
-                trial_expires = user.trial_subscription_expires
-        regular_active = False
-        regular_expires = None
-        subscription_type = "none"
-        if user.is_subscribed:
-            if user.is_manual_subscription:
-                if user.subscription_expires and user.subscription_expires < now:
-                    user.is_subscribed = False
-                    user.is_manual_subscription = False
-                    db.session.commit()
-                else:
-                    regular_active = True
-                    regular_expires = user.subscription_expires
-                    subscription_type = "manual"
-            else:
-                successful_payment = (
-                    Payment.query.filter_by(user_id=user.id, status="succeeded")
-                    .order_by(Payment.created_at.desc())
-                    .first()
-                )
-                if not successful_payment:
-                    user.is_subscribed = False
-                    db.session.commit()
-                elif user.subscription_expires and user.subscription_expires < now:
-                    user.is_subscribed = False
-                    db.session.commit()
-                else:
-                    regular_active = True
-                    regular_expires = user.subscription_expires
-                    subscription_type = "paid"
-        if trial_active and regular_active:
-            trial_expires = trial_expires or now
-            regular_expires = regular_expires or now
-            if regular_expires > trial_expires:
-                user.is_trial_subscription = False
-                user.trial_subscription_expires = None
-                db.session.commit()
-                trial_active = False
-            else:
-                user.is_subscribed = False
-                user.is_manual_subscription = False
-                db.session.commit()
-                regular_active = False
-        if trial_active:
-            time_left = trial_expires - now if trial_expires else None
-            days_left = time_left.days if time_left else None
-            return {
-                "is_subscribed": True,
-                "is_trial": True,
-                "expires_at": trial_expires,
-                "days_left": days_left,
-                "type": "trial",
-            }
-        elif regular_active:
-            time_left = regular_expires - now if regular_expires else None
-            days_left = time_left.days if time_left else None
-            return {
-                "is_subscribed": True,
-                "is_trial": False,
-                "expires_at": regular_expires,
-                "days_left": days_left,
-                "type": subscription_type,
-            }
-        else:
-            return {
-                "is_subscribed": False,
-                "is_trial": False,
-                "expires_at": None,
-                "days_left": 0,
-                "type": "none",
-            }
+        return SubscriptionState.get_info(user)
 
     def get_trial_subscription_info(self, user: User) -> dict:
         if not user.is_trial_subscription:
@@ -496,9 +427,6 @@ class YooKassaService:
             return {"is_trial": True, "days_left": 0, "expires_at": None}
         now = datetime.utcnow()
         if user.trial_subscription_expires < now:
-            user.is_trial_subscription = False
-            user.trial_subscription_expires = None
-            db.session.commit()
             return {"is_trial": False, "days_left": 0, "expires_at": None}
         time_left = user.trial_subscription_expires - now
         days_left = time_left.days
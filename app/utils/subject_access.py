@@ -0,0 +1,52 @@
+from typing import Dict, FrozenSet, Iterable
+
+from flask import current_app
+
+from .. import db
+from ..models import SubjectGroup
+from .model_changes import ModelChanges
+
+
+class SubjectAccess:
+    """
+    Карта доступа group_id -> множество subject_id
+
+    Карта строится одним запросом к SubjectGroup и хранится в процессе,
+    пока не изменится поколение "subject-access". Commit, меняющий Subject,
+    Group или SubjectGroup (включая массовые delete()), сдвигает поколение,
+    и следующая проверка во всех процессах сервера перестроит карту.
+    """
+
+    GENERATION_NAME = "subject-access"
+    MODELS = ("Subject", "Group", "SubjectGroup")
+
+    @staticmethod
+    def get_map() -> Dict[int, FrozenSet[int]]:
+        generation = ModelChanges.get_generation(SubjectAccess.GENERATION_NAME)
+        cached = current_app.extensions.get("subject_access")
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        subject_ids: Dict[int, set] = {}
+        rows = db.session.query(SubjectGroup.group_id, SubjectGroup.subject_id).all()
+        for group_id, subject_id in rows:
+            subject_ids.setdefault(group_id, set()).add(subject_id)
+        access_map = {
+            group_id: frozenset(ids) for group_id, ids in subject_ids.items()
+        }
+        current_app.extensions["subject_access"] = (generation, access_map)
+        return access_map
+
+    @staticmethod
+    def get_subject_ids(group_id: int) -> FrozenSet[int]:
+        return SubjectAccess.get_map().get(group_id, frozenset())
+
+    @staticmethod
+    def has_access(group_id: int, subject_id: int) -> bool:
+        return subject_id in SubjectAccess.get_subject_ids(group_id)
+
+    @staticmethod
+    def invalidate(model_names: Iterable[str] = ()) -> None:
+        ModelChanges.bump_generation(SubjectAccess.GENERATION_NAME)
+
+
+ModelChanges.subscribe(SubjectAccess.MODELS, SubjectAccess.invalidate)
@@ -0,0 +1,186 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from flask import current_app
+from sqlalchemy import and_, case, event, func, inspect, update
+from sqlalchemy.orm import Session
+
+from .. import db
+from ..models import BackgroundJob, Payment, User
+from .job_queue import JobQueue
+
+EXPIRE_SUBSCRIPTIONS_JOB = "expire_subscriptions"
+
+
+class SubscriptionState:
+    """
+    Денормализованное состояние подписки: User.effective_subscription_expires
+
+    Поле хранит момент окончания действующей подписки (пробной, ручной или
+    оплаченной - какая заканчивается позже) и пересчитывается в before_flush
+    при любом изменении полей подписки. Бессрочная подписка хранится как
+    NO_EXPIRY. Проверка доступа - сравнение с текущим временем без запросов
+    и записи в БД; истекшие подписки сбрасывает периодическая задача
+    expire_subscriptions одним UPDATE.
+    """
+
+    NO_EXPIRY = datetime(9999, 12, 31)
+    FIELDS = (
+        "is_subscribed",
+        "subscription_expires",
+        "is_manual_subscription",
+        "is_trial_subscription",
+        "trial_subscription_expires",
+    )
+    SWEEP_INTERVAL_SECONDS = 300
+
+    @staticmethod
+    def _trial_expires(user: User) -> Optional[datetime]:
+        if not user.is_trial_subscription:
+            return None
+        return user.trial_subscription_expires or SubscriptionState.NO_EXPIRY
+
+    @staticmethod
+    def _regular_expires(user: User) -> Optional[datetime]:
+        if not user.is_subscribed:
+            return None
+        return user.subscription_expires or SubscriptionState.NO_EXPIRY
+
+    @staticmethod
+    def compute_expires(user: User) -> Optional[datetime]:
+        candidates = [
+            expires
+            for expires in (
+                SubscriptionState._trial_expires(user),
+                SubscriptionState._regular_expires(user),
+            )
+            if expires is not None
+        ]
+        return max(candidates) if candidates else None
+
+    @staticmethod
+    def is_active(user: User, now: Optional[datetime] = None) -> bool:
+        expires = user.effective_subscription_expires
+        return expires is not None and expires > (now or datetime.utcnow())
+
+    @staticmethod
+    def get_info(user: User, now: Optional[datetime] = None) -> Dict[str, Any]:
+        now = now or datetime.utcnow()
+        if not SubscriptionState.is_active(user, now):
+            return {
+                "is_subscribed": False,
+                "is_trial": False,
+                "expires_at": None,
+                "days_left": 0,
+                "type": "none",
+            }
+        expires = user.effective_subscription_expires
+        is_trial = SubscriptionState._trial_expires(user) == expires
+        if is_trial:
+            subscription_type = "trial"
+        elif user.is_manual_subscription:
+            subscription_type = "manual"
+        else:
+            subscription_type = "paid"
+        expires_at = None if expires >= SubscriptionState.NO_EXPIRY else expires
+        return {
+            "is_subscribed": True,
+            "is_trial": is_trial,
+            "expires_at": expires_at,
+            "days_left": (expires_at - now).days if expires_at else None,
+            "type": subscription_type,
+        }
+
+    @staticmethod
+    def _needs_refresh(user: User) -> bool:
+        state = inspect(user)
+        if state.pending:
+            return True
+        return any(
+            state.attrs[field].history.has_changes()
+            for field in SubscriptionState.FIELDS
+        )
+
+    @staticmethod
+    def _before_flush(session: Session, flush_context, instances) -> None:
+        for instance in (*session.new, *session.dirty):
+            if isinstance(instance, User) and SubscriptionState._needs_refresh(
+                instance
+            ):
+                instance.effective_subscription_expires = (
+                    SubscriptionState.compute_expires(instance)
+                )
+
+    @staticmethod
+    def expire_subscriptions(now: Optional[datetime] = None) -> int:
+        """
+        Сбрасывает истекшие подписки одним UPDATE и возвращает их число
+
+        Вторым UPDATE снимается оплаченная подписка без успешного платежа
+        (раньше это делала каждая проверка доступа); у таких пользователей
+        остается только пробная подписка, если она есть.
+        """
+        now = now or datetime.utcnow()
+        expired = db.session.execute(
+            update(User)
+            .where(User.effective_subscription_expires <= now)
+            .values(
+                is_subscribed=False,
+                is_manual_subscription=False,
+                is_trial_subscription=False,
+                trial_subscription_expires=None,
+                effective_subscription_expires=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        has_payment = (
+            db.session.query(Payment.id)
+            .filter(Payment.user_id == User.id, Payment.status == "succeeded")
+            .exists()
+        )
+        unpaid = db.session.execute(
+            update(User)
+            .where(
+                and_(
+                    User.is_subscribed.is_(True),
+                    User.is_manual_subscription.isnot(True),
+                    ~has_payment,
+                )
+            )
+            .values(
+                is_subscribed=False,
+                effective_subscription_expires=case(
+                    (
+                        User.is_trial_subscription.is_(True),
+                        func.coalesce(
+                            User.trial_subscription_expires,
+                            SubscriptionState.NO_EXPIRY,
+                        ),
+                    ),
+                    else_=None,
+                ),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        db.session.expire_all()
+        if expired.rowcount or unpaid.rowcount:
+            current_app.logger.info(
+                f"Сброшено подписок: истекших {expired.rowcount}, "
+                f"без успешного платежа {unpaid.rowcount}"
+            )
+        return expired.rowcount + unpaid.rowcount
+
+    @staticmethod
+    def run_expiry_job(payload: Dict[str, Any], job: BackgroundJob) -> Dict[str, int]:
+        return {"expired": SubscriptionState.expire_subscriptions()}
+
+
+event.listen(Session, "before_flush", SubscriptionState._before_flush)
+
+JobQueue.register(
+    EXPIRE_SUBSCRIPTIONS_JOB,
+    SubscriptionState.run_expiry_job,
+    concurrency=1,
+    interval=SubscriptionState.SWEEP_INTERVAL_SECONDS,
+)
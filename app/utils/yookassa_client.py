@@ -0,0 +1,153 @@
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+
+class CircuitOpenError(Exception):
+    """API ЮKassa временно считается недоступным, запрос не отправлялся"""
+
+
+class YooKassaClient:
+    """
+    HTTP-клиент API ЮKassa, общий для всех запросов процесса
+
+    Один requests.Session с пулом keep-alive соединений, раздельные таймауты
+    на соединение и чтение, повторы сетевых ошибок, 429 и 5xx с
+    экспоненциальной задержкой со случайным разбросом. Все попытки одного
+    вызова идут с одним Idempotence-Key, поэтому повтор POST не создает
+    второй платеж. После BREAKER_THRESHOLD неудачных вызовов подряд цепь
+    размыкается: следующие BREAKER_COOLDOWN секунд вызовы сразу завершаются
+    CircuitOpenError, затем пропускается один пробный вызов.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(
+        self,
+        base_url: str,
+        shop_id: str,
+        secret_key: str,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 15.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        pool_size: int = 10,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 30.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.session = requests.Session()
+        self.session.auth = (shop_id, secret_key)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+
+    @staticmethod
+    def get() -> "YooKassaClient":
+        client = current_app.extensions.get("yookassa_client")
+        if client is None:
+            config = current_app.config
+            client = YooKassaClient(
+                config.get("YOOKASSA_API_URL", "https://api.yookassa.ru/v3"),
+                config["YOOKASSA_SHOP_ID"],
+                config["YOOKASSA_SECRET_KEY"],
+                connect_timeout=config.get("YOOKASSA_CONNECT_TIMEOUT", 3.05),
+                read_timeout=config.get("YOOKASSA_READ_TIMEOUT", 15.0),
+                max_retries=config.get("YOOKASSA_MAX_RETRIES", 2),
+                pool_size=config.get("YOOKASSA_POOL_SIZE", 10),
+                breaker_threshold=config.get("YOOKASSA_BREAKER_THRESHOLD", 5),
+                breaker_cooldown=config.get("YOOKASSA_BREAKER_COOLDOWN", 30.0),
+            )
+            current_app.extensions["yookassa_client"] = client
+        return client
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_until > time.monotonic()
+
+    def _before_call(self) -> None:
+        with self._lock:
+            if self._failures < self.breaker_threshold:
+                return
+            if self._opened_until > time.monotonic() or self._probe_in_flight:
+                raise CircuitOpenError("API ЮKassa временно недоступен")
+            self._probe_in_flight = True
+
+    def _after_call(self, success: bool) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            if success:
+                self._failures = 0
+                self._opened_until = 0.0
+                return
+            self._failures += 1
+            if self._failures >= self.breaker_threshold:
+                self._opened_until = time.monotonic() + self.breaker_cooldown
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, self.backoff_base * (2**attempt))
+
+    def request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict[str, Any]] = None,
+        idempotence_key: Optional[str] = None,
+    ) -> requests.Response:
+        """
+        Выполняет вызов API с повторами и возвращает последний ответ
+
+        Сетевая ошибка после исчерпания повторов пробрасывается как
+        requests.RequestException; ответы 4xx возвращаются без повторов.
+        """
+        self._before_call()
+        headers = {"Idempotence-Key": idempotence_key or str(uuid.uuid4())}
+        url = f"{self.base_url}/{endpoint}"
+        response = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    time.sleep(self._backoff(attempt - 1))
+                try:
+                    response = self.session.request(
+                        method,
+                        url,
+                        headers=headers,
+                        json=data,
+                        timeout=self.timeout,
+                    )
+                except requests.exceptions.RequestException as e:
+                    if attempt == self.max_retries:
+                        raise
+                    current_app.logger.warning(
+                        f"Повтор запроса {method} {endpoint} к ЮKassa: {e}"
+                    )
+                    continue
+                if response.status_code not in self.RETRY_STATUSES:
+                    break
+                if attempt < self.max_retries:
+                    current_app.logger.warning(
+                        f"Повтор запроса {method} {endpoint} к ЮKassa: "
+                        f"HTTP {response.status_code}"
+                    )
+        except requests.exceptions.RequestException:
+            self._after_call(False)
+            raise
+        self._after_call(response.status_code < 500)
+        return response
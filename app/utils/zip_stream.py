@@ -0,0 +1,169 @@
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+
+class _StreamBuffer:
+    """
+    Несмещаемый (non-seekable) приемник для zipfile
+
+    Наличие tell() без seek() заставляет zipfile писать записи с data
+    descriptor и не возвращаться назад, поэтому готовые байты можно сразу
+    отдавать клиенту.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+@dataclass
+class ZipEntry:
+    """Запись архива: файл на диске (path) или готовое содержимое (data)"""
+
+    arcname: str
+    path: Optional[str] = None
+    data: Optional[bytes] = None
+    mtime: Optional[float] = None
+
+
+class ZipStream:
+    """
+    Потоковая сборка ZIP-архива без временного файла
+
+    Байты архива отдаются по мере чтения файлов, большие архивы и записи
+    пишутся в формате ZIP64. Уже сжатые форматы сохраняются без повторного
+    сжатия (ZIP_STORED), чтобы не тратить CPU.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    PREFETCH_MAX_SIZE = 16 * 1024 * 1024
+    STORED_EXTENSIONS = {
+        "zip",
+        "rar",
+        "7z",
+        "gz",
+        "bz2",
+        "xz",
+        "pdf",
+        "docx",
+        "pptx",
+        "xlsx",
+        "odt",
+        "jpg",
+        "jpeg",
+        "png",
+        "gif",
+        "webp",
+        "mp3",
+        "mp4",
+    }
+
+    @staticmethod
+    def get_compress_type(arcname: str) -> int:
+        extension = os.path.splitext(arcname)[1].lower().lstrip(".")
+        if extension in ZipStream.STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    @staticmethod
+    def _make_info(arcname: str, mtime: Optional[float] = None) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(
+            arcname, date_time=time.localtime(mtime or time.time())[:6]
+        )
+        info.compress_type = ZipStream.get_compress_type(arcname)
+        info.external_attr = 0o644 << 16
+        return info
+
+    @staticmethod
+    def generate(entries: Iterable[ZipEntry]) -> Iterator[bytes]:
+        """
+        Собирает архив из записей и отдает его по частям
+
+        Файлы, которые не удалось открыть, пропускаются. Ошибка чтения уже
+        начатой записи прерывает архив: вернуться назад в потоке нельзя.
+        """
+        buffer = _StreamBuffer()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for entry in entries:
+                if entry.data is not None:
+                    info = ZipStream._make_info(entry.arcname, entry.mtime)
+                    zip_file.writestr(info, entry.data)
+                    yield from ZipStream._drain(buffer)
+                    continue
+                try:
+                    source = open(entry.path, "rb")
+                except OSError:
+                    continue
+                with source:
+                    stat = os.fstat(source.fileno())
+                    info = ZipStream._make_info(entry.arcname, stat.st_mtime)
+                    force_zip64 = stat.st_size >= zipfile.ZIP64_LIMIT
+                    with zip_file.open(info, "w", force_zip64=force_zip64) as target:
+                        while True:
+                            chunk = source.read(ZipStream.CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            target.write(chunk)
+                            yield from ZipStream._drain(buffer)
+                yield from ZipStream._drain(buffer)
+        yield from ZipStream._drain(buffer)
+
+    @staticmethod
+    def _drain(buffer: _StreamBuffer) -> Iterator[bytes]:
+        data = buffer.pop()
+        if data:
+            yield data
+
+    @staticmethod
+    def _read_entry(entry: ZipEntry) -> ZipEntry:
+        if entry.data is not None or not entry.path:
+            return entry
+        try:
+            with open(entry.path, "rb") as source:
+                stat = os.fstat(source.fileno())
+                if stat.st_size > ZipStream.PREFETCH_MAX_SIZE:
+                    return entry
+                data = source.read()
+        except OSError:
+            return entry
+        return ZipEntry(entry.arcname, data=data, mtime=stat.st_mtime)
+
+    @staticmethod
+    def prefetch(entries: Iterable[ZipEntry], workers: int = 4) -> Iterator[ZipEntry]:
+        """
+        Читает файлы записей заранее в ограниченном пуле потоков
+
+        Порядок записей сохраняется, одновременно в памяти не больше
+        2 * workers файлов. Файлы больше PREFETCH_MAX_SIZE не читаются
+        заранее и потоково копируются с диска в generate.
+        """
+        window = deque()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for entry in entries:
+                window.append(pool.submit(ZipStream._read_entry, entry))
+                if len(window) >= workers * 2:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
@@ -1,12 +1,13 @@
 from typing import Any, Dict
 
-from flask import Blueprint, current_app, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, url_for
 from flask_login import current_user, login_required
 from flask_wtf.csrf import validate_csrf
 from wtforms import ValidationError
 
 from ..models import Notification, Subject
-from ..services import UserManagementService
+from ..services import ExportService, UploadService, UserManagementService
+from ..utils.job_queue import JobQueue
 
 api_bp = Blueprint("api", __name__)
 
@@ -50,6 +51,25 @@ def mark_notification_read(notification_id: int) -> Dict[str, Any]:
     return jsonify({"success": True})
 
 
+@api_bp.route("/api/export-jobs/<int:job_id>")
+@login_required
+def export_job_status(job_id: int) -> Any:
+    job = ExportService.get_solutions_export_job(job_id, current_user.id)
+    if job is None:
+        return jsonify({"success": False, "error": "Задача не найдена"}), 404
+    result = JobQueue.get_result(job) or {}
+    return jsonify(
+        {
+            "success": True,
+            "job_id": job.id,
+            "status": job.status,
+            "progress": job.progress,
+            "download_url": result.get("download_url"),
+            "error": job.error if job.status == JobQueue.STATUS_FAILED else None,
+        }
+    )
+
+
 @api_bp.route("/api/subject/<int:subject_id>/pattern", methods=["POST"])
 @login_required
 def update_subject_pattern(subject_id: int) -> Dict[str, Any]:
@@ -85,6 +105,113 @@ def update_subject_pattern(subject_id: int) -> Dict[str, Any]:
         )
 
 
+def _upload_headers(upload) -> Dict[str, str]:
+    return {
+        "Upload-Offset": str(upload.offset),
+        "Upload-Length": str(upload.size),
+        "Cache-Control": "no-store",
+    }
+
+
+def _upload_not_found() -> Any:
+    return jsonify({"success": False, "error": "Загрузка не найдена"}), 404
+
+
+@api_bp.route("/api/uploads", methods=["POST"])
+@login_required
+def create_upload() -> Any:
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get("size", request.headers.get("Upload-Length")))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Некорректный размер файла"}), 400
+    upload, error = UploadService.create_session(
+        current_user, data.get("filename"), size
+    )
+    if not upload:
+        return jsonify({"success": False, "error": error}), 400
+    response = jsonify(
+        {
+            "success": True,
+            "upload_id": upload.id,
+            "offset": upload.offset,
+            "size": upload.size,
+        }
+    )
+    response.status_code = 201
+    response.headers["Location"] = url_for("api.upload_status", upload_id=upload.id)
+    response.headers.update(_upload_headers(upload))
+    return response
+
+
+@api_bp.route("/api/uploads/<upload_id>", methods=["GET", "HEAD"])
+@login_required
+def upload_status(upload_id: str) -> Any:
+    upload = UploadService.get_session(upload_id, current_user.id)
+    if not upload:
+        return _upload_not_found()
+    response = jsonify(
+        {
+            "success": True,
+            "upload_id": upload.id,
+            "offset": upload.offset,
+            "size": upload.size,
+            "status": upload.status,
+        }
+    )
+    response.headers.update(_upload_headers(upload))
+    return response
+
+
+@api_bp.route("/api/uploads/<upload_id>", methods=["PATCH"])
+@login_required
+def upload_chunk(upload_id: str) -> Any:
+    upload = UploadService.get_session(upload_id, current_user.id)
+    if not upload:
+        return _upload_not_found()
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return jsonify({"success": False, "error": "Не указан Upload-Offset"}), 400
+    success, error = UploadService.append_chunk(upload, offset, request.stream)
+    if not success:
+        response = jsonify({"success": False, "error": error, "offset": upload.offset})
+        response.status_code = 409 if error == UploadService.OFFSET_CONFLICT else 400
+        response.headers.update(_upload_headers(upload))
+        return response
+    return Response(status=204, headers=_upload_headers(upload))
+
+
+@api_bp.route("/api/uploads/<upload_id>/finalize", methods=["POST"])
+@login_required
+def finalize_upload(upload_id: str) -> Any:
+    upload = UploadService.get_session(upload_id, current_user.id)
+    if not upload:
+        return _upload_not_found()
+    data = request.get_json(silent=True) or {}
+    success, error = UploadService.finalize(upload, data.get("sha256"))
+    if not success:
+        return jsonify({"success": False, "error": error}), 400
+    return jsonify(
+        {
+            "success": True,
+            "upload_id": upload.id,
+            "size": upload.size,
+            "sha256": upload.sha256,
+        }
+    )
+
+
+@api_bp.route("/api/uploads/<upload_id>", methods=["DELETE"])
+@login_required
+def abort_upload(upload_id: str) -> Any:
+    upload = UploadService.get_session(upload_id, current_user.id)
+    if not upload:
+        return _upload_not_found()
+    UploadService.abort(upload)
+    return Response(status=204)
+
+
 @api_bp.errorhandler(400)
 def bad_request(error) -> Dict[str, Any]:
     current_app.logger.error("=== ОШИБКА 400 BAD REQUEST ===")
@@ -1,17 +1,18 @@
 import os
 import shutil
-from typing import Union
+from typing import Optional, Union
 
 from flask import (
     Blueprint,
     Response,
     current_app,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
-    send_file,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_login import current_user, login_required
@@ -21,13 +22,16 @@ from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 
 from ..forms import MaterialForm
-from ..models import Material, ShortLink, SiteSettings, Subject, SubjectGroup, db
+from ..models import Material, ShortLink, SiteSettings, Subject, db
 from ..services import (
     ExportService,
     MaterialService,
     SubjectService,
     UserManagementService,
 )
+from ..utils.blob_store import BlobStore
+from ..utils.file_index import FileIndex
+from ..utils.file_response import FileResponseBuilder
 from ..utils.file_storage import FileStorageManager
 from ..utils.notifications import redirect_with_notification
 from ..utils.payment_service import YooKassaService
@@ -163,33 +167,17 @@ def index() -> Union[str, Response]:
                 )
     try:
         if current_user.is_authenticated:
-            accessible_subjects = UserManagementService.get_accessible_subjects(
-                current_user
-            )
-            current_app.logger.info(
-                f"User {current_user.username} has access to {len(accessible_subjects)} subjects"
-            )
-            if accessible_subjects:
-                subject_ids = [s.id for s in accessible_subjects]
-                subjects = (
-                    Subject.query.options(
-                        joinedload(Subject.materials), joinedload(Subject.groups)
-                    )
-                    .filter(Subject.id.in_(subject_ids))
-                    .all()
-                )
+            subjects = SubjectService.get_subject_cards(current_user)
+            if subjects:
                 current_app.logger.info(
-                    f"Loaded {len(subjects)} subjects for authenticated user"
+                    f"User {current_user.username} has access to {len(subjects)} subjects"
                 )
             else:
-                subjects = []
                 current_app.logger.warning(
                     f"No accessible subjects found for user {current_user.username} (group_id: {current_user.group_id})"
                 )
         else:
-            subjects = Subject.query.options(
-                joinedload(Subject.materials), joinedload(Subject.groups)
-            ).all()
+            subjects = SubjectService.get_subject_cards()
             current_app.logger.info(
                 f"Loaded {len(subjects)} subjects for unauthenticated user"
             )
@@ -248,14 +236,16 @@ def subject_detail(subject_id: int) -> Union[str, Response]:
             "main.index", "Ошибка загрузки предмета", "error"
         )
     if current_user.is_authenticated:
-        accessible_subjects = UserManagementService.get_accessible_subjects(
-            current_user
-        )
-        if subject not in accessible_subjects:
+        if not UserManagementService.can_access_subject(current_user, subject.id):
+            if not current_user.group_id:
+                return redirect_with_notification(
+                    "main.index",
+                    "У вас не назначена группа. Обратитесь к администратору",
+                    "error",
+                )
             return redirect_with_notification(
                 "main.index", "У вас нет доступа к этому предмету", "error"
             )
-    if current_user.is_authenticated:
         try:
             payment_service = YooKassaService()
             if not payment_service.check_user_subscription(current_user):
@@ -264,21 +254,6 @@ def subject_detail(subject_id: int) -> Union[str, Response]:
                     "Для доступа к предметам необходима активная подписка",
                     "warning",
                 )
-            if not UserManagementService.is_effective_admin(current_user):
-                if current_user.group:
-                    subject_group = SubjectGroup.query.filter_by(
-                        subject_id=subject.id, group_id=current_user.group.id
-                    ).first()
-                    if not subject_group:
-                        return redirect_with_notification(
-                            "main.index", "У вас нет доступа к этому предмету", "error"
-                        )
-                else:
-                    return redirect_with_notification(
-                        "main.index",
-                        "У вас не назначена группа. Обратитесь к администратору",
-                        "error",
-                    )
         except Exception as e:
             current_app.logger.error(
                 f"Error checking subscription in subject_detail: {e}"
@@ -287,15 +262,14 @@ def subject_detail(subject_id: int) -> Union[str, Response]:
                 "main.index", "Ошибка проверки подписки", "error"
             )
     lectures, assignments = MaterialService.get_subject_materials(subject.id)
+    assignment_ids = [material.id for material in assignments]
     form = None
     user_submissions = {}
     if current_user.is_authenticated:
         try:
-            for material in assignments:
-                for sub in material.submissions:
-                    if str(sub.user_id) == str(current_user.id) and sub.file:
-                        user_submissions[material.id] = sub
-                        break
+            user_submissions = MaterialService.get_user_submissions(
+                current_user.id, assignment_ids
+            )
         except Exception as e:
             current_app.logger.error(f"Error loading user submissions: {e}")
             user_submissions = {}
@@ -311,7 +285,7 @@ def subject_detail(subject_id: int) -> Union[str, Response]:
             material_type = form.type.data
             if subject.mode == 2:
                 material_type = "assignment"
-            material = MaterialService.create_material(
+            MaterialService.create_material(
                 subject_id=subject_id,
                 title=form.title.data,
                 description=form.description.data,
@@ -321,6 +295,8 @@ def subject_detail(subject_id: int) -> Union[str, Response]:
                     form.solution_file.data if material_type == "assignment" else None
                 ),
                 created_by=current_user.id,
+                file_upload_id=request.form.get("file_upload_id"),
+                solution_upload_id=request.form.get("solution_upload_id"),
             )
             flash("Материал добавлен")
             return redirect(url_for("main.subject_detail", subject_id=subject_id))
@@ -333,6 +309,9 @@ def subject_detail(subject_id: int) -> Union[str, Response]:
         can_manage_materials = UserManagementService.can_manage_subject_materials(
             current_user, subject
         )
+    submission_counts = {}
+    if can_manage_materials:
+        submission_counts = MaterialService.get_submission_counts(assignment_ids)
     assignments_completion_percent = 0
     if current_user.is_authenticated and assignments:
         completed_count = len(user_submissions)
@@ -353,6 +332,7 @@ def subject_detail(subject_id: int) -> Union[str, Response]:
         assignments=assignments,
         form=form if can_add_materials else None,
         user_submissions=user_submissions,
+        submission_counts=submission_counts,
         can_add_materials=can_add_materials,
         can_manage_materials=can_manage_materials,
         assignments_completion_percent=assignments_completion_percent,
@@ -390,6 +370,7 @@ def delete_subject(subject_id: int) -> Response:
         subject_path = os.path.join(upload_base, str(subject.id))
         if os.path.exists(subject_path):
             shutil.rmtree(subject_path)
+        BlobStore.release_all(FileIndex.forget_subject(subject.id))
     except Exception as folder_error:
         current_app.logger.error(
             f"Ошибка удаления папки предмета {subject.id}: {folder_error}"
@@ -485,6 +466,7 @@ def material_detail(material_id: int) -> Union[str, Response]:
 @login_required
 def delete_solution(submission_id: int) -> Response:
     from app.models import Submission
+    from app.utils.export_cache import ExportCache
     from app.utils.file_storage import FileStorageManager
 
     submission = Submission.query.get_or_404(submission_id)
@@ -500,6 +482,7 @@ def delete_solution(submission_id: int) -> Response:
             )
     db.session.delete(submission)
     db.session.commit()
+    ExportCache.invalidate(current_user.id)
     flash("Решение удалено", "success")
     return redirect(url_for("main.material_detail", material_id=submission.material_id))
 
@@ -511,13 +494,11 @@ def add_solution_file(material_id: int) -> Response:
         flash("Доступ запрещён")
         return redirect(url_for("main.index"))
     material = Material.query.get_or_404(material_id)
-    if current_user.is_moderator:
-        accessible_subjects = UserManagementService.get_accessible_subjects(
-            current_user
-        )
-        if material.subject not in accessible_subjects:
-            flash("У вас нет доступа к этому предмету.", "error")
-            return redirect(url_for("main.index"))
+    if current_user.is_moderator and not UserManagementService.can_access_subject(
+        current_user, material.subject_id
+    ):
+        flash("У вас нет доступа к этому предмету.", "error")
+        return redirect(url_for("main.index"))
     file = request.files.get("solution_file")
     if file:
         subject = material.subject
@@ -573,6 +554,15 @@ def submit_solution(material_id: int) -> Response:
     if material.type != "assignment":
         flash("Можно загружать решение только для практик")
         return redirect(url_for("main.subject_detail", subject_id=material.subject_id))
+    upload_id = request.form.get("upload_id")
+    if upload_id:
+        if MaterialService.submit_solution(
+            material, current_user.id, upload_id=upload_id
+        ):
+            flash("Решение загружено")
+        else:
+            flash("Ошибка при сохранении файла решения", "error")
+        return redirect(url_for("main.material_detail", material_id=material_id))
     file = request.files.get("solution_file")
     if file:
         subject = material.subject
@@ -660,13 +650,11 @@ def replace_material_file(material_id: int) -> Response:
         flash("Доступ запрещён")
         return redirect(url_for("main.index"))
     material = Material.query.get_or_404(material_id)
-    if current_user.is_moderator:
-        accessible_subjects = UserManagementService.get_accessible_subjects(
-            current_user
-        )
-        if material.subject not in accessible_subjects:
-            flash("У вас нет доступа к этому предмету.", "error")
-            return redirect(url_for("main.index"))
+    if current_user.is_moderator and not UserManagementService.can_access_subject(
+        current_user, material.subject_id
+    ):
+        flash("У вас нет доступа к этому предмету.", "error")
+        return redirect(url_for("main.index"))
     file = request.files.get("file")
     if not file or not file.filename:
         flash("Файл не выбран", "error")
@@ -688,13 +676,11 @@ def replace_material_solution_file(material_id: int) -> Response:
     if material.type != "assignment":
         flash("Файл решения можно заменить только для практик", "error")
         return redirect(url_for("main.material_detail", material_id=material.id))
-    if current_user.is_moderator:
-        accessible_subjects = UserManagementService.get_accessible_subjects(
-            current_user
-        )
-        if material.subject not in accessible_subjects:
-            flash("У вас нет доступа к этому предмету.", "error")
-            return redirect(url_for("main.index"))
+    if current_user.is_moderator and not UserManagementService.can_access_subject(
+        current_user, material.subject_id
+    ):
+        flash("У вас нет доступа к этому предмету.", "error")
+        return redirect(url_for("main.index"))
     file = request.files.get("solution_file")
     if not file or not file.filename:
         flash("Файл не выбран", "error")
@@ -714,29 +700,21 @@ def delete_material(material_id: int) -> Response:
         return redirect(url_for("main.index"))
     material = Material.query.get_or_404(material_id)
     subject_id = material.subject_id
-    if current_user.is_moderator:
-        accessible_subjects = UserManagementService.get_accessible_subjects(
-            current_user
-        )
-        if material.subject not in accessible_subjects:
-            flash("У вас нет доступа к этому предмету.", "error")
-            return redirect(url_for("main.index"))
+    if current_user.is_moderator and not UserManagementService.can_access_subject(
+        current_user, material.subject_id
+    ):
+        flash("У вас нет доступа к этому предмету.", "error")
+        return redirect(url_for("main.index"))
     if material.file:
         try:
-            upload_base = current_app.config.get("UPLOAD_FOLDER", "app/static/uploads")
-            file_path = os.path.join(upload_base, material.file)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            FileStorageManager.delete_file(material.file)
         except Exception as file_error:
             current_app.logger.error(
                 f"Ошибка удаления файла материала {material.file}: {file_error}"
             )
     if material.solution_file:
         try:
-            upload_base = current_app.config.get("UPLOAD_FOLDER", "app/static/uploads")
-            solution_path = os.path.join(upload_base, material.solution_file)
-            if os.path.exists(solution_path):
-                os.remove(solution_path)
+            FileStorageManager.delete_file(material.solution_file)
         except Exception as solution_error:
             current_app.logger.error(
                 f"Ошибка удаления файла решения {material.solution_file}: {solution_error}"
@@ -1025,8 +1003,35 @@ def download_redirect() -> Response:
 def serve_file(subject_id: int, filename: str) -> Response:
     import os
 
-    from flask import Response, abort, request
+    from flask import abort
 
+    location = FileIndex.lookup(subject_id, filename)
+    file_path = FileIndex.get_full_path(location) if location else None
+    possible_paths = []
+    if not file_path:
+        possible_paths = _probe_file_paths(subject_id, filename)
+        for path in possible_paths:
+            if os.path.exists(path):
+                file_path = path
+                FileIndex.schedule_record(path)
+                break
+    if not file_path:
+        current_app.logger.error(
+            f"Файл не найден: {filename} для subject_id {subject_id}"
+        )
+        current_app.logger.error(f"Проверенные пути: {possible_paths}")
+        abort(404)
+    try:
+        response = FileResponseBuilder.send(file_path, filename, location)
+        db.session.commit()
+        return response
+    except Exception as e:
+        current_app.logger.error(f"Ошибка обработки файла {file_path}: {e}")
+        abort(500)
+
+
+def _probe_file_paths(subject_id: int, filename: str) -> list:
+    """Кандидаты расположения файла для случая, когда его нет в индексе"""
     upload_folder = current_app.config["UPLOAD_FOLDER"]
     safe_filename = secure_filename(filename)
     possible_paths = []
@@ -1081,138 +1086,7 @@ def serve_file(subject_id: int, filename: str) -> Response:
                         possible_paths.append(path5)
     except (OSError, Exception):
         pass
-    file_path = None
-    for path in possible_paths:
-        if os.path.exists(path):
-            file_path = path
-            break
-    if not file_path:
-        current_app.logger.error(
-            f"Файл не найден: {filename} для subject_id {subject_id}"
-        )
-        current_app.logger.error(f"Проверенные пути: {possible_paths}")
-        abort(404)
-    if filename.lower().endswith(".pdf"):
-        mimetype = "application/pdf"
-    elif filename.lower().endswith((".jpg", ".jpeg")):
-        mimetype = "image/jpeg"
-    elif filename.lower().endswith(".png"):
-        mimetype = "image/png"
-    elif filename.lower().endswith(".docx"):
-        mimetype = (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        )
-    elif filename.lower().endswith(".doc"):
-        mimetype = "application/msword"
-    elif filename.lower().endswith(".txt"):
-        mimetype = "text/plain"
-    elif filename.lower().endswith(".zip"):
-        mimetype = "application/zip"
-    else:
-        mimetype = "application/octet-stream"
-    try:
-        file_size = os.path.getsize(file_path)
-        range_header = request.headers.get("Range")
-        if range_header:
-            return _handle_range_request(file_path, file_size, mimetype, filename)
-        if request.method == "HEAD":
-            response = Response(
-                status=200,
-                mimetype=mimetype,
-                headers={
-                    "Content-Length": str(file_size),
-                    "Accept-Ranges": "bytes",
-                    "Cache-Control": "public, max-age=3600",
-                    "X-Content-Type-Options": "nosniff",
-                    "X-Frame-Options": "SAMEORIGIN",
-                },
-            )
-            response.headers["Content-Disposition"] = (
-                f'attachment; filename="{os.path.basename(filename)}"'
-            )
-            return response
-
-        def generate_file():
-            try:
-                with open(file_path, "rb") as f:
-                    while True:
-                        chunk = f.read(65536)
-                        if not chunk:
-                            break
-                        yield chunk
-            except Exception as e:
-                current_app.logger.error(f"Ошибка чтения файла {file_path}: {e}")
-                return
-
-        response = Response(
-            generate_file(),
-            mimetype=mimetype,
-            headers={
-                "Content-Length": str(file_size),
-                "Accept-Ranges": "bytes",
-                "Cache-Control": "public, max-age=3600",
-                "X-Content-Type-Options": "nosniff",
-                "X-Frame-Options": "SAMEORIGIN",
-            },
-        )
-        response.headers["Content-Disposition"] = (
-            f'attachment; filename="{os.path.basename(filename)}"'
-        )
-        return response
-    except Exception as e:
-        current_app.logger.error(f"Ошибка обработки файла {file_path}: {e}")
-        abort(500)
-
-
-def _handle_range_request(
-    file_path: str, file_size: int, mimetype: str, filename: str
-) -> Response:
-    import re
-
-    from flask import Response, request
-
-    range_match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
-    if not range_match:
-        return Response("Bad Request", status=400)
-    start = int(range_match.group(1))
-    end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-    if start >= file_size or end >= file_size or start > end:
-        return Response("Requested Range Not Satisfiable", status=416)
-    content_length = end - start + 1
-
-    def generate_range():
-        try:
-            with open(file_path, "rb") as f:
-                f.seek(start)
-                remaining = content_length
-                while remaining > 0:
-                    chunk_size = min(65536, remaining)
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-        except Exception as e:
-            current_app.logger.error(f"Ошибка чтения диапазона файла {file_path}: {e}")
-            return
-
-    response = Response(
-        generate_range(),
-        status=206,
-        mimetype=mimetype,
-        headers={
-            "Content-Length": str(content_length),
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Cache-Control": "public, max-age=3600",
-            "X-Content-Type-Options": "nosniff",
-            "X-Frame-Options": "SAMEORIGIN",
-        },
-    )
-    response.headers["Content-Disposition"] = (
-        f'attachment; filename="{os.path.basename(filename)}"'
-    )
-    return response
+    return possible_paths
 
 
 @main_bp.route(
@@ -1223,7 +1097,7 @@ def serve_user_file(subject_id: int, user_id: int, filename: str) -> Response:
     """Специальный маршрут для файлов решений пользователей"""
     import os
 
-    from flask import Response, abort
+    from flask import abort
     from werkzeug.utils import secure_filename
 
     upload_folder = current_app.config["UPLOAD_FOLDER"]
@@ -1240,51 +1114,9 @@ def serve_user_file(subject_id: int, user_id: int, filename: str) -> Response:
     if not os.path.exists(file_path):
         current_app.logger.error(f"Файл пользователя не найден: {file_path}")
         abort(404)
-    if filename.lower().endswith(".pdf"):
-        mimetype = "application/pdf"
-    elif filename.lower().endswith((".jpg", ".jpeg")):
-        mimetype = "image/jpeg"
-    elif filename.lower().endswith(".png"):
-        mimetype = "image/png"
-    elif filename.lower().endswith(".docx"):
-        mimetype = (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        )
-    elif filename.lower().endswith(".doc"):
-        mimetype = "application/msword"
-    elif filename.lower().endswith(".txt"):
-        mimetype = "text/plain"
-    elif filename.lower().endswith(".zip"):
-        mimetype = "application/zip"
-    else:
-        mimetype = "application/octet-stream"
     try:
-        file_size = os.path.getsize(file_path)
-
-        def generate_file():
-            try:
-                with open(file_path, "rb") as f:
-                    while True:
-                        chunk = f.read(65536)
-                        if not chunk:
-                            break
-                        yield chunk
-            except Exception as e:
-                current_app.logger.error(f"Ошибка чтения файла {file_path}: {e}")
-                return
-
-        response = Response(
-            generate_file(),
-            mimetype=mimetype,
-            headers={
-                "Content-Length": str(file_size),
-                "Accept-Ranges": "bytes",
-                "Cache-Control": "public, max-age=3600",
-                "X-Content-Type-Options": "nosniff",
-                "X-Frame-Options": "SAMEORIGIN",
-                "Content-Disposition": f'attachment; filename="{os.path.basename(filename)}"',
-            },
-        )
+        response = FileResponseBuilder.send(file_path, filename)
+        db.session.commit()
         return response
     except Exception as e:
         current_app.logger.error(f"Ошибка обработки файла {file_path}: {e}")
@@ -1294,39 +1126,104 @@ def serve_user_file(subject_id: int, user_id: int, filename: str) -> Response:
 @main_bp.route("/export-solutions")
 @login_required
 def export_user_solutions() -> Response:
-    from urllib.parse import quote
+    """
+    Запрашивает архив решений пользователя
 
-    temp_file = ExportService.export_user_solutions(
+    Готовый архив из кэша отдается сразу, иначе сборка ставится в фоновую
+    очередь: о готовности придет уведомление со ссылкой на скачивание.
+    Клиенты с Accept: application/json получают ссылку или номер задачи
+    для опроса /api/export-jobs/<id>.
+    """
+    wants_json = request.accept_mimetypes.best == "application/json"
+    download_url, job = ExportService.request_solutions_export(
         current_user.id, current_user.username
     )
-    if not temp_file:
+    if download_url is None and job is None:
+        if wants_json:
+            return jsonify({"success": False, "error": "Нет решений для экспорта"})
         flash("У вас нет загруженных решений для экспорта", "info")
         return redirect(url_for("main.profile"))
+    if wants_json:
+        if download_url:
+            return jsonify(
+                {"success": True, "status": "done", "download_url": download_url}
+            )
+        return jsonify(
+            {
+                "success": True,
+                "job_id": job.id,
+                "status": job.status,
+                "progress": job.progress,
+                "status_url": url_for("api.export_job_status", job_id=job.id),
+            }
+        )
+    if download_url:
+        return redirect(download_url)
+    flash(
+        "Архив решений собирается. Ссылка на скачивание придет в уведомлениях.",
+        "info",
+    )
+    return redirect(url_for("main.profile"))
+
+
+@main_bp.route("/export-solutions/download/<token>")
+@login_required
+def download_user_solutions(token: str) -> Response:
+    from datetime import datetime
+
+    archive_path = ExportService.load_download_token(token, current_user.id)
+    if archive_path is None:
+        flash("Ссылка на архив устарела, запросите экспорт заново", "warning")
+        return redirect(url_for("main.profile"))
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    response = FileResponseBuilder.send(
+        archive_path, f"{current_user.username}-{timestamp}.zip"
+    )
+    response.headers["Cache-Control"] = "private, no-store"
+    return response
 
-    def remove_file(response):
-        try:
-            os.unlink(temp_file)
-        except Exception:
-            pass
-        return response
 
-    timestamp = os.path.basename(temp_file).replace(".zip", "").split("-")[-1]
-    filename = f"{current_user.username}-{timestamp}.zip"
-    response = send_file(
-        temp_file,
-        as_attachment=True,
-        download_name=filename,
+@main_bp.route("/subject/<int:subject_id>/export-submissions")
+@login_required
+def export_subject_submissions(subject_id: int) -> Response:
+    subject = Subject.query.get_or_404(subject_id)
+    return _export_submissions_response(subject)
+
+
+@main_bp.route("/material/<int:material_id>/export-submissions")
+@login_required
+def export_material_submissions(material_id: int) -> Response:
+    material = Material.query.get_or_404(material_id)
+    return _export_submissions_response(material.subject, material)
+
+
+def _export_submissions_response(
+    subject: Subject, material: Optional[Material] = None
+) -> Response:
+    """Отдает архив решений всех студентов преподавателю предмета"""
+    from datetime import datetime
+    from urllib.parse import quote
+
+    if not UserManagementService.can_manage_subject_materials(current_user, subject):
+        flash("У вас нет доступа к этому предмету.", "error")
+        return redirect(url_for("main.index"))
+    archive = ExportService.export_submissions(subject, material)
+    name_parts = [ExportService.clean_folder_name(subject.title)]
+    if material is not None:
+        name_parts.append(ExportService.clean_folder_name(material.title))
+    name_parts.append(datetime.now().strftime("%Y%m%d_%H%M%S"))
+    filename = f"{'-'.join(name_parts)}.zip"
+    response = Response(
+        stream_with_context(archive),
         mimetype="application/zip",
+        direct_passthrough=True,
     )
     response.headers["Content-Disposition"] = (
-        f"attachment; filename=\"{filename}\"; filename*=UTF-8''{quote(filename)}"
+        f"attachment; filename=\"{secure_filename(filename) or 'submissions.zip'}\"; "
+        f"filename*=UTF-8''{quote(filename)}"
     )
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    response.call_on_close(
-        lambda: os.unlink(temp_file) if os.path.exists(temp_file) else None
-    )
+    response.headers["X-Accel-Buffering"] = "no"
     return response
 
 
@@ -95,34 +95,32 @@ def subscription() -> Union[str, Response]:
 
 @payment_bp.route("/payment/webhook", methods=["POST"])
 def payment_webhook() -> Tuple[str, int]:
+    data = request.get_json(silent=True)
+    current_app.logger.info(f"Получен webhook от ЮKassa: {data}")
+    if not data:
+        current_app.logger.error("Пустые данные в webhook")
+        return "OK", 200
+    event = data.get("event")
+    payment_id = (data.get("object") or {}).get("id")
+    if not event or not payment_id:
+        current_app.logger.error("Event или payment ID не найден в webhook")
+        return "OK", 200
     try:
-        data = request.get_json()
-        current_app.logger.info(f"Получен webhook от ЮKassa: {data}")
-        if not data:
-            current_app.logger.error("Пустые данные в webhook")
-            return "OK", 200
-        event = data.get("event")
-        payment_data = data.get("object", {})
-        payment_id = payment_data.get("id")
-        if not payment_id:
-            current_app.logger.error("Payment ID не найден в webhook")
-            return "OK", 200
-        current_app.logger.info(
-            f"Обработка webhook: event={event}, payment_id={payment_id}"
+        stored = PaymentService.store_webhook(
+            event, payment_id, request.get_data(as_text=True)
         )
-        success = PaymentService.process_payment_webhook(event, payment_data)
-        if success:
-            current_app.logger.info(
-                f"Webhook обработан успешно: payment_id={payment_id}"
-            )
-        else:
-            current_app.logger.error(
-                f"Ошибка обработки webhook: payment_id={payment_id}"
-            )
-        return "OK", 200
     except Exception as e:
-        current_app.logger.error(f"Ошибка обработки webhook: {str(e)}")
-        return "OK", 200
+        current_app.logger.error(f"Ошибка сохранения webhook: {str(e)}")
+        return "Error", 500
+    if stored:
+        current_app.logger.info(
+            f"Webhook поставлен в очередь: event={event}, payment_id={payment_id}"
+        )
+    else:
+        current_app.logger.info(
+            f"Повторная доставка webhook: event={event}, payment_id={payment_id}"
+        )
+    return "OK", 200
 
 
 @payment_bp.route("/payment/success")
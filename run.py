@@ -23,27 +23,44 @@ def run_telegram_bot():
     bot_manager.run_bot()
 
 
+def run_job_worker():
+    from app import create_app
+    from app.utils.file_storage import FileStorageManager  # noqa: F401
+    from app.utils.job_queue import JobQueue
+    from app.utils.subscription_state import SubscriptionState  # noqa: F401
+
+    app = create_app()
+    with app.app_context():
+        JobQueue.run_worker()
+
+
 def main():
+    import os
+
     website_process = Process(target=run_website)
     bot_process = Process(target=run_telegram_bot)
+    worker_processes = [
+        Process(target=run_job_worker)
+        for _ in range(int(os.getenv("JOB_WORKERS", 2)))
+    ]
+    processes = [website_process, bot_process, *worker_processes]
 
     try:
         website_process.start()
         time.sleep(1)
         bot_process.start()
-        website_process.join()
-        bot_process.join()
+        for worker_process in worker_processes:
+            worker_process.start()
+        for process in processes:
+            process.join()
 
     except KeyboardInterrupt:
         pass
     finally:
-        if website_process.is_alive():
-            website_process.terminate()
-            website_process.join()
-
-        if bot_process.is_alive():
-            bot_process.terminate()
-            bot_process.join()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
 
 
 if __name__ == "__main__":
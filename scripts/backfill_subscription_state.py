@@ -0,0 +1,58 @@
+import os
+import sys
+
+from sqlalchemy import inspect, text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models import User  # noqa: E402
+from app.utils.subscription_state import SubscriptionState  # noqa: E402
+
+
+def add_effective_column():
+    columns = {column["name"] for column in inspect(db.engine).get_columns("user")}
+    if "effective_subscription_expires" in columns:
+        return False
+    with db.engine.begin() as connection:
+        connection.execute(
+            text('ALTER TABLE "user" ADD COLUMN effective_subscription_expires TIMESTAMP')
+        )
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_user_effective_subscription_expires "
+                'ON "user" (effective_subscription_expires)'
+            )
+        )
+    return True
+
+
+def backfill_subscription_state():
+    app = create_app()
+    with app.app_context():
+        try:
+            if add_effective_column():
+                print("Добавлена колонка user.effective_subscription_expires")
+            updated = 0
+            for user in User.query.yield_per(500):
+                expires = SubscriptionState.compute_expires(user)
+                if user.effective_subscription_expires != expires:
+                    user.effective_subscription_expires = expires
+                    updated += 1
+            db.session.commit()
+            expired = SubscriptionState.expire_subscriptions()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Ошибка пересчета подписок: {e}")
+            return False
+        print(f"✅ Пересчитано подписок: {updated}, сброшено истекших: {expired}")
+        return True
+
+
+def main():
+    if not backfill_subscription_state():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Бенчмарк отдачи /files через настоящий HTTP-сервер.
+
+Приложение запускается на werkzeug (как app.run() в run.py, без
+wsgi.file_wrapper), на wsgiref (стандартный сервер с wsgi.file_wrapper без
+sendfile) и, если установлен, на gunicorn (wsgi.file_wrapper с os.sendfile).
+Клиент скачивает файл целиком и случайными диапазонами по HTTP через
+loopback и сверяет байты. Показывает MB/s, запросы/с и число ошибочных
+ответов.
+
+    python3 scripts/bench_file_serving.py --size-mb 64 --downloads 10 \\
+        --ranges 200 --range-kb 256
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def start_werkzeug(app, port):
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def start_wsgiref(app, port):
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    server = make_server(
+        "127.0.0.1",
+        port,
+        app,
+        server_class=ThreadingWSGIServer,
+        handler_class=QuietHandler,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def run_gunicorn(app, port):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"127.0.0.1:{port}")
+            self.cfg.set("workers", 1)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", 4)
+            self.cfg.set("loglevel", "warning")
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def start_gunicorn(app, port):
+    process = multiprocessing.get_context("fork").Process(
+        target=run_gunicorn, args=(app, port), daemon=True
+    )
+    process.start()
+
+    def stop():
+        process.terminate()
+        process.join()
+
+    return stop
+
+
+SERVERS = {
+    "werkzeug": start_werkzeug,
+    "wsgiref": start_wsgiref,
+    "gunicorn": start_gunicorn,
+}
+
+
+def bench_full(url, payload_sha256, file_size, downloads):
+    errors = 0
+    started = time.perf_counter()
+    with requests.Session() as session:
+        for _ in range(downloads):
+            digest = hashlib.sha256()
+            received = 0
+            with session.get(url, stream=True) as response:
+                for chunk in response.iter_content(1 << 20):
+                    digest.update(chunk)
+                    received += len(chunk)
+            if received != file_size or digest.hexdigest() != payload_sha256:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    return file_size * downloads / (1024 * 1024) / elapsed, errors
+
+
+def bench_ranges(url, payload, count, range_size):
+    errors = 0
+    rng = random.Random(0)
+    started = time.perf_counter()
+    with requests.Session() as session:
+        for _ in range(count):
+            start = rng.randrange(0, len(payload) - range_size)
+            end = start + range_size - 1
+            response = session.get(url, headers={"Range": f"bytes={start}-{end}"})
+            if response.status_code != 206 or response.content != payload[
+                start : end + 1
+            ]:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    return count / elapsed, count * range_size / (1024 * 1024) / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--downloads", type=int, default=10)
+    parser.add_argument("--ranges", type=int, default=200)
+    parser.add_argument("--range-kb", type=int, default=256)
+    parser.add_argument(
+        "--servers", default="werkzeug,wsgiref,gunicorn", help="через запятую"
+    )
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench-files-")
+    os.environ.update(
+        {
+            "SECRET_KEY": os.environ.get("SECRET_KEY", "bench"),
+            "LOG_FILE": os.devnull,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{work_dir}/bench.db",
+        }
+    )
+
+    from app import create_app, db
+    from app.utils.file_index import FileIndex
+    from app.utils.file_storage import FileStorageManager
+
+    app = create_app()
+    app.config["SERVER_NAME"] = None
+    app.config["UPLOAD_FOLDER"] = os.path.join(work_dir, "uploads")
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+    payload_sha256 = hashlib.sha256(payload).hexdigest()
+    with app.app_context():
+        db.create_all()
+        full_path, _ = FileStorageManager.get_material_upload_path(1, "bench.bin")
+        with open(full_path, "wb") as f:
+            f.write(payload)
+        FileIndex.record(full_path, payload_sha256)
+        db.session.commit()
+
+    print(
+        f"Файл: {args.size_mb} MB, загрузок: {args.downloads}, "
+        f"диапазонов: {args.ranges} по {args.range_kb} KB"
+    )
+    try:
+        run_servers(app, args, payload, payload_sha256)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_servers(app, args, payload, payload_sha256):
+    for name in args.servers.split(","):
+        if name == "gunicorn":
+            try:
+                import gunicorn  # noqa: F401
+            except ImportError:
+                print(f"{name:<10} не установлен, пропуск")
+                continue
+        port = free_port()
+        stop = SERVERS[name](app, port)
+        try:
+            if not wait_for_port(port):
+                print(f"{name:<10} сервер не запустился")
+                continue
+            url = f"http://127.0.0.1:{port}/files/1/bench.bin"
+            full_rate, full_errors = bench_full(
+                url, payload_sha256, len(payload), args.downloads
+            )
+            range_rps, range_rate, range_errors = bench_ranges(
+                url, payload, args.ranges, args.range_kb * 1024
+            )
+        finally:
+            stop()
+        print(
+            f"{name:<10} целиком {full_rate:8.1f} MB/s  "
+            f"диапазоны {range_rps:7.1f} запр/с ({range_rate:7.1f} MB/s)  "
+            f"ошибок {full_errors + range_errors}"
+        )
+
+
+if __name__ == "__main__":
+    main()
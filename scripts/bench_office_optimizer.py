@@ -0,0 +1,118 @@
+"""
+Бенчмарк пересжатия DOCX/PPTX: распаковка на диск против потоковой пересборки.
+
+Генерирует документ с XML-частями и уже сжатыми картинками в word/media
+и оптимизирует его копии двумя способами. Показывает время, пиковый объем
+временных файлов и итоговый размер.
+
+    python3 scripts/bench_office_optimizer.py --media-mb 64 --runs 5
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("LOG_FILE", os.devnull)
+
+from app import create_app  # noqa: E402
+from app.utils.file_optimizer import FileOptimizer  # noqa: E402
+
+
+def legacy_optimize(file_path, temp_root):
+    """Прежняя реализация: extractall, rglob и новый архив"""
+    temp_path = file_path + ".optimized"
+    with tempfile.TemporaryDirectory(dir=temp_root) as temp_dir:
+        temp_path_obj = Path(temp_dir)
+        with zipfile.ZipFile(file_path, "r") as zip_ref:
+            zip_ref.extractall(temp_path_obj)
+        for name in FileOptimizer.OFFICE_REMOVED_ENTRIES:
+            extracted = temp_path_obj / name
+            if extracted.exists():
+                extracted.unlink()
+        extracted_size = sum(
+            path.stat().st_size for path in temp_path_obj.rglob("*") if path.is_file()
+        )
+        with zipfile.ZipFile(
+            temp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=9
+        ) as zip_out:
+            for path in temp_path_obj.rglob("*"):
+                if path.is_file():
+                    zip_out.write(path, path.relative_to(temp_path_obj))
+    if os.path.getsize(temp_path) < os.path.getsize(file_path):
+        os.replace(temp_path, file_path)
+    else:
+        os.unlink(temp_path)
+    return extracted_size
+
+
+def streaming_optimize(file_path, temp_root):
+    FileOptimizer._optimize_office_file(file_path)
+    return 0
+
+
+def build_document(path, media_mb):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr("[Content_Types].xml", b"<Types/>")
+        zf.writestr(
+            "_rels/.rels",
+            b'<Relationships><Relationship Id="rId1" Target="word/document.xml"/>'
+            b'<Relationship Id="rId2" Target="docProps/thumbnail.jpeg"/>'
+            b"</Relationships>",
+        )
+        zf.writestr(
+            "word/document.xml",
+            b"<w:document>" + b"<w:p><w:r><w:t>text</w:t></w:r></w:p>" * 200000
+            + b"</w:document>",
+        )
+        for i in range(media_mb):
+            zf.writestr(f"word/media/image{i}.jpeg", os.urandom(1024 * 1024))
+        zf.writestr("docProps/thumbnail.jpeg", os.urandom(64 * 1024))
+
+
+def run(label, optimize, source, runs, work_dir):
+    timings = []
+    temp_peak = 0
+    result_size = 0
+    for i in range(runs):
+        file_path = os.path.join(work_dir, f"run{i}.docx")
+        shutil.copyfile(source, file_path)
+        started = time.perf_counter()
+        temp_peak = max(temp_peak, optimize(file_path, work_dir))
+        timings.append(time.perf_counter() - started)
+        result_size = os.path.getsize(file_path)
+        os.unlink(file_path)
+    print(
+        f"{label:<26} {sum(timings) / runs * 1000:10.1f} ms "
+        f"{temp_peak / (1024 * 1024):10.1f} MB temp "
+        f"{result_size / (1024 * 1024):10.1f} MB итог"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--media-mb", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with tempfile.TemporaryDirectory() as work_dir, app.app_context():
+        source = os.path.join(work_dir, "source.docx")
+        build_document(source, args.media_mb)
+        print(
+            f"Документ: {os.path.getsize(source) / (1024 * 1024):.1f} MB, "
+            f"запусков: {args.runs}"
+        )
+        run("до: extractall + rglob", legacy_optimize, source, args.runs, work_dir)
+        run("после: потоковая", streaming_optimize, source, args.runs, work_dir)
+
+
+if __name__ == "__main__":
+    main()
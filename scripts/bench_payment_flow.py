@@ -0,0 +1,261 @@
+"""
+Нагрузочный тест оплаты подписки против локальной заглушки ЮKassa.
+
+Поднимает заглушку (scripts/yookassa_stub.py), приложение на werkzeug и
+исполнителей фоновых задач на временной SQLite-базе, затем проводит
+--flows оплат по --concurrency одновременно: вход, создание платежа,
+переход на страницу подтверждения, опрос /api/payment/status и ожидание
+активации подписки через webhook. Показывает перцентили задержек этапов,
+время выполнения SQL и число ошибок блокировки базы.
+
+    python3 scripts/bench_payment_flow.py --flows 200 --concurrency 20 \\
+        --latency-ms 80 --error-rate 0.05
+"""
+
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values):
+    if not values:
+        return "нет данных"
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+
+    return (
+        f"p50 {pick(0.50):8.1f}  p95 {pick(0.95):8.1f}  "
+        f"p99 {pick(0.99):8.1f}  max {ordered[-1] * 1000:8.1f} мс  (n={len(values)})"
+    )
+
+
+class SqlStats:
+    """Время выполнения SQL и ошибки блокировки SQLite"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.durations = []
+        self.lock_errors = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        event.listen(engine, "handle_error", self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bench_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["bench_started"].pop()
+        with self._lock:
+            self.durations.append(elapsed)
+
+    def _error(self, context):
+        if "locked" in str(context.original_exception):
+            with self._lock:
+                self.lock_errors += 1
+
+
+def run_workers(app, stop, count):
+    from app import db
+    from app.utils.job_queue import JobQueue
+
+    def work(worker_id):
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    processed = JobQueue.run_pending(worker_id, max_jobs=10)
+                except Exception:
+                    db.session.rollback()
+                    processed = 0
+                finally:
+                    db.session.remove()
+                if not processed:
+                    time.sleep(0.05)
+
+    threads = [
+        threading.Thread(target=work, args=(f"bench-{index}",), daemon=True)
+        for index in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run_flow(app, base_url, username, amount, timings, poll_interval, timeout):
+    from app import db
+    from app.models import User
+    from app.utils.subscription_state import SubscriptionState
+
+    session = requests.Session()
+    session.post(
+        f"{base_url}/login",
+        data={"username": username, "password": "bench"},
+        allow_redirects=False,
+    )
+    flow_started = time.perf_counter()
+    started = time.perf_counter()
+    response = session.get(
+        f"{base_url}/subscription",
+        params={"period": "1", "amount": amount},
+        allow_redirects=False,
+    )
+    timings["create"].append(time.perf_counter() - started)
+    confirmation_url = response.headers.get("Location", "")
+    if "/confirm/" not in confirmation_url:
+        return False
+    payment_id = confirmation_url.rsplit("/", 1)[-1]
+    session.get(confirmation_url, allow_redirects=False)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        status = session.get(f"{base_url}/api/payment/status/{payment_id}")
+        timings["status"].append(time.perf_counter() - started)
+        if status.ok and status.json().get("status") == "succeeded":
+            break
+        time.sleep(poll_interval)
+    while time.monotonic() < deadline:
+        with app.app_context():
+            user = db.session.query(User).filter_by(username=username).one()
+            active = SubscriptionState.is_active(user)
+        if active:
+            timings["end_to_end"].append(time.perf_counter() - flow_started)
+            return True
+        time.sleep(poll_interval)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--flows", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--capture-delay", type=float, default=0.5)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    from yookassa_stub import YooKassaStub
+
+    app_port = free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+    stub = YooKassaStub(
+        ("127.0.0.1", 0),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        capture_delay=args.capture_delay,
+        webhook_url=f"{base_url}/payment/webhook",
+    )
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    db_fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(db_fd)
+    os.environ.update(
+        {
+            "SECRET_KEY": os.environ.get("SECRET_KEY", "bench"),
+            "LOG_FILE": os.devnull,
+            "SERVER_NAME": f"127.0.0.1:{app_port}",
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+            "YOOKASSA_API_URL": f"{stub.base_url}/v3",
+            "YOOKASSA_SHOP_ID": "bench-shop",
+            "YOOKASSA_SECRET_KEY": "bench-secret",
+        }
+    )
+
+    from werkzeug.security import generate_password_hash
+    from werkzeug.serving import make_server
+
+    from app import create_app, db
+    from app.models import User
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    password = generate_password_hash("bench")
+    usernames = [f"bench_{index}" for index in range(args.flows)]
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(
+            User(
+                username=username,
+                email=f"{username}@example.com",
+                password=password,
+                is_verified=True,
+            )
+            for username in usernames
+        )
+        db.session.commit()
+        sql_stats = SqlStats(db.engine)
+    amount = app.config["SUBSCRIPTION_PRICES"]["1"]
+
+    server = make_server("127.0.0.1", app_port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stop = threading.Event()
+    run_workers(app, stop, args.workers)
+
+    timings = {"create": [], "status": [], "end_to_end": []}
+    print(
+        f"Оплат: {args.flows}, одновременно: {args.concurrency}, "
+        f"задержка API: {args.latency_ms}+{args.jitter_ms} мс, "
+        f"ошибки API: {args.error_rate:.0%}"
+    )
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(
+                executor.map(
+                    lambda username: run_flow(
+                        app,
+                        base_url,
+                        username,
+                        amount,
+                        timings,
+                        args.poll_interval,
+                        args.timeout,
+                    ),
+                    usernames,
+                )
+            )
+    finally:
+        stop.set()
+        server.shutdown()
+        stub.shutdown()
+    elapsed = time.perf_counter() - started
+
+    completed = sum(results)
+    print(
+        f"Завершено: {completed}/{args.flows} за {elapsed:.1f} с "
+        f"({completed / elapsed:.1f} оплат/с)"
+    )
+    print(f"{'создание платежа':<18} {percentiles(timings['create'])}")
+    print(f"{'опрос статуса':<18} {percentiles(timings['status'])}")
+    print(f"{'до подписки':<18} {percentiles(timings['end_to_end'])}")
+    print(f"{'SQL-запрос':<18} {percentiles(sql_stats.durations)}")
+    print(f"Ошибок блокировки БД: {sql_stats.lock_errors}")
+    print(f"Заглушка ЮKassa: {stub.counters}")
+    os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.utils.image_variants import ImageVariants  # noqa: E402
+
+
+def build_image_variants(workers=None):
+    app = create_app()
+    with app.app_context():
+        print(f"Построение WebP и миниатюр в {app.config['UPLOAD_FOLDER']}")
+        try:
+            built, failed = ImageVariants.build_missing(workers)
+        except Exception as e:
+            print(f"❌ Ошибка построения производных изображений: {e}")
+            return False
+        print(f"✅ Изображений обработано: {built}")
+        if failed:
+            print(f"⚠️ Не удалось обработать: {failed}")
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Строит WebP-версии и миниатюры уже загруженных изображений"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="число процессов (по числу ядер)"
+    )
+    args = parser.parse_args()
+    if not build_image_variants(args.workers):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
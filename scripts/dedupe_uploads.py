@@ -0,0 +1,43 @@
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.utils.blob_store import BlobStore  # noqa: E402
+from app.utils.file_index import FileIndex  # noqa: E402
+from app.utils.file_storage import FileStorageManager  # noqa: E402
+
+
+def dedupe_uploads():
+    app = create_app()
+    with app.app_context():
+        print(f"Сканирование папки загрузок: {app.config['UPLOAD_FOLDER']}")
+        try:
+            count = FileIndex.rebuild()
+            print(f"✅ Индекс файлов пересобран, записей: {count}")
+            linked, saved_bytes = BlobStore.deduplicate_existing()
+            db.session.commit()
+            removed = BlobStore.collect_garbage()
+            legacy_blobs = os.path.join(app.config["UPLOAD_FOLDER"], BlobStore.BLOB_DIR)
+            if os.path.isdir(legacy_blobs):
+                shutil.rmtree(legacy_blobs)
+                print(f"🧹 Удалено старое хранилище блобов: {legacy_blobs}")
+        except Exception as e:
+            print(f"❌ Ошибка дедупликации загрузок: {e}")
+            return False
+        print(f"✅ Файлов связано с хранилищем блобов: {linked}")
+        print(f"✅ Освобождено: {FileStorageManager.format_file_size(saved_bytes)}")
+        if removed:
+            print(f"🧹 Удалено блобов без ссылок: {removed}")
+        return True
+
+
+def main():
+    if not dedupe_uploads():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
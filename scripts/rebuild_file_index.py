@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.utils.file_index import FileIndex  # noqa: E402
+
+
+def rebuild_file_index():
+    app = create_app()
+    with app.app_context():
+        print(f"Сканирование папки загрузок: {app.config['UPLOAD_FOLDER']}")
+        try:
+            count = FileIndex.rebuild()
+        except Exception as e:
+            print(f"❌ Ошибка пересборки индекса файлов: {e}")
+            return False
+        print(f"✅ Индекс файлов пересобран, записей: {count}")
+        return True
+
+
+def main():
+    if not rebuild_file_index():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
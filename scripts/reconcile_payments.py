@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.services.payment_service import PaymentService  # noqa: E402
+
+
+def reconcile_payments(stale_minutes=None):
+    app = create_app()
+    with app.app_context():
+        try:
+            report = PaymentService.reconcile_pending_payments(stale_minutes)
+        except Exception as e:
+            print(f"❌ Ошибка сверки платежей: {e}")
+            return False
+        print(f"Проверено зависших платежей: {report['checked']}")
+        for payment_id, (old_status, new_status) in report["updated"].items():
+            print(f"  {payment_id}: {old_status} -> {new_status}")
+        for payment_id in report["activated"]:
+            print(f"  {payment_id}: подписка активирована")
+        for payment_id in report["missing"]:
+            print(f"  {payment_id}: не найден в ЮKassa")
+        if "skipped" in report:
+            print(f"⚠️ Сверка пропущена: {report['skipped']}")
+        if "error" in report:
+            print(f"❌ Ошибка запроса к ЮKassa: {report['error']}")
+            return False
+        print(f"✅ Изменено статусов: {len(report['updated'])}")
+        return True
+
+
+def main():
+    if len(sys.argv) > 2:
+        print("Использование: python3 scripts/reconcile_payments.py [минуты]")
+        sys.exit(1)
+    stale_minutes = int(sys.argv[1]) if len(sys.argv) == 2 else None
+    if not reconcile_payments(stale_minutes):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
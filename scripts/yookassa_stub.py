@@ -0,0 +1,261 @@
+"""
+Локальная замена API ЮKassa для нагрузочного тестирования платежей.
+
+Реализует POST /v3/payments, GET /v3/payments/<id> и GET /v3/payments
+(список с created_at.gte/created_at.lt, limit и cursor). Переход по
+confirmation_url (/confirm/<id>) подтверждает платеж: через --capture-delay
+секунд он становится succeeded, и на --webhook-url уходит уведомление
+payment.succeeded. --latency-ms и --jitter-ms задерживают каждый ответ API,
+--error-rate задает долю ответов 500/503. Повтор POST с тем же
+Idempotence-Key возвращает тот же платеж.
+
+    python3 scripts/yookassa_stub.py --port 8765 \\
+        --webhook-url http://127.0.0.1:8002/payment/webhook
+    YOOKASSA_API_URL=http://127.0.0.1:8765/v3
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+
+def utc_timestamp():
+    return datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _api_call(self):
+        """Задержка и внедрение ошибок; False, если ответ уже отправлен"""
+        stub = self.server
+        stub.count("requests")
+        delay = stub.latency_ms + random.uniform(0, stub.jitter_ms)
+        time.sleep(delay / 1000)
+        if not self.headers.get("Authorization"):
+            self._send_json(401, {"type": "error", "code": "invalid_credentials"})
+            return False
+        if random.random() < stub.error_rate:
+            stub.count("injected_errors")
+            self._send_json(
+                random.choice((500, 503)),
+                {"type": "error", "code": "internal_server_error"},
+            )
+            return False
+        return True
+
+    def do_POST(self):  # noqa: N802
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if path != "/v3/payments":
+            self._send_json(404, {"type": "error", "code": "not_found"})
+            return
+        if not self._api_call():
+            return
+        key = self.headers.get("Idempotence-Key")
+        payment = self.server.create_payment(key, body)
+        self._send_json(200, payment)
+
+    def do_GET(self):  # noqa: N802
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "confirm":
+            self._confirm(parts[1])
+            return
+        if parts[:2] != ["v3", "payments"] or len(parts) > 3:
+            self._send_json(404, {"type": "error", "code": "not_found"})
+            return
+        if not self._api_call():
+            return
+        if len(parts) == 3:
+            payment = self.server.get_payment(parts[2])
+            if payment is None:
+                self._send_json(404, {"type": "error", "code": "not_found"})
+            else:
+                self._send_json(200, payment)
+            return
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        self._send_json(200, self.server.list_payments(query))
+
+    def _confirm(self, payment_id):
+        return_url = self.server.confirm_payment(payment_id)
+        if return_url is None:
+            self._send_json(404, {"type": "error", "code": "not_found"})
+            return
+        self.send_response(302)
+        self.send_header("Location", return_url)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class YooKassaStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency_ms=0.0,
+        jitter_ms=0.0,
+        error_rate=0.0,
+        capture_delay=0.0,
+        webhook_url=None,
+    ):
+        super().__init__(address, StubHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.capture_delay = capture_delay
+        self.webhook_url = webhook_url
+        self.payments = {}
+        self.return_urls = {}
+        self.idempotence = {}
+        self.counters = {"requests": 0, "injected_errors": 0, "webhooks": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def create_payment(self, key, body):
+        with self.lock:
+            if key and key in self.idempotence:
+                return dict(self.payments[self.idempotence[key]])
+            payment_id = str(uuid.uuid4())
+            payment = {
+                "id": payment_id,
+                "status": "pending",
+                "paid": False,
+                "amount": body.get("amount", {}),
+                "description": body.get("description"),
+                "metadata": body.get("metadata", {}),
+                "created_at": utc_timestamp(),
+                "confirmation": {
+                    "type": "redirect",
+                    "confirmation_url": f"{self.base_url}/confirm/{payment_id}",
+                },
+            }
+            self.payments[payment_id] = payment
+            self.return_urls[payment_id] = body.get("confirmation", {}).get(
+                "return_url", ""
+            )
+            if key:
+                self.idempotence[key] = payment_id
+            return dict(payment)
+
+    def get_payment(self, payment_id):
+        with self.lock:
+            payment = self.payments.get(payment_id)
+            return dict(payment) if payment else None
+
+    def list_payments(self, query):
+        limit = int(query.get("limit", 10))
+        offset = int(query.get("cursor", 0))
+        with self.lock:
+            items = sorted(
+                (dict(p) for p in self.payments.values()),
+                key=lambda p: p["created_at"],
+            )
+        if "created_at.gte" in query:
+            items = [p for p in items if p["created_at"] >= query["created_at.gte"]]
+        if "created_at.lt" in query:
+            items = [p for p in items if p["created_at"] < query["created_at.lt"]]
+        page = {"type": "list", "items": items[offset : offset + limit]}
+        if offset + limit < len(items):
+            page["next_cursor"] = str(offset + limit)
+        return page
+
+    def confirm_payment(self, payment_id):
+        with self.lock:
+            if payment_id not in self.payments:
+                return None
+            return_url = self.return_urls[payment_id]
+        timer = threading.Timer(
+            self.capture_delay, self.capture_payment, [payment_id]
+        )
+        timer.daemon = True
+        timer.start()
+        return return_url
+
+    def capture_payment(self, payment_id):
+        with self.lock:
+            payment = self.payments[payment_id]
+            payment.update(
+                status="succeeded",
+                paid=True,
+                captured_at=utc_timestamp(),
+            )
+            notification = {
+                "type": "notification",
+                "event": "payment.succeeded",
+                "object": dict(payment),
+            }
+        if not self.webhook_url:
+            return
+        for attempt in range(5):
+            try:
+                response = requests.post(
+                    self.webhook_url, json=notification, timeout=10
+                )
+                if response.status_code == 200:
+                    self.count("webhooks")
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.5 * 2**attempt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--capture-delay", type=float, default=1.0)
+    parser.add_argument("--webhook-url")
+    args = parser.parse_args()
+
+    stub = YooKassaStub(
+        (args.host, args.port),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        capture_delay=args.capture_delay,
+        webhook_url=args.webhook_url,
+    )
+    print(f"Заглушка ЮKassa: YOOKASSA_API_URL={stub.base_url}/v3")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Запросов: {stub.counters}")
+
+
+if __name__ == "__main__":
+    main()
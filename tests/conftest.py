@@ -23,6 +23,8 @@ def app():
         "SECRET_KEY": "test_secret_key",
         "UPLOAD_FOLDER": tempfile.mkdtemp(),
         "TICKET_FILES_FOLDER": tempfile.mkdtemp(),
+        "DATA_FOLDER": tempfile.mkdtemp(),
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
         "TESTING": "True",
         "MAIL_USERNAME": "test@gmail.com",
         "MAIL_PASSWORD": "test_password",
@@ -43,6 +45,7 @@ def app():
         app.config["TESTING"] = True
         app.config["SECRET_KEY"] = "test_secret_key"
         app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+        app.config["UPLOAD_FOLDER"] = test_env["UPLOAD_FOLDER"]
         app.config["WTF_CSRF_ENABLED"] = False
         app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
@@ -71,6 +74,7 @@ def app():
             db_path,
             test_env["UPLOAD_FOLDER"],
             test_env["TICKET_FILES_FOLDER"],
+            test_env["DATA_FOLDER"],
         ]
         for path in cleanup_paths:
             try:
@@ -223,3 +223,58 @@ class TestUserManagement:
             assert not UserManagementService.can_add_materials_to_subject(mod, subject)
 
             assert not UserManagementService.can_add_materials_to_subject(user, subject)
+
+    def test_subject_access_map_cached_until_group_change(self, app, db):
+        """Тест: проверки доступа берутся из карты и сбрасываются при смене групп."""
+        from sqlalchemy import event
+
+        from app.models import Group, SubjectGroup
+        from app.services.user_management_service import UserManagementService
+
+        with app.app_context():
+            group = Group(name=f"group{uuid.uuid4()}")
+            subjects = [Subject(title=f"Subject{uuid.uuid4()}") for _ in range(2)]
+            db.session.add_all([group, *subjects])
+            db.session.commit()
+            db.session.add(SubjectGroup(subject_id=subjects[0].id, group_id=group.id))
+            mod = User(
+                username=f"mod{uuid.uuid4()}",
+                email=f"mod{uuid.uuid4()}@gmail.com",
+                password="pass",
+                is_moderator=True,
+                group_id=group.id,
+            )
+            db.session.add(mod)
+            db.session.commit()
+            first, second = subjects[0], subjects[1]
+            db.session.refresh(mod)
+            db.session.refresh(first)
+            db.session.refresh(second)
+
+            assert UserManagementService.can_access_subject(mod, first.id)
+
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+            try:
+                assert UserManagementService.can_add_materials_to_subject(mod, first)
+                assert UserManagementService.can_manage_subject_materials(mod, first)
+                assert not UserManagementService.can_access_subject(mod, second.id)
+            finally:
+                event.remove(
+                    db.engine, "before_cursor_execute", before_cursor_execute
+                )
+            assert statements == []
+
+            db.session.add(SubjectGroup(subject_id=second.id, group_id=group.id))
+            db.session.commit()
+            assert UserManagementService.can_access_subject(mod, second.id)
+
+            SubjectGroup.query.filter_by(subject_id=first.id).delete()
+            db.session.commit()
+            assert not UserManagementService.can_access_subject(mod, first.id)
+            accessible = UserManagementService.get_accessible_subjects(mod)
+            assert [subject.id for subject in accessible] == [second.id]
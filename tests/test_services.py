@@ -10,6 +10,17 @@ from app.services.export_service import ExportService
 from app.models import Subject, Material, db
 
 
+def build_user_archive(user):
+    """Собирает архив решений пользователя так же, как задача export_solutions."""
+    subjects_dict = ExportService.collect_user_solutions(user.id)
+    fingerprint = ExportService.get_solutions_fingerprint(
+        user.id, user.username, subjects_dict
+    )
+    return ExportService.build_solutions_archive(
+        user.id, user.username, subjects_dict, fingerprint
+    )
+
+
 class TestSubjectService:
     """Тесты для SubjectService."""
 
@@ -82,6 +93,60 @@ class TestSubjectService:
 
                 SubjectService.get_subject_or_404(99999)
 
+    def test_get_subject_cards_single_query(self, app):
+        """Тест карточек предметов: счетчики, доступ по группе и один запрос."""
+        from sqlalchemy import event
+
+        from app.models import Group, SubjectGroup, User
+
+        with app.app_context():
+            group = Group(name=f"cards_{uuid.uuid4()}")
+            visible = Subject(title="Видимый")
+            hidden = Subject(title="Скрытый")
+            db.session.add_all([group, visible, hidden])
+            db.session.commit()
+            db.session.add(SubjectGroup(subject_id=visible.id, group_id=group.id))
+            for i, material_type in enumerate(["lecture", "assignment", "assignment"]):
+                db.session.add(
+                    Material(
+                        title=f"Материал {i}",
+                        type=material_type,
+                        subject_id=visible.id,
+                    )
+                )
+            user = User(
+                username=f"cards_{uuid.uuid4()}",
+                email=f"cards_{uuid.uuid4()}@gmail.com",
+                password="test",
+                group_id=group.id,
+            )
+            db.session.add(user)
+            db.session.commit()
+            db.session.refresh(user)
+
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+            try:
+                cards = SubjectService.get_subject_cards(user)
+            finally:
+                event.remove(
+                    db.engine, "before_cursor_execute", before_cursor_execute
+                )
+
+            assert len(statements) == 1
+            assert [card.id for card in cards] == [visible.id]
+            assert cards[0].material_count == 3
+            assert cards[0].assignment_count == 2
+            assert cards[0].last_updated is not None
+
+            all_cards = {card.id: card for card in SubjectService.get_subject_cards()}
+            assert all_cards[hidden.id].material_count == 0
+            assert all_cards[hidden.id].last_updated is None
+
 
 class TestMaterialService:
     """Тесты для MaterialService."""
@@ -110,6 +175,52 @@ class TestMaterialService:
             assert lectures[0].type == "lecture"
             assert assignments[0].type == "assignment"
 
+    def test_user_submissions_and_counts(self, app):
+        """Тест: решения только текущего пользователя и счетчики по заданиям."""
+        from app.models import Submission, User
+
+        with app.app_context():
+            subject = Subject(title=f"Subject {uuid.uuid4()}")
+            db.session.add(subject)
+            db.session.commit()
+            assignments = [
+                Material(title=f"Задание {i}", type="assignment", subject_id=subject.id)
+                for i in range(2)
+            ]
+            users = [
+                User(
+                    username=f"student_{uuid.uuid4()}",
+                    email=f"st_{uuid.uuid4()}@gmail.com",
+                    password="test",
+                )
+                for _ in range(3)
+            ]
+            db.session.add_all([*assignments, *users])
+            db.session.commit()
+            for user in users:
+                db.session.add(
+                    Submission(
+                        user_id=user.id,
+                        material_id=assignments[0].id,
+                        file=f"{subject.id}/users/{user.id}/a.txt",
+                    )
+                )
+            db.session.add(
+                Submission(
+                    user_id=users[0].id, material_id=assignments[1].id, file=None
+                )
+            )
+            db.session.commit()
+            material_ids = [material.id for material in assignments]
+
+            own = MaterialService.get_user_submissions(users[0].id, material_ids)
+            assert list(own) == [assignments[0].id]
+            assert own[assignments[0].id].user_id == users[0].id
+
+            counts = MaterialService.get_submission_counts(material_ids)
+            assert counts == {assignments[0].id: 3}
+            assert MaterialService.get_submission_counts([]) == {}
+
     def test_create_material(self, app):
         """Тест создания материала."""
         with app.app_context():
@@ -242,16 +353,65 @@ class TestExportService:
 
         long_name = "A" * 150
         result = ExportService.clean_folder_name(long_name)
-        assert result == "Предмет"
+        assert result == "A" * 100
+
+        result = ExportService.clean_folder_name(long_name, 42)
+        assert result == "A" * 97 + "_42"
+
+    def test_collect_submissions_unique_archive_paths(self, app):
+        """Тест: одноименные длинные задания не сливаются в одну папку архива."""
+        from app.models import Submission, User
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                app.config["UPLOAD_FOLDER"] = temp_dir
+                user = User(
+                    username=f"student_{uuid.uuid4()}",
+                    email=f"st_{uuid.uuid4()}@gmail.com",
+                    password="test",
+                )
+                subject = Subject(title="Информатика")
+                db.session.add_all([user, subject])
+                db.session.commit()
+                title = "Очень длинное название задания " * 5
+                for index in range(2):
+                    material = Material(
+                        title=title, type="assignment", subject_id=subject.id
+                    )
+                    db.session.add(material)
+                    db.session.commit()
+                    relative_path = f"{subject.id}/users/{user.id}/{index}/lab.txt"
+                    full_path = os.path.join(temp_dir, relative_path)
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    with open(full_path, "wb") as f:
+                        f.write(b"answer")
+                    db.session.add(
+                        Submission(
+                            user_id=user.id, material_id=material.id, file=relative_path
+                        )
+                    )
+                db.session.commit()
+
+                entries, manifest = ExportService.collect_submissions(subject)
+
+                archive_paths = [entry.arcname for entry in entries]
+                assert len(set(archive_paths)) == 2
+                assert [row[4] for row in manifest] == archive_paths
+                for path in archive_paths:
+                    assert len(path.split("/")[1]) <= ExportService.MAX_FOLDER_NAME_LENGTH
+
+        used_paths = set()
+        assert ExportService._unique_archive_path("a/lab.txt", used_paths) == "a/lab.txt"
+        assert ExportService._unique_archive_path("a/lab.txt", used_paths) == "a/lab_2.txt"
 
     def test_export_user_solutions_no_submissions(self, app):
         """Тест экспорта решений для пользователя без решений."""
         with app.app_context():
-            result = ExportService.export_user_solutions(999, "testuser")
-            assert result is None
+            result = ExportService.request_solutions_export(999, "testuser")
+            assert result == (None, None)
 
     def test_export_user_solutions_with_submissions(self, app):
-        """Тест экспорта решений для пользователя с решениями."""
+        """Тест экспорта решений для пользователя без решений в предмете."""
         with app.app_context():
 
             subject = Subject(title="Математика")
@@ -264,9 +424,185 @@ class TestExportService:
             db.session.add(material)
             db.session.commit()
 
-            result = ExportService.export_user_solutions(1, "testuser")
+            result = ExportService.request_solutions_export(1, "testuser")
+
+            assert result == (None, None)
+
+    def test_export_user_solutions_streams_zip(self, app):
+        """Тест потокового архива решений: файлы, README и сжатие по типу."""
+        import io
+        import zipfile
 
-            assert result is None
+        from app.models import Submission, User
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                app.config["UPLOAD_FOLDER"] = temp_dir
+                user = User(
+                    username=f"exporter_{uuid.uuid4()}",
+                    email=f"exp_{uuid.uuid4()}@gmail.com",
+                    password="test",
+                )
+                subject = Subject(title="Физика")
+                db.session.add_all([user, subject])
+                db.session.commit()
+                files = {"answer.pdf": b"%PDF-1.4 answer", "notes.txt": b"notes" * 100}
+                for filename, payload in files.items():
+                    material = Material(
+                        title=filename, type="assignment", subject_id=subject.id
+                    )
+                    db.session.add(material)
+                    db.session.commit()
+                    relative_path = f"{subject.id}/users/{user.id}/{filename}"
+                    full_path = os.path.join(temp_dir, relative_path)
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    with open(full_path, "wb") as f:
+                        f.write(payload)
+                    db.session.add(
+                        Submission(
+                            user_id=user.id,
+                            material_id=material.id,
+                            file=relative_path,
+                        )
+                    )
+                db.session.commit()
+
+                data = b"".join(build_user_archive(user))
+
+            with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+                assert zip_file.testzip() is None
+                assert zip_file.read("Физика/answer.pdf") == files["answer.pdf"]
+                assert zip_file.read("Физика/notes.txt") == files["notes.txt"]
+                assert "README.txt" in zip_file.namelist()
+                pdf_info = zip_file.getinfo("Физика/answer.pdf")
+                assert pdf_info.compress_type == zipfile.ZIP_STORED
+                txt_info = zip_file.getinfo("Физика/notes.txt")
+                assert txt_info.compress_type == zipfile.ZIP_DEFLATED
+
+    def test_collect_user_solutions_constant_queries(self, app):
+        """Тест: число запросов экспорта не зависит от числа решений."""
+        from sqlalchemy import event
+
+        from app.models import Submission, User
+
+        def count_queries(user_id):
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+            try:
+                db.session.expire_all()
+                ExportService.collect_user_solutions(user_id)
+            finally:
+                event.remove(
+                    db.engine, "before_cursor_execute", before_cursor_execute
+                )
+            return len(statements)
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                app.config["UPLOAD_FOLDER"] = temp_dir
+                counts = []
+                for submission_count in (2, 8):
+                    user = User(
+                        username=f"counter_{uuid.uuid4()}",
+                        email=f"cnt_{uuid.uuid4()}@gmail.com",
+                        password="test",
+                    )
+                    db.session.add(user)
+                    db.session.commit()
+                    for i in range(submission_count):
+                        subject = Subject(title=f"Предмет {i}")
+                        db.session.add(subject)
+                        db.session.commit()
+                        material = Material(
+                            title=f"Задание {i}",
+                            type="assignment",
+                            subject_id=subject.id,
+                        )
+                        db.session.add(material)
+                        db.session.commit()
+                        relative_path = f"{subject.id}/users/{user.id}/work{i}.txt"
+                        full_path = os.path.join(temp_dir, relative_path)
+                        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                        with open(full_path, "w") as f:
+                            f.write("answer")
+                        db.session.add(
+                            Submission(
+                                user_id=user.id,
+                                material_id=material.id,
+                                file=relative_path,
+                            )
+                        )
+                    db.session.commit()
+                    counts.append(count_queries(user.id))
+                    result = ExportService.collect_user_solutions(user.id)
+                    assert (
+                        sum(len(data["files"]) for data in result.values())
+                        == submission_count
+                    )
+
+                assert counts[0] == counts[1] == 1
+
+    def test_export_user_solutions_cached_until_submit(self, app):
+        """Тест: неизменившиеся решения отдаются из кэша, сдача его сбрасывает."""
+        import io
+
+        from werkzeug.datastructures import FileStorage
+
+        from app.models import Submission, User
+        from app.utils.export_cache import ExportCache
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                app.config["UPLOAD_FOLDER"] = temp_dir
+                user = User(
+                    username=f"cached_{uuid.uuid4()}",
+                    email=f"cache_{uuid.uuid4()}@gmail.com",
+                    password="test",
+                )
+                subject = Subject(title="Химия")
+                db.session.add_all([user, subject])
+                db.session.commit()
+                material = Material(
+                    title="Опыт", type="assignment", subject_id=subject.id
+                )
+                db.session.add(material)
+                db.session.commit()
+                relative_path = f"{subject.id}/users/{user.id}/report.txt"
+                full_path = os.path.join(temp_dir, relative_path)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                with open(full_path, "w") as f:
+                    f.write("first")
+                db.session.add(
+                    Submission(
+                        user_id=user.id, material_id=material.id, file=relative_path
+                    )
+                )
+                db.session.commit()
+
+                first = b"".join(build_user_archive(user))
+                subjects_dict = ExportService.collect_user_solutions(user.id)
+                fingerprint = ExportService.get_solutions_fingerprint(
+                    user.id, user.username, subjects_dict
+                )
+                cache_path = ExportCache.get_path(user.id, fingerprint)
+                assert os.path.exists(cache_path)
+                assert not cache_path.startswith(temp_dir)
+
+                second = b"".join(build_user_archive(user))
+                assert second == first
+
+                file_data = FileStorage(
+                    stream=io.BytesIO(b"second"), filename="report2.txt"
+                )
+                assert MaterialService.submit_solution(material, user.id, file_data)
+                assert not os.path.exists(cache_path)
+
+                third = b"".join(build_user_archive(user))
+                assert third != first
 
     def test_generate_readme_content(self, app):
         """Тест генерации содержимого README."""
@@ -295,3 +631,106 @@ class TestExportService:
             assert "Упражнение 1" in content
             assert "Упражнение 2" in content
             assert "Дата создания:" in content
+
+
+class TestPaymentReconciliation:
+    """Тесты для сверки зависших платежей."""
+
+    def test_reconcile_uses_paginated_listing(self, app):
+        """Тест: статусы берутся из постраничного списка, а не по платежу."""
+        from datetime import datetime, timedelta
+        from unittest.mock import patch
+
+        from app.models import Payment, User
+        from app.services.payment_service import PaymentService
+        from app.utils.payment_service import YooKassaService
+
+        keys = {"YOOKASSA_SHOP_ID": "shop", "YOOKASSA_SECRET_KEY": "secret"}
+        with app.app_context(), patch.dict(app.config, keys):
+            user = User(username="reconcile", email="reconcile@example.com")
+            user.password = "x"
+            db.session.add(user)
+            db.session.flush()
+            old = datetime.utcnow() - timedelta(hours=1)
+            for payment_id, created_at in (
+                ("paid", old),
+                ("canceled", old),
+                ("lost", old),
+                ("fresh", datetime.utcnow()),
+                ("ancient", datetime.utcnow() - timedelta(days=30)),
+            ):
+                db.session.add(
+                    Payment(
+                        user_id=user.id,
+                        yookassa_payment_id=payment_id,
+                        amount=89,
+                        status="pending",
+                        created_at=created_at,
+                    )
+                )
+            db.session.commit()
+
+            pages = [
+                {
+                    "items": [{"id": "paid", "status": "succeeded", "paid": True}],
+                    "next_cursor": "page-2",
+                },
+                {"items": [{"id": "canceled", "status": "canceled"}]},
+            ]
+            with patch.object(
+                YooKassaService, "_make_api_request", side_effect=pages
+            ) as api:
+                report = PaymentService.reconcile_pending_payments(15)
+
+            assert api.call_count == 2
+            assert "cursor=page-2" in api.call_args.args[0]
+            first_url = api.call_args_list[0].args[0]
+            window_start = (old - timedelta(minutes=10)).date().isoformat()
+            assert f"created_at.gte={window_start}" in first_url
+            assert report["checked"] == 3
+            assert report["updated"] == {
+                "paid": ["pending", "succeeded"],
+                "canceled": ["pending", "canceled"],
+            }
+            assert report["activated"] == ["paid"]
+            assert report["missing"] == ["lost"]
+            statuses = dict(
+                db.session.query(Payment.yookassa_payment_id, Payment.status).all()
+            )
+            assert statuses["fresh"] == "pending"
+            assert statuses["ancient"] == "pending"
+            assert db.session.get(User, user.id).has_active_subscription()
+
+    def test_deactivation_is_committed_by_caller(self, app):
+        """Тест: снятие подписки по отмененному платежу не делает свой commit."""
+        from datetime import datetime, timedelta
+
+        from app.models import Payment, User
+        from app.services.payment_service import PaymentService
+
+        with app.app_context():
+            user = User(username="canceler", email="canceler@example.com")
+            user.password = "x"
+            user.is_subscribed = True
+            user.subscription_expires = datetime.utcnow() + timedelta(days=30)
+            db.session.add(user)
+            db.session.flush()
+            payment = Payment(
+                user_id=user.id,
+                yookassa_payment_id="to-cancel",
+                amount=89,
+                status="pending",
+            )
+            db.session.add(payment)
+            db.session.commit()
+
+            assert PaymentService._deactivate_subscription_for_payment(payment)
+            db.session.rollback()
+            assert db.session.get(User, user.id).is_subscribed
+
+            assert PaymentService.process_payment_webhook(
+                "payment.canceled", {"id": "to-cancel", "status": "canceled"}
+            )
+            db.session.expire_all()
+            assert not db.session.get(User, user.id).is_subscribed
+            assert db.session.get(Payment, payment.id).status == "canceled"
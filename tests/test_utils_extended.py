@@ -122,6 +122,641 @@ class TestFileStorageManager:
                     assert "456" in rel_path
 
 
+class TestFileIndex:
+    """Тесты для индекса расположения файлов."""
+
+    def test_record_and_resolve(self, app):
+        """Тест записи и поиска файла в индексе."""
+        from app.utils.file_index import FileIndex
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    full_path, _ = FileStorageManager.get_material_upload_path(
+                        7, "lecture.pdf"
+                    )
+                    with open(full_path, "wb") as f:
+                        f.write(b"%PDF")
+
+                    assert FileIndex.record(full_path)
+                    assert FileIndex.resolve(7, "lecture.pdf") == full_path
+                    assert FileIndex.resolve(8, "lecture.pdf") is None
+
+    def test_record_failure_keeps_caller_changes(self, app):
+        """Тест: ошибка записи индекса не откатывает изменения вызывающего кода."""
+        from app import db
+        from app.models import FileLocation, Subject
+        from app.utils.file_index import FileIndex
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    full_path, _ = FileStorageManager.get_material_upload_path(
+                        11, "draft.pdf"
+                    )
+                    with open(full_path, "wb") as f:
+                        f.write(b"%PDF")
+                    assert FileIndex.record(full_path)
+                    db.session.commit()
+
+                    db.session.add(Subject(title="Savepoint Subject"))
+                    missing = Mock()
+                    missing.filter_by.return_value.first.return_value = None
+                    with patch.object(FileLocation, "query", missing):
+                        assert not FileIndex.record(full_path)
+                    db.session.commit()
+
+                    assert Subject.query.filter_by(title="Savepoint Subject").count()
+                    assert FileIndex.resolve(11, "draft.pdf") == full_path
+
+    def test_material_has_priority_over_user_file(self, app):
+        """Тест приоритета файла материала над решением пользователя."""
+        from app.utils.file_index import FileIndex
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    material_path, _ = FileStorageManager.get_material_upload_path(
+                        1, "task.pdf"
+                    )
+                    user_path, _ = FileStorageManager.get_subject_upload_path(
+                        1, 5, "task.pdf"
+                    )
+                    for path in (material_path, user_path):
+                        with open(path, "wb") as f:
+                            f.write(b"data")
+
+                    FileIndex.record(user_path)
+                    FileIndex.record(material_path)
+                    assert FileIndex.resolve(1, "task.pdf") == material_path
+
+                    os.remove(material_path)
+                    assert FileIndex.resolve(1, "task.pdf") == user_path
+
+    def test_record_stores_validators(self, app):
+        """Тест сохранения валидаторов и фоновой переиндексации измененного файла."""
+        import hashlib
+
+        from app.models import BackgroundJob
+        from app.utils.file_index import INDEX_FILE_JOB, FileIndex
+        from app.utils.job_queue import JobQueue
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    full_path, _ = FileStorageManager.get_material_upload_path(
+                        2, "slides.pdf"
+                    )
+                    with open(full_path, "wb") as f:
+                        f.write(b"first")
+                    FileIndex.record(full_path)
+                    location = FileIndex.get_metadata(full_path)
+                    assert location.size == 5
+                    assert location.sha256 == hashlib.sha256(b"first").hexdigest()
+
+                    with open(full_path, "wb") as f:
+                        f.write(b"second version")
+                    os.utime(full_path, (1, 1))
+                    with patch.object(FileIndex, "compute_sha256") as hash_file:
+                        assert FileIndex.get_metadata(full_path) is None
+                        assert FileIndex.get_metadata(full_path) is None
+                    hash_file.assert_not_called()
+                    assert (
+                        BackgroundJob.query.filter_by(
+                            kind=INDEX_FILE_JOB, status=JobQueue.STATUS_PENDING
+                        ).count()
+                        == 1
+                    )
+
+                    assert JobQueue.run_pending("test-worker") == 1
+                    location = FileIndex.get_metadata(full_path)
+                    assert location.size == 14
+                    assert location.sha256 == hashlib.sha256(b"second version").hexdigest()
+
+    def test_delete_file_forgets_location(self, app):
+        """Тест удаления записи индекса вместе с файлом."""
+        from app.utils.file_index import FileIndex
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    full_path, rel_path = FileStorageManager.get_material_upload_path(
+                        3, "notes.txt"
+                    )
+                    with open(full_path, "wb") as f:
+                        f.write(b"notes")
+                    FileIndex.record(full_path)
+
+                    assert FileStorageManager.delete_file(rel_path)
+                    assert not os.path.exists(full_path)
+                    assert FileIndex.resolve(3, "notes.txt") is None
+
+    def test_rebuild(self, app):
+        """Тест пересборки индекса по содержимому папки загрузок."""
+        from app.models import FileLocation
+        from app.utils.file_index import FileIndex
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    paths = [
+                        FileStorageManager.get_material_upload_path(2, "a.pdf")[0],
+                        FileStorageManager.get_subject_upload_path(2, 9, "b.pdf")[0],
+                        FileStorageManager.get_subject_upload_path(2, 9, "a.pdf")[0],
+                    ]
+                    for path in paths:
+                        with open(path, "wb") as f:
+                            f.write(b"x")
+
+                    assert FileIndex.rebuild() == 3
+                    assert FileIndex.resolve(2, "a.pdf") == paths[0]
+                    assert FileIndex.resolve(2, "b.pdf") == paths[1]
+                    location = FileLocation.query.filter_by(filename="b.pdf").first()
+                    assert location.user_id == 9
+
+
+class TestBlobStore:
+    """Тесты для дедуплицирующего хранилища загрузок."""
+
+    def test_same_content_shares_blob(self, app):
+        """Тест: одинаковые загрузки ссылаются на один блоб до удаления последней."""
+        import hashlib
+        import io
+
+        from werkzeug.datastructures import FileStorage
+
+        from app.utils.blob_store import BlobStore
+
+        payload = b"%PDF-1.4 shared lecture"
+        sha256 = hashlib.sha256(payload).hexdigest()
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    paths = []
+                    for subject_id in (1, 2):
+                        full_path, rel_path = (
+                            FileStorageManager.get_material_upload_path(
+                                subject_id, "lecture.pdf"
+                            )
+                        )
+                        upload = FileStorage(
+                            stream=io.BytesIO(payload), filename="lecture.pdf"
+                        )
+                        assert FileStorageManager.save_file(upload, full_path)
+                        paths.append((full_path, rel_path))
+
+                    blob_path = BlobStore.blob_path(sha256)
+                    assert not blob_path.startswith(temp_dir)
+                    assert os.path.samefile(paths[0][0], blob_path)
+                    assert os.path.samefile(paths[1][0], blob_path)
+
+                    assert FileStorageManager.delete_file(paths[0][1])
+                    assert os.path.exists(blob_path)
+                    with open(paths[1][0], "rb") as f:
+                        assert f.read() == payload
+
+                    assert FileStorageManager.delete_file(paths[1][1])
+                    assert not os.path.exists(blob_path)
+
+    def test_deduplicate_existing(self, app):
+        """Тест дедупликации уже загруженных копий."""
+        from app.utils.blob_store import BlobStore
+        from app.utils.file_index import FileIndex
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    paths = [
+                        FileStorageManager.get_material_upload_path(3, "t.zip")[0],
+                        FileStorageManager.get_material_upload_path(4, "t.zip")[0],
+                        FileStorageManager.get_subject_upload_path(4, 7, "u.txt")[0],
+                    ]
+                    for path in paths:
+                        with open(path, "wb") as f:
+                            f.write(b"same bytes")
+
+                    assert FileIndex.rebuild() == 3
+                    linked, saved_bytes = BlobStore.deduplicate_existing()
+                    assert linked == 3
+                    assert saved_bytes == 2 * len(b"same bytes")
+                    assert os.path.samefile(paths[0], paths[2])
+                    assert BlobStore.deduplicate_existing() == (0, 0)
+
+    def test_delete_user_files_releases_own_blobs(self, app):
+        """Тест: удаление файлов пользователя проверяет только его блобы."""
+        import hashlib
+        import io
+
+        from werkzeug.datastructures import FileStorage
+
+        from app.utils.blob_store import BlobStore
+
+        shared, own = b"shared task", b"own solution"
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    uploads = [
+                        (FileStorageManager.get_material_upload_path(1, "t"), shared),
+                        (FileStorageManager.get_subject_upload_path(1, 5, "a"), shared),
+                        (FileStorageManager.get_subject_upload_path(1, 5, "b"), own),
+                    ]
+                    for (full_path, _), payload in uploads:
+                        upload = FileStorage(stream=io.BytesIO(payload), filename="x")
+                        assert FileStorageManager.save_file(upload, full_path)
+
+                    with patch.object(
+                        BlobStore, "release", wraps=BlobStore.release
+                    ) as release:
+                        assert FileStorageManager.delete_user_files(5)
+                    assert release.call_count == 2
+                    assert os.path.exists(
+                        BlobStore.blob_path(hashlib.sha256(shared).hexdigest())
+                    )
+                    assert not os.path.exists(
+                        BlobStore.blob_path(hashlib.sha256(own).hexdigest())
+                    )
+
+
+class TestFileOptimizer:
+    """Тесты для оптимизации загружаемых файлов."""
+
+    def test_office_file_streaming_recompression(self, app):
+        """Тест: DOCX пересжимается, миниатюра и ссылка на нее удаляются."""
+        import zipfile
+        import zlib
+
+        from app.utils.file_optimizer import FileOptimizer
+
+        rels = (
+            b'<?xml version="1.0"?><Relationships>'
+            b'<Relationship Id="rId1" Target="word/document.xml"/>'
+            b'<Relationship Id="rId2" Target="docProps/thumbnail.jpeg"/>'
+            b"</Relationships>"
+        )
+        document = b"<w:document>" + b"<w:p>text</w:p>" * 5000 + b"</w:document>"
+        image = os.urandom(4096)
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                file_path = os.path.join(temp_dir, "report.docx")
+                with zipfile.ZipFile(file_path, "w", zipfile.ZIP_STORED) as zf:
+                    zf.writestr("[Content_Types].xml", b"<Types/>")
+                    zf.writestr("_rels/.rels", rels)
+                    for name, data in (
+                        ("word/document.xml", document),
+                        ("word/media/image1.png", image),
+                    ):
+                        info = zipfile.ZipInfo(name, date_time=(2020, 5, 17, 9, 30, 0))
+                        info.external_attr = 0o100644 << 16
+                        zf.writestr(info, data)
+                    zf.writestr("docProps/thumbnail.jpeg", os.urandom(1024))
+
+                assert FileOptimizer.optimize_file(file_path) == (True, None)
+
+                with zipfile.ZipFile(file_path) as zf:
+                    assert zf.namelist() == [
+                        "[Content_Types].xml",
+                        "_rels/.rels",
+                        "word/document.xml",
+                        "word/media/image1.png",
+                    ]
+                    assert b"thumbnail" not in zf.read("_rels/.rels")
+                    assert b"word/document.xml" in zf.read("_rels/.rels")
+                    assert zf.read("word/document.xml") == document
+                    assert zf.read("word/media/image1.png") == image
+                    media = zf.getinfo("word/media/image1.png")
+                    assert media.compress_type == zipfile.ZIP_STORED
+                    assert (
+                        zf.getinfo("word/document.xml").compress_type
+                        == zipfile.ZIP_DEFLATED
+                    )
+                    level9 = zlib.compressobj(9, zlib.DEFLATED, -15)
+                    assert zf.getinfo("word/document.xml").compress_size == len(
+                        level9.compress(document) + level9.flush()
+                    )
+                    for name in ("word/document.xml", "word/media/image1.png"):
+                        info = zf.getinfo(name)
+                        assert info.date_time == (2020, 5, 17, 9, 30, 0)
+                        assert info.external_attr == 0o100644 << 16
+                assert os.listdir(temp_dir) == ["report.docx"]
+
+    def test_office_file_invalid_archive(self, app):
+        """Тест: поврежденный архив не изменяется."""
+        from app.utils.file_optimizer import FileOptimizer
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                file_path = os.path.join(temp_dir, "broken.pptx")
+                with open(file_path, "wb") as f:
+                    f.write(b"not a zip")
+
+                assert FileOptimizer.optimize_file(file_path) == (False, None)
+                with open(file_path, "rb") as f:
+                    assert f.read() == b"not a zip"
+                assert os.listdir(temp_dir) == ["broken.pptx"]
+
+    def test_image_metadata_stripped(self, app):
+        """Тест: EXIF удаляется, ориентация применяется к пикселям, ICC сохраняется."""
+        from PIL import Image, ImageCms
+
+        from app.utils.file_optimizer import FileOptimizer
+        from app.utils.image_variants import ImageVariants
+
+        icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                file_path = os.path.join(temp_dir, "photo.jpg")
+                exif = Image.Exif()
+                exif[0x0112] = 6
+                exif[0x010F] = "Camera"
+                Image.new("RGB", (200, 100), "red").save(
+                    file_path,
+                    format="JPEG",
+                    quality=95,
+                    exif=exif,
+                    icc_profile=icc_profile,
+                )
+
+                assert FileOptimizer.optimize_file(file_path) == (True, None)
+
+                with Image.open(file_path) as image:
+                    assert image.size == (100, 200)
+                    assert not image.getexif()
+                    assert image.info["icc_profile"] == icc_profile
+                assert os.listdir(temp_dir) == ["photo.jpg"]
+
+                thumb_path = os.path.join(temp_dir, "photo.thumb.webp")
+                ImageVariants.render(
+                    file_path, os.path.join(temp_dir, "photo.webp"), thumb_path
+                )
+                with Image.open(thumb_path) as thumbnail:
+                    assert thumbnail.info["icc_profile"] == icc_profile
+
+
+class TestJobQueue:
+    """Тесты для фоновой очереди задач."""
+
+    def test_save_file_enqueues_optimization(self, app):
+        """Тест: сохранение PDF ставит оптимизацию в очередь, а не выполняет ее."""
+        import io
+
+        from werkzeug.datastructures import FileStorage
+
+        from app.models import BackgroundJob
+        from app.utils.file_storage import OPTIMIZE_FILE_JOB
+        from app.utils.job_queue import JobQueue
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    full_path, _ = FileStorageManager.get_material_upload_path(
+                        1, "lecture.pdf"
+                    )
+                    upload = FileStorage(
+                        stream=io.BytesIO(b"%PDF-1.4 lecture"), filename="lecture.pdf"
+                    )
+                    with patch(
+                        "app.utils.file_storage.FileOptimizer.optimize_file"
+                    ) as optimize:
+                        assert FileStorageManager.save_file(upload, full_path)
+                        optimize.assert_not_called()
+
+                    job = BackgroundJob.query.one()
+                    assert job.kind == OPTIMIZE_FILE_JOB
+                    assert job.status == JobQueue.STATUS_PENDING
+                    assert JobQueue.get_payload(job)["path"] == full_path
+
+    def test_optimization_job_swaps_file(self, app):
+        """Тест: результат оптимизации заменяет файл и обновляет индекс."""
+        import hashlib
+        import io
+
+        from werkzeug.datastructures import FileStorage
+
+        from app.utils.file_index import FileIndex
+        from app.utils.job_queue import JobQueue
+
+        def fake_optimize(path):
+            with open(path, "wb") as f:
+                f.write(b"small")
+            return True, None
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    full_path, _ = FileStorageManager.get_material_upload_path(
+                        1, "scan.pdf"
+                    )
+                    upload = FileStorage(
+                        stream=io.BytesIO(b"%PDF-1.4 large scan"), filename="scan.pdf"
+                    )
+                    assert FileStorageManager.save_file(upload, full_path)
+                    with patch(
+                        "app.utils.file_storage.FileOptimizer.optimize_file",
+                        side_effect=fake_optimize,
+                    ):
+                        assert JobQueue.run_pending("test-worker") == 1
+
+                    with open(full_path, "rb") as f:
+                        assert f.read() == b"small"
+                    location = FileIndex.get_metadata(full_path)
+                    assert location.sha256 == hashlib.sha256(b"small").hexdigest()
+                    assert sorted(os.listdir(os.path.dirname(full_path))) == [
+                        "scan.pdf"
+                    ]
+
+    def test_optimization_job_skips_replaced_file(self, app):
+        """Тест: если файл заменили до запуска задачи, результат отбрасывается."""
+        from app.models import BackgroundJob
+        from app.utils.job_queue import JobQueue
+
+        with app.app_context():
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with patch.dict(app.config, {"UPLOAD_FOLDER": temp_dir}):
+                    full_path, _ = FileStorageManager.get_material_upload_path(
+                        1, "task.pdf"
+                    )
+                    with open(full_path, "wb") as f:
+                        f.write(b"new version")
+                    FileStorageManager.enqueue_optimization(full_path, "0" * 64)
+                    with patch(
+                        "app.utils.file_storage.FileOptimizer.optimize_file"
+                    ) as optimize:
+                        JobQueue.run_pending("test-worker")
+                        optimize.assert_not_called()
+
+                    job = BackgroundJob.query.one()
+                    assert job.status == JobQueue.STATUS_DONE
+                    assert JobQueue.get_result(job)["reason"] == "changed"
+
+    def test_concurrency_limit(self, app):
+        """Тест: лимит одновременных задач одного вида."""
+        from app.utils.job_queue import JobQueue
+
+        with app.app_context():
+            with patch.dict(JobQueue._handlers, {"test_job": (Mock(return_value=None), 1)}):
+                JobQueue.enqueue("test_job", {"n": 1})
+                JobQueue.enqueue("test_job", {"n": 2})
+                first = JobQueue.claim("worker-1")
+                assert first is not None
+                assert JobQueue.claim("worker-2") is None
+
+                assert JobQueue.run_job(first)
+                second = JobQueue.claim("worker-2")
+                assert JobQueue.get_payload(second) == {"n": 2}
+
+    def test_failed_job_is_retried(self, app):
+        """Тест: упавшая задача возвращается в очередь до исчерпания попыток."""
+        from app.models import BackgroundJob
+        from app.models import db as database
+        from app.utils.job_queue import JobQueue
+
+        handler = Mock(side_effect=RuntimeError("boom"))
+        with app.app_context():
+            with patch.dict(JobQueue._handlers, {"test_job": (handler, 1)}):
+                job = JobQueue.enqueue("test_job", max_attempts=2)
+                job_id = job.id
+                assert not JobQueue.run_job(JobQueue.claim("worker"))
+                job = BackgroundJob.query.get(job_id)
+                assert job.status == JobQueue.STATUS_PENDING
+                assert job.error == "boom"
+
+                job.run_after = job.created_at
+                database.session.commit()
+                assert not JobQueue.run_job(JobQueue.claim("worker"))
+                job = BackgroundJob.query.get(job_id)
+                assert job.status == JobQueue.STATUS_FAILED
+                assert handler.call_count == 2
+
+    def test_schedule_periodic_skips_job_added_concurrently(self, app):
+        """Тест: периодическая задача, поставленная другим процессом, не дублируется."""
+        from datetime import datetime, timedelta
+
+        from app import db
+        from app.models import BackgroundJob
+        from app.utils.job_queue import JobQueue
+        from app.utils.subscription_state import EXPIRE_SUBSCRIPTIONS_JOB
+
+        with app.app_context():
+            db.session.add(
+                BackgroundJob(
+                    kind=EXPIRE_SUBSCRIPTIONS_JOB,
+                    status=JobQueue.STATUS_DONE,
+                    finished_at=datetime.utcnow() - timedelta(hours=1),
+                )
+            )
+            db.session.commit()
+
+            def other_worker_schedules(kind):
+                if kind == EXPIRE_SUBSCRIPTIONS_JOB:
+                    db.session.add(BackgroundJob(kind=kind))
+                    db.session.flush()
+                return 60
+
+            with patch.object(
+                JobQueue, "get_interval", side_effect=other_worker_schedules
+            ):
+                JobQueue.schedule_periodic()
+
+            pending = BackgroundJob.query.filter_by(
+                kind=EXPIRE_SUBSCRIPTIONS_JOB, status=JobQueue.STATUS_PENDING
+            ).count()
+            assert pending == 1
+
+
+class TestFragmentCache:
+    """Тесты кэша фрагментов шаблонов."""
+
+    def test_cache_tag_invalidated_by_commit(self, app):
+        """Тест: {% cache %} отдает фрагмент из кэша до commit предмета."""
+        from app.models import Group, Subject, SubjectGroup, db
+
+        def render_template_string(source, **context):
+            return app.jinja_env.from_string(source).render(**context)
+
+        template = '{% cache ("titles",), 300 %}{{ render() }}{% endcache %}'
+        with app.app_context():
+            renders = []
+
+            def render():
+                renders.append(1)
+                return ",".join(subject.title for subject in Subject.query.all())
+
+            db.session.add(Subject(title="Алгебра"))
+            db.session.commit()
+            assert render_template_string(template, render=render) == "Алгебра"
+            assert render_template_string(template, render=render) == "Алгебра"
+            assert len(renders) == 1
+
+            db.session.add(Subject(title="Геометрия"))
+            db.session.commit()
+            assert render_template_string(template, render=render) == "Алгебра,Геометрия"
+            assert len(renders) == 2
+
+            group = Group(name="Группа фрагментов")
+            db.session.add(group)
+            db.session.commit()
+            render_template_string(template, render=render)
+            assert len(renders) == 2
+
+            subject = Subject.query.first()
+            db.session.add(SubjectGroup(subject_id=subject.id, group_id=group.id))
+            db.session.commit()
+            render_template_string(template, render=render)
+            SubjectGroup.query.filter_by(subject_id=subject.id).delete()
+            db.session.commit()
+            render_template_string(template, render=render)
+            assert len(renders) == 4
+
+            render_template_string(
+                '{% cache ("titles",), 0 %}{{ render() }}{% endcache %}',
+                render=render,
+            )
+            assert len(renders) == 5
+
+    def test_concurrent_misses_render_once(self, app):
+        """Тест: параллельные промахи по одному ключу рендерят фрагмент один раз."""
+        import threading
+        import time
+
+        from app.utils.fragment_cache import FragmentCache
+
+        renders = []
+        results = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.2)
+            return "fragment"
+
+        def request_fragment():
+            with app.app_context():
+                results.append(FragmentCache.get_or_render(("lesson",), 60, render))
+
+        with app.app_context():
+            FragmentCache.get_backend()
+        threads = [threading.Thread(target=request_fragment) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["fragment"] * 5
+        assert len(renders) == 1
+
+    def test_local_backend_evicts_least_recent(self):
+        """Тест: локальный бэкенд хранит не больше max_entries фрагментов."""
+        from app.utils.fragment_cache import LocalFragmentBackend
+
+        backend = LocalFragmentBackend(2)
+        backend.set("a", "1", 60)
+        backend.set("b", "2", 60)
+        assert backend.get("a") == "1"
+        backend.set("c", "3", 60)
+        assert backend.get("b") is None
+        assert backend.get("a") == "1"
+        assert backend.get("c") == "3"
+
+
 class TestYooKassaService:
     """Тесты для YooKassa платежной системы."""
 
@@ -179,3 +814,245 @@ class TestYooKassaService:
 
             result = service.process_successful_payment("fake_payment_id")
             assert isinstance(result, bool)
+
+    def test_client_retries_with_same_idempotence_key(self, app):
+        """Тест: повтор после 503 идет с тем же Idempotence-Key."""
+        from app.utils.yookassa_client import YooKassaClient
+
+        with app.app_context():
+            client = YooKassaClient(
+                "https://api.example.com/v3", "shop", "secret", backoff_base=0
+            )
+            responses = [Mock(status_code=503), Mock(status_code=200)]
+            with patch.object(
+                client.session, "request", side_effect=responses
+            ) as request:
+                response = client.request("POST", "payments", {"amount": 1})
+
+            assert response.status_code == 200
+            assert request.call_count == 2
+            keys = {
+                call.kwargs["headers"]["Idempotence-Key"]
+                for call in request.call_args_list
+            }
+            assert len(keys) == 1
+            assert request.call_args.kwargs["timeout"] == client.timeout
+
+    def test_client_circuit_fails_fast(self, app):
+        """Тест: после серии сбоев запросы не отправляются до истечения паузы."""
+        import requests
+
+        from app.utils.yookassa_client import CircuitOpenError, YooKassaClient
+
+        with app.app_context():
+            client = YooKassaClient(
+                "https://api.example.com/v3",
+                "shop",
+                "secret",
+                max_retries=0,
+                breaker_threshold=2,
+                breaker_cooldown=60,
+            )
+            with patch.object(
+                client.session,
+                "request",
+                side_effect=requests.exceptions.ConnectionError("down"),
+            ) as request:
+                for _ in range(2):
+                    with pytest.raises(requests.exceptions.ConnectionError):
+                        client.request("GET", "payments/1")
+                assert client.is_open
+                with pytest.raises(CircuitOpenError):
+                    client.request("GET", "payments/1")
+            assert request.call_count == 2
+
+            client._opened_until = 0.0
+            with patch.object(
+                client.session, "request", return_value=Mock(status_code=200)
+            ):
+                assert client.request("GET", "payments/1").status_code == 200
+            assert not client.is_open
+
+
+class TestPaymentStatusLookup:
+    """Тесты для кэшированной проверки статуса платежа."""
+
+    def _create_payment(self, payment_id, status):
+        from app import db
+        from app.models import Payment, User
+
+        user = User(
+            username=f"payer_{payment_id}",
+            email=f"{payment_id}@example.com",
+            password="x",
+        )
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(
+            Payment(
+                user_id=user.id,
+                yookassa_payment_id=payment_id,
+                amount=89,
+                status=status,
+            )
+        )
+        db.session.commit()
+
+    def test_terminal_status_served_from_db(self, app):
+        """Тест: завершенный платеж не запрашивается у ЮKassa."""
+        keys = {"YOOKASSA_SHOP_ID": "shop", "YOOKASSA_SECRET_KEY": "secret"}
+        with app.app_context(), patch.dict(app.config, keys):
+            self._create_payment("paid-1", "succeeded")
+            service = YooKassaService()
+            with patch.object(YooKassaService, "_make_api_request") as api:
+                status = service.get_payment_status("paid-1")
+            api.assert_not_called()
+            assert status["status"] == "succeeded"
+            assert status["paid"]
+
+    def test_concurrent_lookups_share_one_call(self, app):
+        """Тест: параллельные проверки одного платежа делают один вызов API."""
+        import threading
+        import time
+
+        from app.models import Payment
+
+        calls = []
+        results = []
+
+        def fake_api(self, endpoint, method="GET", data=None, idempotence_key=None):
+            calls.append(endpoint)
+            time.sleep(0.2)
+            return {"id": "pending-1", "status": "waiting_for_capture"}
+
+        def lookup():
+            with app.app_context():
+                results.append(YooKassaService().get_payment_status("pending-1"))
+
+        keys = {"YOOKASSA_SHOP_ID": "shop", "YOOKASSA_SECRET_KEY": "secret"}
+        with patch.dict(app.config, keys), patch.object(
+            YooKassaService, "_make_api_request", fake_api
+        ):
+            with app.app_context():
+                self._create_payment("pending-1", "pending")
+            threads = [threading.Thread(target=lookup) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with app.app_context():
+                YooKassaService().get_payment_status("pending-1")
+                record = Payment.query.filter_by(yookassa_payment_id="pending-1").one()
+                assert record.status == "waiting_for_capture"
+
+        assert calls == ["payments/pending-1"]
+        assert [result["status"] for result in results] == ["waiting_for_capture"] * 5
+
+
+class TestSubscriptionState:
+    """Тесты для денормализованного состояния подписки."""
+
+    def _create_user(self, username, **fields):
+        from app import db
+        from app.models import User
+
+        user = User(
+            username=username, email=f"{username}@example.com", password="x", **fields
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def test_check_is_pure(self, app):
+        """Тест: проверка подписки не делает запросов и не пишет в БД."""
+        from datetime import datetime, timedelta
+
+        from sqlalchemy import event
+
+        from app import db
+
+        with app.app_context():
+            user = self._create_user(
+                "trial_user",
+                is_trial_subscription=True,
+                trial_subscription_expires=datetime.utcnow() + timedelta(days=3),
+            )
+            expired = self._create_user(
+                "expired_user",
+                is_subscribed=True,
+                is_manual_subscription=True,
+                subscription_expires=datetime.utcnow() - timedelta(days=1),
+            )
+            assert user.effective_subscription_expires == (
+                user.trial_subscription_expires
+            )
+            db.session.refresh(user)
+            db.session.refresh(expired)
+
+            statements = []
+
+            def count(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                service = YooKassaService()
+                assert service.check_user_subscription(user)
+                assert service.get_subscription_info(user)["type"] == "trial"
+                assert not service.check_user_subscription(expired)
+                assert service.get_subscription_info(expired)["type"] == "none"
+                assert expired.is_subscribed
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+            assert statements == []
+
+    def test_sweeper_expires_in_bulk(self, app):
+        """Тест: периодическая задача сбрасывает истекшие подписки."""
+        from datetime import datetime, timedelta
+
+        from app.models import BackgroundJob, User
+        from app.utils.job_queue import JobQueue
+        from app.utils.subscription_state import EXPIRE_SUBSCRIPTIONS_JOB
+
+        with app.app_context():
+            past = datetime.utcnow() - timedelta(days=1)
+            for index in range(3):
+                self._create_user(
+                    f"expired_{index}",
+                    is_subscribed=True,
+                    is_manual_subscription=True,
+                    subscription_expires=past,
+                )
+            active = self._create_user(
+                "active_user",
+                is_subscribed=True,
+                is_manual_subscription=True,
+                subscription_expires=datetime.utcnow() + timedelta(days=1),
+            )
+            unpaid = self._create_user(
+                "unpaid_user",
+                is_subscribed=True,
+                subscription_expires=datetime.utcnow() + timedelta(days=1),
+            )
+            active_id, unpaid_id = active.id, unpaid.id
+
+            JobQueue.schedule_periodic()
+            assert JobQueue.schedule_periodic() == 0
+            JobQueue.run_pending("test-worker")
+
+            job = BackgroundJob.query.filter_by(kind=EXPIRE_SUBSCRIPTIONS_JOB).one()
+            assert job.status == JobQueue.STATUS_DONE
+            assert JobQueue.get_result(job) == {"expired": 4}
+            subscribed = User.query.filter(
+                User.effective_subscription_expires.isnot(None)
+            ).all()
+            assert [user.id for user in subscribed] == [active_id]
+            assert not User.query.get(unpaid_id).is_subscribed
+
+            JobQueue.schedule_periodic()
+            pending = BackgroundJob.query.filter_by(
+                kind=EXPIRE_SUBSCRIPTIONS_JOB, status=JobQueue.STATUS_PENDING
+            ).one()
+            assert pending.run_after >= job.finished_at + timedelta(
+                seconds=JobQueue.get_interval(EXPIRE_SUBSCRIPTIONS_JOB)
+            )
@@ -130,6 +130,27 @@ class TestAuthenticatedViews:
 
             assert response.status_code == 200
 
+    def test_subject_detail_without_group(self, client, app):
+        """Тест сообщения пользователю без группы."""
+        from urllib.parse import unquote_plus
+
+        with app.app_context():
+            user = User(
+                username=f"nogroup_{uuid.uuid4()}",
+                email=f"nogroup_{uuid.uuid4()}@gmail.com",
+                password="test",
+            )
+            subject = Subject(title="Grouped Subject")
+            db.session.add_all([user, subject])
+            db.session.commit()
+            user_id, subject_id = user.id, subject.id
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+
+        response = client.get(f"/subject/{subject_id}")
+        assert response.status_code == 302
+        assert "не назначена группа" in unquote_plus(response.headers["Location"])
+
     def test_material_detail_requires_login(self, client, app):
         """Тест что детали материала требуют входа."""
         with app.app_context():
@@ -178,3 +199,412 @@ class TestStaticRoutes:
         """Тест обработки неизвестного кода ошибки."""
         response = client.get("/error/999")
         assert response.status_code == 999
+
+
+class TestUploadApi:
+    """Тесты возобновляемой загрузки файлов частями."""
+
+    def test_resumable_upload_and_submit(self, client, app, tmp_path):
+        """Тест загрузки частями, возобновления и отправки решения по upload_id."""
+        import hashlib
+        import os
+
+        from app.models import Submission
+        from app.services import MaterialService
+
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        payload = os.urandom(300 * 1024)
+        with app.app_context():
+            user = User(
+                username=f"uploader_{uuid.uuid4()}",
+                email=f"up_{uuid.uuid4()}@gmail.com",
+                password="test",
+            )
+            subject = Subject(title="Upload Subject")
+            db.session.add_all([user, subject])
+            db.session.commit()
+            material = Material(title="Task", type="assignment", subject_id=subject.id)
+            db.session.add(material)
+            db.session.commit()
+            user_id, material_id, subject_id = user.id, material.id, subject.id
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+
+        response = client.post(
+            "/api/uploads", json={"filename": "answer.zip", "size": len(payload)}
+        )
+        assert response.status_code == 201
+        upload_id = response.get_json()["upload_id"]
+        patch_headers = {"Content-Type": "application/offset+octet-stream"}
+
+        response = client.patch(
+            f"/api/uploads/{upload_id}",
+            data=payload[:100000],
+            headers={**patch_headers, "Upload-Offset": "0"},
+        )
+        assert response.status_code == 204
+        assert response.headers["Upload-Offset"] == "100000"
+
+        response = client.patch(
+            f"/api/uploads/{upload_id}",
+            data=payload[:10],
+            headers={**patch_headers, "Upload-Offset": "0"},
+        )
+        assert response.status_code == 409
+
+        response = client.head(f"/api/uploads/{upload_id}")
+        assert response.headers["Upload-Offset"] == "100000"
+
+        response = client.post(f"/api/uploads/{upload_id}/finalize", json={})
+        assert response.status_code == 400
+
+        response = client.patch(
+            f"/api/uploads/{upload_id}",
+            data=payload[100000:],
+            headers={**patch_headers, "Upload-Offset": "100000"},
+        )
+        assert response.status_code == 204
+
+        sha256 = hashlib.sha256(payload).hexdigest()
+        response = client.post(
+            f"/api/uploads/{upload_id}/finalize", json={"sha256": sha256}
+        )
+        assert response.status_code == 200
+        assert response.get_json()["sha256"] == sha256
+
+        with app.app_context():
+            material = db.session.get(Material, material_id)
+            assert MaterialService.submit_solution(
+                material, user_id, upload_id=upload_id
+            )
+            submission = Submission.query.filter_by(user_id=user_id).first()
+            full_path = os.path.join(str(tmp_path), submission.file)
+            with open(full_path, "rb") as f:
+                assert f.read() == payload
+            assert submission.file.startswith(f"{subject_id}/users/{user_id}/")
+            assert not MaterialService.submit_solution(
+                material, user_id, upload_id=upload_id
+            )
+
+    def test_concurrent_patches_at_same_offset(self, client, app, tmp_path):
+        """Тест: из двух одновременных PATCH с одним смещением второй получает 409."""
+        import io
+        import threading
+
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        with app.app_context():
+            user = User(
+                username=f"uploader_{uuid.uuid4()}",
+                email=f"up_{uuid.uuid4()}@gmail.com",
+                password="test",
+            )
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+        response = client.post(
+            "/api/uploads", json={"filename": "answer.zip", "size": 200}
+        )
+        upload_id = response.get_json()["upload_id"]
+        patch_headers = {
+            "Content-Type": "application/offset+octet-stream",
+            "Upload-Offset": "0",
+        }
+
+        started = threading.Event()
+        release = threading.Event()
+
+        class SlowStream(io.BytesIO):
+            def readinto(self, buffer):
+                if self.tell() == 50:
+                    started.set()
+                    release.wait(10)
+                return super().readinto(memoryview(buffer)[:50])
+
+        first_client = app.test_client()
+        with first_client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+        results = {}
+
+        def slow_patch():
+            results["first"] = first_client.patch(
+                f"/api/uploads/{upload_id}",
+                input_stream=SlowStream(b"a" * 100),
+                headers=patch_headers,
+            )
+
+        thread = threading.Thread(target=slow_patch)
+        thread.start()
+        try:
+            assert started.wait(10)
+            response = client.patch(
+                f"/api/uploads/{upload_id}", data=b"b" * 100, headers=patch_headers
+            )
+            assert response.status_code == 409
+        finally:
+            release.set()
+            thread.join(10)
+        assert results["first"].status_code == 204
+
+        response = client.head(f"/api/uploads/{upload_id}")
+        assert response.headers["Upload-Offset"] == "100"
+        response = client.patch(
+            f"/api/uploads/{upload_id}",
+            data=b"c" * 100,
+            headers={**patch_headers, "Upload-Offset": "100"},
+        )
+        assert response.status_code == 204
+        with app.app_context():
+            from app.models import UploadSession
+            from app.services import UploadService
+
+            upload = db.session.get(UploadSession, upload_id)
+            with open(UploadService.get_part_path(upload), "rb") as f:
+                assert f.read() == b"a" * 100 + b"c" * 100
+
+
+class TestSubmissionExport:
+    """Тесты выгрузки решений всех студентов для преподавателя."""
+
+    def test_export_subject_submissions(self, client, app, tmp_path):
+        """Тест архива решений по предмету с манифестом сдавших и не сдавших."""
+        import csv
+        import io
+        import os
+        import zipfile
+
+        from app.models import SubjectGroup, Submission
+
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        with app.app_context():
+            group = Group(name=f"group_{uuid.uuid4()}")
+            subject = Subject(title="Химия")
+            db.session.add_all([group, subject])
+            db.session.commit()
+            db.session.add(SubjectGroup(subject_id=subject.id, group_id=group.id))
+            users = {}
+            for name in ("teacher", "alice", "bob"):
+                users[name] = User(
+                    username=f"{name}_{uuid.uuid4().hex[:6]}",
+                    email=f"{name}_{uuid.uuid4()}@gmail.com",
+                    password="test",
+                    group_id=group.id,
+                    is_moderator=name == "teacher",
+                )
+            db.session.add_all(users.values())
+            material = Material(
+                title="Лабораторная 1", type="assignment", subject_id=subject.id
+            )
+            db.session.add(material)
+            db.session.commit()
+            relative_path = f"{subject.id}/users/{users['alice'].id}/lab1.txt"
+            full_path = os.path.join(str(tmp_path), relative_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                f.write(b"alice answer")
+            db.session.add(
+                Submission(
+                    user_id=users["alice"].id,
+                    material_id=material.id,
+                    file=relative_path,
+                )
+            )
+            db.session.commit()
+            subject_id, material_id = subject.id, material.id
+            teacher_id, student_id = users["teacher"].id, users["bob"].id
+            alice, bob = users["alice"].username, users["bob"].username
+
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(student_id)
+        response = client.get(f"/subject/{subject_id}/export-submissions")
+        assert response.status_code == 302
+
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(teacher_id)
+        response = client.get(f"/subject/{subject_id}/export-submissions")
+        assert response.status_code == 200
+        assert response.mimetype == "application/zip"
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zip_file:
+            assert (
+                zip_file.read(f"{alice}/Лабораторная_1_{material_id}/lab1.txt")
+                == b"alice answer"
+            )
+            manifest = zip_file.read("MANIFEST.csv").decode("utf-8-sig")
+        rows = {row[1]: row for row in csv.reader(io.StringIO(manifest))}
+        assert rows[alice][2] == "сдано"
+        assert rows[bob][2] == "не сдано"
+
+        response = client.get(f"/material/{material_id}/export-submissions")
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zip_file:
+            assert zip_file.read(f"{alice}/lab1.txt") == b"alice answer"
+
+
+class TestSolutionsExportJob:
+    """Тесты фоновой сборки архива решений пользователя."""
+
+    def test_export_solutions_runs_in_background(self, client, app, tmp_path):
+        """Тест: архив собирается задачей, ссылка приходит в уведомлении."""
+        import io
+        import os
+        import zipfile
+
+        from app.models import Notification, Submission
+        from app.utils.job_queue import JobQueue
+
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        with app.app_context():
+            subject = Subject(title="Биология")
+            users = [
+                User(
+                    username=f"student_{uuid.uuid4().hex[:6]}",
+                    email=f"student_{uuid.uuid4()}@gmail.com",
+                    password="test",
+                )
+                for _ in range(2)
+            ]
+            db.session.add_all([subject, *users])
+            db.session.commit()
+            material = Material(title="Клетка", type="assignment", subject_id=subject.id)
+            db.session.add(material)
+            db.session.commit()
+            relative_path = f"{subject.id}/users/{users[0].id}/cell.txt"
+            full_path = os.path.join(str(tmp_path), relative_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                f.write(b"cell answer")
+            db.session.add(
+                Submission(
+                    user_id=users[0].id, material_id=material.id, file=relative_path
+                )
+            )
+            db.session.commit()
+            owner_id, other_id = users[0].id, users[1].id
+
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(owner_id)
+        headers = {"Accept": "application/json"}
+        data = client.get("/export-solutions", headers=headers).get_json()
+        assert data["success"] and data["status"] == "pending"
+        repeated = client.get("/export-solutions", headers=headers).get_json()
+        assert repeated["job_id"] == data["job_id"]
+
+        with app.app_context():
+            assert JobQueue.run_pending() == 1
+            notification = Notification.query.filter_by(user_id=owner_id).one()
+            download_url = notification.link
+
+        status = client.get(data["status_url"]).get_json()
+        assert status["status"] == "done" and status["progress"] == 100
+        assert status["download_url"] == download_url
+        response = client.get(download_url)
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zip_file:
+            assert zip_file.read("Биология/cell.txt") == b"cell answer"
+
+        cached = client.get("/export-solutions", headers=headers).get_json()
+        assert cached["status"] == "done" and "job_id" not in cached
+
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(other_id)
+        assert client.get(data["status_url"]).status_code == 404
+        assert client.get(download_url).status_code == 302
+
+
+class TestPaymentWebhook:
+    """Тесты для входящей очереди уведомлений ЮKassa."""
+
+    def test_redelivered_webhook_applied_once(self, client, app):
+        """Тест: повторная доставка не продлевает подписку второй раз."""
+        import json
+
+        from app.models import Payment, PaymentWebhookEvent
+        from app.utils.job_queue import JobQueue
+
+        with app.app_context():
+            user = User(username="webhook_user", email="webhook@example.com")
+            user.password = "x"
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(
+                Payment(user_id=user.id, yookassa_payment_id="wh-1", amount=89)
+            )
+            db.session.commit()
+            user_id = user.id
+
+        body = json.dumps(
+            {
+                "event": "payment.succeeded",
+                "object": {"id": "wh-1", "status": "succeeded", "paid": True},
+            }
+        )
+        for _ in range(2):
+            response = client.post(
+                "/payment/webhook", data=body, content_type="application/json"
+            )
+            assert response.status_code == 200
+
+        with app.app_context():
+            assert PaymentWebhookEvent.query.count() == 1
+            assert Payment.query.one().status == "pending"
+
+            JobQueue.run_pending("test-worker")
+            inbox_event = PaymentWebhookEvent.query.one()
+            assert inbox_event.status == "processed"
+            user = db.session.get(User, user_id)
+            assert user.has_active_subscription()
+            expires = user.subscription_expires
+
+            client.post(
+                "/payment/webhook",
+                data=json.dumps(
+                    {
+                        "event": "payment.waiting_for_capture",
+                        "object": {"id": "wh-1", "status": "waiting_for_capture"},
+                    }
+                ),
+                content_type="application/json",
+            )
+            JobQueue.run_pending("test-worker")
+            db.session.expire_all()
+            assert Payment.query.one().status == "succeeded"
+            assert db.session.get(User, user_id).subscription_expires == expires
+
+    def test_status_poll_does_not_preempt_activation(self, client, app):
+        """Тест: опрос статуса не мешает webhook активировать подписку."""
+        import json
+        from unittest.mock import patch
+
+        from app.models import Payment
+        from app.utils.job_queue import JobQueue
+        from app.utils.payment_service import YooKassaService
+
+        keys = {"YOOKASSA_SHOP_ID": "shop", "YOOKASSA_SECRET_KEY": "secret"}
+        with app.app_context(), patch.dict(app.config, keys):
+            user = User(username="poll_user", email="poll@example.com")
+            user.password = "x"
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(
+                Payment(user_id=user.id, yookassa_payment_id="wh-2", amount=89)
+            )
+            db.session.commit()
+            user_id = user.id
+
+            succeeded = {"id": "wh-2", "status": "succeeded", "paid": True}
+            with patch.object(
+                YooKassaService, "_make_api_request", return_value=succeeded
+            ):
+                status = YooKassaService().get_payment_status("wh-2")
+            assert status["status"] == "succeeded"
+            assert Payment.query.one().status == "pending"
+
+            client.post(
+                "/payment/webhook",
+                data=json.dumps({"event": "payment.succeeded", "object": succeeded}),
+                content_type="application/json",
+            )
+            JobQueue.run_pending("test-worker")
+            db.session.expire_all()
+            assert Payment.query.one().status == "succeeded"
+            assert db.session.get(User, user_id).has_active_subscription()
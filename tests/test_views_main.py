@@ -1,5 +1,9 @@
 """Тесты для main views - минимальный набор."""
 
+import os
+
+from app.utils.file_storage import FileStorageManager
+
 
 class TestMainViews:
     """Тесты для основных представлений."""
@@ -8,3 +12,246 @@ class TestMainViews:
         """Тест главной страницы без авторизации."""
         response = client.get("/")
         assert response.status_code == 200
+
+    def test_serve_file_uses_index(self, client, app, tmp_path):
+        """Тест отдачи файла материала через индекс расположения."""
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        with app.app_context():
+            full_path, _ = FileStorageManager.get_subject_upload_path(
+                4, 12, "report.pdf"
+            )
+        with open(full_path, "wb") as f:
+            f.write(b"%PDF-1.4 test")
+
+        response = client.get("/files/4/report.pdf")
+        assert response.status_code == 200
+        assert response.data == b"%PDF-1.4 test"
+
+        with app.app_context():
+            from app.utils.file_index import FileIndex
+            from app.utils.job_queue import JobQueue
+
+            assert FileIndex.resolve(4, "report.pdf") is None
+            assert JobQueue.run_pending("test-worker") == 1
+            assert FileIndex.resolve(4, "report.pdf") == full_path
+
+        os.remove(full_path)
+        response = client.get("/files/4/report.pdf")
+        assert response.status_code in (302, 404)
+
+    def test_serve_file_offload_modes(self, client, app, tmp_path):
+        """Тест передачи отдачи файла обратному прокси."""
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        with app.app_context():
+            full_path, _ = FileStorageManager.get_material_upload_path(5, "big.pdf")
+        with open(full_path, "wb") as f:
+            f.write(b"%PDF-1.4 big")
+
+        app.config["FILE_OFFLOAD_MODE"] = "x-accel-redirect"
+        response = client.get("/files/5/big.pdf")
+        assert response.status_code == 200
+        assert response.data == b""
+        assert response.headers["X-Accel-Redirect"] == "/protected-uploads/5/big.pdf"
+        assert response.headers["Content-Type"] == "application/pdf"
+        assert "big.pdf" in response.headers["Content-Disposition"]
+
+        app.config["FILE_OFFLOAD_MODE"] = "x-sendfile"
+        response = client.get("/files/5/big.pdf")
+        assert response.headers["X-Sendfile"] == full_path
+
+        app.config["FILE_OFFLOAD_MODE"] = ""
+        response = client.get("/files/5/big.pdf")
+        assert "X-Accel-Redirect" not in response.headers
+        assert response.data == b"%PDF-1.4 big"
+
+    def test_serve_file_range_and_user_file(self, client, app, tmp_path):
+        """Тест отдачи диапазона и файла решения пользователя."""
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        payload = bytes(range(256)) * 1024
+        with app.app_context():
+            material_path, _ = FileStorageManager.get_material_upload_path(
+                6, "lecture.pdf"
+            )
+            user_path, _ = FileStorageManager.get_subject_upload_path(
+                6, 3, "answer.txt"
+            )
+        for path in (material_path, user_path):
+            with open(path, "wb") as f:
+                f.write(payload)
+
+        response = client.get("/files/6/lecture.pdf", headers={"Range": "bytes=10-99"})
+        assert response.status_code == 206
+        assert response.data == payload[10:100]
+        assert response.headers["Content-Range"] == f"bytes 10-99/{len(payload)}"
+
+        response = client.get("/files/6/users/3/answer.txt")
+        assert response.status_code == 200
+        assert response.data == payload
+        assert response.headers["Content-Length"] == str(len(payload))
+
+    def test_serve_file_range_with_server_file_wrapper(self, client, app, tmp_path):
+        """Тест диапазона под wsgi.file_wrapper, читающим файл до конца."""
+        from wsgiref.util import FileWrapper
+
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        payload = bytes(range(256)) * 1024
+        with app.app_context():
+            full_path, _ = FileStorageManager.get_material_upload_path(
+                8, "notes.pdf"
+            )
+        with open(full_path, "wb") as f:
+            f.write(payload)
+        environ = {"wsgi.file_wrapper": FileWrapper}
+
+        response = client.get(
+            "/files/8/notes.pdf",
+            headers={"Range": "bytes=1000-70999"},
+            environ_base=environ,
+        )
+        assert response.status_code == 206
+        assert response.data == payload[1000:71000]
+        assert response.headers["Content-Length"] == "70000"
+
+        response = client.get("/files/8/notes.pdf", environ_base=environ)
+        assert response.data == payload
+
+    def test_serve_file_conditional_get(self, client, app, tmp_path):
+        """Тест ETag/Last-Modified, ответа 304 и If-Range."""
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        payload = b"0123456789" * 100
+        with app.app_context():
+            from app.utils.file_index import FileIndex
+
+            full_path, _ = FileStorageManager.get_material_upload_path(8, "exam.pdf")
+            with open(full_path, "wb") as f:
+                f.write(payload)
+            FileIndex.record(full_path)
+
+        response = client.get("/files/8/exam.pdf")
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+        assert response.status_code == 200
+        assert len(etag) == 66
+
+        response = client.get("/files/8/exam.pdf", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+        response = client.get(
+            "/files/8/exam.pdf", headers={"If-Modified-Since": last_modified}
+        )
+        assert response.status_code == 304
+        response = client.get("/files/8/exam.pdf", headers={"If-None-Match": '"other"'})
+        assert response.status_code == 200
+
+        response = client.get(
+            "/files/8/exam.pdf", headers={"Range": "bytes=0-9", "If-Range": etag}
+        )
+        assert response.status_code == 206
+        assert response.data == payload[:10]
+        response = client.get(
+            "/files/8/exam.pdf",
+            headers={"Range": "bytes=0-9", "If-Range": '"stale"'},
+        )
+        assert response.status_code == 200
+        assert response.data == payload
+
+    def test_serve_file_suffix_multipart_and_invalid_ranges(
+        self, client, app, tmp_path
+    ):
+        """Тест суффиксных, множественных и невыполнимых диапазонов."""
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        payload = bytes(range(256)) * 64
+        size = len(payload)
+        with app.app_context():
+            material_path, _ = FileStorageManager.get_material_upload_path(
+                9, "slides.pdf"
+            )
+            user_path, _ = FileStorageManager.get_subject_upload_path(9, 2, "work.pdf")
+        for path in (material_path, user_path):
+            with open(path, "wb") as f:
+                f.write(payload)
+
+        response = client.get("/files/9/slides.pdf", headers={"Range": "bytes=-100"})
+        assert response.status_code == 206
+        assert response.data == payload[-100:]
+        assert (
+            response.headers["Content-Range"] == f"bytes {size - 100}-{size - 1}/{size}"
+        )
+
+        response = client.get(
+            "/files/9/users/2/work.pdf", headers={"Range": "bytes=100-199"}
+        )
+        assert response.status_code == 206
+        assert response.data == payload[100:200]
+
+        response = client.get(
+            "/files/9/slides.pdf", headers={"Range": "bytes=0-9, 50-59, 5-12"}
+        )
+        assert response.status_code == 206
+        content_type = response.headers["Content-Type"]
+        assert content_type.startswith("multipart/byteranges; boundary=")
+        boundary = content_type.split("boundary=")[1]
+        assert response.headers["Content-Length"] == str(len(response.data))
+        parts = response.data.split(f"--{boundary}".encode())[1:-1]
+        assert len(parts) == 2
+        assert b"Content-Range: bytes 0-12/" in parts[0]
+        assert parts[0].endswith(b"\r\n\r\n" + payload[0:13] + b"\r\n")
+        assert parts[1].endswith(b"\r\n\r\n" + payload[50:60] + b"\r\n")
+
+        response = client.get(
+            "/files/9/slides.pdf", headers={"Range": f"bytes={size}-"}
+        )
+        assert response.status_code == 416
+        assert response.headers["Content-Range"] == f"bytes */{size}"
+
+        response = client.get("/files/9/slides.pdf", headers={"Range": "bytes=9-2"})
+        assert response.status_code == 200
+        assert response.data == payload
+
+    def test_serve_image_webp_negotiation(self, client, app, tmp_path):
+        """Тест выбора WebP-версии по Accept и миниатюры по ?thumbnail=1."""
+        import io
+
+        from PIL import Image
+
+        from app.utils.file_index import FileIndex
+        from app.utils.image_variants import ImageVariants
+
+        app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        with app.app_context():
+            full_path, _ = FileStorageManager.get_material_upload_path(
+                11, "screen.png"
+            )
+            image = Image.new("RGB", (800, 600), "white")
+            image.paste((30, 90, 200), (100, 100, 500, 300))
+            image.save(full_path, format="PNG")
+            FileIndex.record(full_path)
+            sha256 = FileIndex.get_metadata(full_path).sha256
+            assert ImageVariants.build(full_path, sha256)
+
+        response = client.get("/files/11/screen.png")
+        assert response.headers["Content-Type"] == "image/png"
+        assert "Accept" in response.headers["Vary"]
+
+        with open(full_path, "rb") as f:
+            original = f.read()
+        for accept in ("*/*", "image/*", "image/webp;q=0, */*"):
+            response = client.get("/files/11/screen.png", headers={"Accept": accept})
+            assert response.headers["Content-Type"] == "image/png"
+            assert response.data == original
+            assert "screen.png" in response.headers["Content-Disposition"]
+
+        response = client.get(
+            "/files/11/screen.png", headers={"Accept": "image/webp,*/*"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/webp"
+        assert response.headers["ETag"] == f'"{sha256}-webp"'
+        assert "screen.webp" in response.headers["Content-Disposition"]
+        with Image.open(io.BytesIO(response.data)) as webp:
+            assert webp.size == (800, 600)
+
+        response = client.get("/files/11/screen.png?thumbnail=1")
+        assert response.headers["Content-Type"] == "image/webp"
+        with Image.open(io.BytesIO(response.data)) as thumbnail:
+            assert max(thumbnail.size) <= 320